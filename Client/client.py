@@ -1,28 +1,55 @@
 import socket
 import rsa
-from cryptography import fernet
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey, X25519PublicKey
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
 
 import os
 import json
 import re
+import time
+import queue
 import hashlib
+import itertools
+from threading import Thread, Lock, Event
 
-from typing import Any
+from typing import Any, BinaryIO, Callable
 from exceptions import *
+from framing import FrameReader, send_frame
+from record_layer import RecordLayer, PlaintextRecordLayer, CIPHER_SUITES, PLAINTEXT, PACKAGE_RECORD, CHUNK_RECORD, derive_keys
 
 PATH = os.path.dirname(os.path.realpath(__file__))
+CHUNK_SIZE = 64 * 1024 #64 KB
+TICKET_PATH = PATH + '\\session_ticket.json'
+REQUEST_QUEUE_SIZE = 64 #records buffered per request, bounds memory of downloads when disk is slower than the network
+MIN_STRIPE_SIZE = 1024 * 1024 #1 MB, smaller files are downloaded through a single connection
 class Client:
-    def __init__(self, addr):
+    def __init__(self, addr, session_ticket: dict | None = None):
         '''
         Creates a client socket to communicate with the server and manage package formatting
 
         Args:
-            addr: Server's address
+            addr: Server's address, or the path of its local listener (Unix domain socket) when running on the same host
+            session_ticket [dict | None = None]: Session ticket of a logged-in client, makes this a data connection joining that client's session (see open_data_connections)
 
         Returns:
             None
         '''
-        self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.addr = addr
+        self.is_data_connection = session_ticket is not None
+        self.session_ticket = session_ticket if self.is_data_connection else self.load_session_ticket()
+        self.resumed_username = None
+
+        self.request_ids = itertools.count(1)
+        self.send_lock = Lock()
+        self.accepted_uploads: dict[str, tuple[int, dict]] = {}
+        #uploads the server staged, kept so an interrupted upload of an unchanged file can be resumed
+        self.unfinished_uploads: dict[str, dict] = {}
+        self.accepted_downloads: dict[tuple[str, str], tuple[int, dict | None, int]] = {}
+        #downloads cut off by a lost connection, kept so the rest of the file can be requested as a byte range
+        self.unfinished_downloads: dict[tuple[str, str], dict] = {}
+        #transfers the server queued (position and estimated start time), by request id
+        self.queued_requests: dict[int, dict] = {}
         self.connect_to_server(addr)
 
     def send_login_package(self, username: str, password: str) -> tuple[bool, list | str]:
@@ -81,38 +108,76 @@ class Client:
         }
         return self.send_and_receive(package, 'logout_response')
     
-    def send_upload_request(self, file_path: str, is_public: bool) -> tuple[bool, str]:
+    def send_upload_request(self, file_path: str, is_public: bool, stripes: int = 1, urgent: bool = False) -> tuple[bool, str]:
         '''
-        Send an upload request to the server
+        Send an upload request to the server. If an earlier upload of the same (unchanged) file was interrupted, the server is asked to resume it instead
 
         Args:
             file_path [str]: Path to the file
             is_public [bool]: Upload as public or private file
+            stripes [int = 1]: Amount of stripes to split the file into, to send them in parallel (the server might split it into less)
+            urgent [bool = False]: Mark the upload as urgent, so a busy server starts it sooner
 
         Returns:
-            [tuple[bool, str]]: Tuple containing 2 elements, first indicating whether the upload request was approved or not, second will be a rejection string ("" if successful)
+            [tuple[bool, dict | str]]: Tuple containing 2 elements, first indicating whether the upload request was approved or not, second will be a dict containing the upload id, the offset to upload from and the stripes' byte ranges if approved, else will be a rejection string
         '''
         if not os.path.isfile(file_path):
             return (False, 'File doesn\'t exist')
         
-        file_size = os.path.getsize(file_path)
+        file_stat = os.stat(file_path)
+        unfinished = self.unfinished_uploads.pop(file_path, None)
+        if (unfinished is not None) and ((unfinished['file-size-bytes'], unfinished['modified-time']) == (file_stat.st_size, file_stat.st_mtime_ns)):
+            package = {
+                'type': 'upload_resume',
+                'upload-id': unfinished['upload-id'],
+                'stripes': stripes
+            }
+            if urgent:
+                package['urgent'] = True
+            request_id = self.open_request()
+            accepted, response = self.send_and_receive(package, 'upload_resume_response', request_id)
+            if accepted:
+                self.unfinished_uploads[file_path] = unfinished
+                self.accepted_uploads[file_path] = (request_id, response)
+                return (accepted, response)
+
+            #the staged upload is gone, start over
+            self.close_request(request_id)
+
         package = {
             'type': 'upload_request',
             'file-data': {
                 'file-name': file_path.rsplit('\\')[-1],
-                'file-size-bytes': file_size,
+                'file-size-bytes': file_stat.st_size,
                 'is-public': is_public
-            }
+            },
+            'stripes': stripes
         }
-        return self.send_and_receive(package, 'upload_request_response')
+        if urgent:
+            package['urgent'] = True
+        request_id = self.open_request()
+        accepted, response = self.send_and_receive(package, 'upload_request_response', request_id)
+        if accepted:
+            #the file's chunks are sent in the same request by upload_file()
+            self.unfinished_uploads[file_path] = {
+                'upload-id': response['upload-id'],
+                'file-size-bytes': file_stat.st_size,
+                'modified-time': file_stat.st_mtime_ns
+            }
+            self.accepted_uploads[file_path] = (request_id, response)
+        else:
+            self.close_request(request_id)
+
+        return (accepted, response)
         
-    def send_download_request(self, file_name: str, username: str) -> tuple[bool, str]:
+    def send_download_request(self, file_name: str, username: str, urgent: bool = False) -> tuple[bool, str]:
         '''
-        Send an download request to the server
+        Send an download request to the server. If an earlier download of the same file was cut off, only the rest of the file is requested
 
         Args:
             file_name [str]: Name of file to download
             username [str]: Username of file's uploader
+            urgent [bool = False]: Mark the download as urgent, so a busy server starts it sooner
 
         Returns:
             [tuple[bool, str]]: Tuple containing 2 elements, first indicating whether the download request was approved or not, second will be a rejection string ("" if successful)
@@ -122,7 +187,84 @@ class Client:
             'file-name': file_name,
             'username': username
         }
-        return self.send_and_receive(package, 'download_request_response')
+        if urgent:
+            package['urgent'] = True
+        unfinished = self.unfinished_downloads.pop((file_name, username), None)
+        if (unfinished is not None) and os.path.isfile(unfinished['part-path']):
+            package['ranges'] = [[os.path.getsize(unfinished['part-path']), None]]
+            package['resumed'] = True
+        else:
+            unfinished = None
+
+        request_id = self.open_request()
+        accepted, response = self.send_and_receive(package, 'download_request_response', request_id)
+        if accepted:
+            #the file is received in the same request by download_file()
+            self.accepted_downloads[(file_name, username)] = (request_id, unfinished, response)
+        else:
+            self.close_request(request_id)
+            if unfinished is not None:
+                os.remove(unfinished['part-path'])
+
+        return (accepted, response)
+
+    def read_file_ranges(self, file_name: str, username: str, ranges: list[tuple[int, int | None]]) -> list[bytes] | None:
+        '''
+        Read byte ranges of a file from the server (a file's header for a preview for example) without downloading the whole file
+
+        Args:
+            file_name [str]: Name of file to read from
+            username [str]: Username of file's uploader
+            ranges [list[tuple[int, int | None]]]: [start, end] byte ranges to read, end is exclusive or None for the end of the file
+
+        Returns:
+            [list[bytes] | None]: The bytes of each range the server sent (sorted, overlapping ranges are merged and ranges are cut at the end of the file), None if the read failed
+        '''
+        package = {
+            'type': 'download_request',
+            'file-name': file_name,
+            'username': username,
+            'ranges': [list(byte_range) for byte_range in ranges]
+        }
+        request_id = self.open_request()
+        try:
+            accepted, _ = self.send_and_receive(package, 'download_request_response', request_id)
+            if not accepted:
+                return None
+            
+            ready_package = {
+                'type': 'download_ready'
+            }
+            self.send_package(ready_package, request_id)
+            header_package = self.receive_package(request_id, 'download_start')
+
+            received = True
+            data = []
+            for start, end in header_package['ranges']:
+                range_data = bytearray()
+                while start + len(range_data) < end:
+                    kind, offset, chunk = self.receive_record(request_id)
+                    if (kind != CHUNK_RECORD) or (offset != start + len(range_data)) or (offset + len(chunk) > end):
+                        received = False
+                        break
+
+                    range_data += chunk
+
+                if not received:
+                    break
+                data.append(bytes(range_data))
+
+            final_package = {
+                'type': 'download_final',
+                'received': received
+            }
+            self.send_package(final_package, request_id)
+        except InvalidPackageException:
+            return None
+        finally:
+            self.close_request(request_id)
+
+        return data if received else None
     
     def send_file_publicity_change_request(self, file_name: str) -> tuple[bool, str]:
         '''
@@ -189,126 +331,558 @@ class Client:
         return self.send_and_receive(package, 'user_files')
 
 
-    def send_package(self, package: dict):
+    def reconnect(self):
+        '''
+        Opens a new connection to the server (after a network failure for example), resuming the logged-in session if a valid session ticket is held
+
+        Returns:
+            None
+
+        Raises:
+            ConnectionError: If the connection failed
+        '''
+        self.client_socket.close()
+        self.connect_to_server(self.addr)
+
+    def open_request(self) -> int:
+        '''
+        Allocate a request id and a queue that receives the server's records for it
+
+        Returns:
+            [int]: The request id
+
+        Raises:
+            ConnectionError: If the connection was already lost
+        '''
+        request_id = next(self.request_ids)
+        self.pending_requests[request_id] = queue.Queue(REQUEST_QUEUE_SIZE)
+        if self.connection_lost.is_set():
+            #nothing would ever wake this request up
+            self.pending_requests.pop(request_id)
+            raise ConnectionError
+
+        return request_id
+
+    def close_request(self, request_id: int):
+        '''
+        Release a request id, records arriving for it later are dropped. The records already queued for it are dropped too, so a reader waiting for room in its queue moves on to the other requests
+
+        Args:
+            request_id [int]: Request id to release
+
+        Returns:
+            None
+        '''
+        request_queue = self.pending_requests.pop(request_id, None)
+        self.queued_requests.pop(request_id, None)
+        if request_queue is not None:
+            #the reader puts at most one more record in the queue once it's no longer pending, so it never fills up again
+            while True:
+                try:
+                    request_queue.get_nowait()
+                except queue.Empty:
+                    break
+
+    def get_queue_status(self, transfer: str | tuple[str, str]) -> dict | None:
+        '''
+        Get where an accepted transfer waits in the server's transfer queue
+
+        Args:
+            transfer [str | tuple[str, str]]: Path of the file for an accepted upload, or (file name, uploader's username) for an accepted download
+
+        Returns:
+            [dict | None]: Dict containing the position in the queue and the estimated start time (as a timestamp), None if the transfer isn't queued
+        '''
+        accepted = self.accepted_uploads.get(transfer) if isinstance(transfer, str) else self.accepted_downloads.get(transfer)
+        if accepted is None:
+            return None
+
+        return self.queued_requests.get(accepted[0])
+
+    def send_package(self, package: dict, request_id: int):
         '''
         Send a package to the server
 
         Args:
             package [dict]: Package to send
+            request_id [int]: Id of the request the package belongs to
 
         Returns:
             None
         '''
         json_dump = json.dumps(package)
-        encrypted = self.endec.encrypt(json_dump.encode())
-        self.client_socket.send(encrypted)
+        encrypted = self.endec.seal(PACKAGE_RECORD, request_id, json_dump.encode())
+        with self.send_lock:
+            send_frame(self.client_socket, encrypted)
         print(f'Sent {package['type']} package')
 
-    def upload_file(self, file_path: str):
+    def send_chunk(self, chunk: bytes | memoryview, request_id: int, offset: int):
+        '''
+        Send a file chunk to the server
+
+        Args:
+            chunk [bytes | memoryview]: Chunk to send
+            request_id [int]: Id of the upload request the chunk belongs to
+            offset [int]: Offset of the chunk in the file
+
+        Returns:
+            None
+        '''
+        encrypted = self.endec.seal(CHUNK_RECORD, request_id, chunk, offset)
+        with self.send_lock:
+            send_frame(self.client_socket, encrypted)
+
+    def upload_file(self, file_path: str, data_connections: list['Client'] | None = None):
         '''
-        Upload a file to the server
+        Upload a file to the server, expected to be called after an accepted upload request for the same path. The file is read, encrypted and sent in chunks of CHUNK_SIZE bytes, starting from the offset the server asked for (once the server starts the upload, if it was queued)\n
+        If the server split the upload into stripes, the other stripes are sent in parallel through the given data connections (or through this connection if there are none)
 
         Args:
             file_path [str]: Path to file to upload
+            data_connections [list[Client] | None = None]: Data connections to send stripes through (see open_data_connections)
 
         Returns:
             [tuple[bool, dict | str]]: Tuple containing 2 elements, first indicating whether the upload was completed successfully or not, second will be a dict containing uploaded file's data (as determined by the server) if connected successfully, else will be a rejection string
         '''
-        with open(file_path, 'rb') as f:
-            file_data = f.read()
-        encrypted = self.endec.encrypt(file_data)
-        
-        header_package = {
-            'type': 'upload_start',
-            'encrypted-size': len(encrypted)
-        }
-        self.send_package(header_package)
-        self.client_socket.sendall(encrypted)
+        try:
+            request_id, upload = self.accepted_uploads.pop(file_path)
+        except KeyError:
+            return (False, 'Upload was not accepted')
 
         try:
-            response_package = self.receive_package('upload_final')
+            if request_id in self.queued_requests:
+                #the server sends upload_start once the upload can start
+                self.receive_package(request_id, 'upload_start')
         except InvalidPackageException:
+            self.close_request(request_id)
             return (False, 'Unexpected response package')
+
+        data_connections = data_connections or [self]
+        upload_done = Event()
+        upload_answered = lambda: upload_done.is_set() or (not self.pending_requests[request_id].empty())
+        stripe_threads = []
+        for index, (start, end) in enumerate(upload['stripes'][1:], 1):
+            connection = data_connections[(index - 1) % len(data_connections)]
+            stripe_thread = Thread(target=connection.send_stripe, args=(file_path, upload['upload-id'], index, start, end, upload_answered), daemon=True)
+            stripe_thread.start()
+            stripe_threads.append(stripe_thread)
+
+        try:
+            start, end = upload['stripes'][0]
+            self.send_file_range(file_path, request_id, start, end, upload_answered)
+
+            response_package = self.receive_package(request_id, 'upload_final')
+        except InvalidPackageException:
+            return (False, 'Unexpected response package')
+        finally:
+            upload_done.set()
+            for stripe_thread in stripe_threads:
+                stripe_thread.join()
+            self.close_request(request_id)
+
+        if response_package['accepted']:
+            self.unfinished_uploads.pop(file_path, None)
         
         return (response_package['accepted'], response_package['response'])
+
+    def send_stripe(self, file_path: str, upload_id: str, index: int, start: int, end: int, upload_answered: Callable[[], bool]) -> bool:
+        '''
+        Send a single stripe of a striped upload, expected to run in a different thread (usually on a data connection)
+
+        Args:
+            file_path [str]: Path to the file being uploaded
+            upload_id [str]: Id of the upload
+            index [int]: Index of the stripe
+            start [int]: Offset the stripe starts at
+            end [int]: Offset the stripe ends at (exclusive)
+            upload_answered [Callable[[], bool]]: Returns whether the server already answered the upload (stops sending early)
+
+        Returns:
+            [bool]: Whether the server accepted the stripe
+        '''
+        package = {
+            'type': 'upload_stripe',
+            'upload-id': upload_id,
+            'stripe': index
+        }
+        request_id = self.open_request()
+        try:
+            accepted, _ = self.send_and_receive(package, 'upload_stripe_response', request_id)
+            if accepted:
+                self.send_file_range(file_path, request_id, start, end, upload_answered)
+        except OSError:
+            #lost the data connection, the server fails the upload
+            accepted = False
+        finally:
+            self.close_request(request_id)
+
+        return accepted
+
+    def send_file_range(self, file_path: str, request_id: int, start: int, end: int, upload_answered: Callable[[], bool]):
+        '''
+        Send a byte range of a file as chunks, read through a single reused buffer. An empty range is still sent as a single empty chunk
+
+        Args:
+            file_path [str]: Path to the file
+            request_id [int]: Id of the request the chunks belong to
+            start [int]: Offset the range starts at
+            end [int]: Offset the range ends at (exclusive)
+            upload_answered [Callable[[], bool]]: Returns whether the server already answered the upload (stops sending early)
+
+        Returns:
+            None
+        '''
+        offset = start
+        buffer = bytearray(CHUNK_SIZE)
+        view = memoryview(buffer)
+        with open(file_path, 'rb') as f:
+            f.seek(offset)
+            while True:
+                count = f.readinto(view[:min(CHUNK_SIZE, end - offset)])
+                self.send_chunk(view[:count], request_id, offset)
+                offset += count
+                if (offset >= end) or (count == 0) or upload_answered():
+                    #done, or the server already answered (upload failed)
+                    break
     
-    def download_file(self, file_name: str):
+    def download_file(self, file_name: str, username: str, data_connections: list['Client'] | None = None):
         '''
-        Download a file from the server
+        Download a file from the server, expected to be called after an accepted download request for the same file. Tells the server the client is ready, then decrypts the file's chunks and writes them to ./downloads as they arrive\n
+        If the connection is lost, what was received is kept so the next download request for the file continues from it\n
+        If data connections are given, the file is split into stripes downloaded in parallel, the first through this connection and the rest through the data connections
 
         Args:
-            file_path [str]: Name of file to download
+            file_name [str]: Name of file to download
+            username [str]: Username of file's uploader
+            data_connections [list[Client] | None = None]: Data connections to download stripes through (see open_data_connections)
 
         Returns:
             [bool]: Was the file downloaded successfully
         '''
-        header_package = self.receive_package('download_start')
-        data = self.client_socket.recv(header_package['encrypted-size'])
-
         try:
-            file = self.endec.decrypt(data)
-        except fernet.InvalidToken:
-            file_received = False
+            request_id, unfinished, file_size = self.accepted_downloads.pop((file_name, username))
+        except KeyError:
+            return False
+
+        if unfinished is not None:
+            temp_path = unfinished['part-path']
         else:
-            file_received = True
+            base_name, extension = os.path.splitext(file_name)
+            temp_path = self.get_download_path(base_name, extension) + '.part'
 
-        final_package = {
-            'type': 'download_final',
-            'received': file_received
-        }
-        self.send_package(final_package)
+        #a cut off download is resumed through this connection only
+        stripe_count = 1 if (unfinished is not None) or (not data_connections) else max(1, min(len(data_connections) + 1, file_size // MIN_STRIPE_SIZE))
+        bounds = [file_size * i // stripe_count for i in range(stripe_count + 1)]
+
+        try:
+            ready_package = {
+                'type': 'download_ready'
+            }
+            if stripe_count > 1:
+                ready_package['ranges'] = [[bounds[0], bounds[1]]]
+                with open(temp_path, 'wb') as f:
+                    f.truncate(file_size)
+            self.send_package(ready_package, request_id)
+
+            try:
+                header_package = self.receive_package(request_id, 'download_start')
+            except InvalidPackageException:
+                return False
+
+            stripe_results = [False] * stripe_count
+            stripe_threads = []
+            for index in range(1, stripe_count):
+                connection = data_connections[index - 1]
+                stripe_thread = Thread(target=connection.download_stripe, args=(file_name, username, temp_path, bounds[index], bounds[index + 1], header_package['upload-time'], stripe_results, index), daemon=True)
+                stripe_thread.start()
+                stripe_threads.append(stripe_thread)
+
+            mode = 'r+b' if stripe_count > 1 else ('wb' if unfinished is None else 'ab')
+            with open(temp_path, mode) as f:
+                #the rest of a cut off download only fits if the file wasn't replaced since
+                file_received = (unfinished is None) or (unfinished['upload-time'] == header_package['upload-time'])
+                try:
+                    stripe_results[0] = file_received and self.receive_file_range(request_id, f, f.tell() if stripe_count == 1 else 0, bounds[1])
+                except ConnectionError:
+                    if stripe_count == 1:
+                        self.unfinished_downloads[(file_name, username)] = {
+                            'part-path': temp_path,
+                            'upload-time': header_package['upload-time']
+                        }
+                    raise
+
+            for stripe_thread in stripe_threads:
+                stripe_thread.join()
+            file_received = all(stripe_results)
+
+            final_package = {
+                'type': 'download_final',
+                'received': file_received
+            }
+            self.send_package(final_package, request_id)
+        finally:
+            self.close_request(request_id)
 
         if not file_received:
+            os.remove(temp_path)
             return False
         
-        base_name, extension = os.path.splitext(file_name)
-        self.save_file(base_name, extension, file)
+        os.replace(temp_path, temp_path.removesuffix('.part'))
         return True
 
-    def receive_package(self, expected_type: str = '') -> dict:
+    def download_stripe(self, file_name: str, username: str, temp_path: str, start: int, end: int, upload_time: int, results: list[bool], index: int):
+        '''
+        Download a single stripe of a striped download into the (already allocated) download file, expected to run in a different thread on a data connection
+
+        Args:
+            file_name [str]: Name of file to download
+            username [str]: Username of file's uploader
+            temp_path [str]: Path of the file being downloaded
+            start [int]: Offset the stripe starts at
+            end [int]: Offset the stripe ends at (exclusive)
+            upload_time [int]: Upload time of the file the other stripes come from, a replaced file fails the stripe
+            results [list[bool]]: Results of all stripes, the stripe's result is set at "index"
+            index [int]: Index of the stripe
+
+        Returns:
+            None
+        '''
+        package = {
+            'type': 'download_request',
+            'file-name': file_name,
+            'username': username,
+            'ranges': [[start, end]]
+        }
+        request_id = self.open_request()
+        try:
+            accepted, _ = self.send_and_receive(package, 'download_request_response', request_id)
+            if not accepted:
+                return
+
+            ready_package = {
+                'type': 'download_ready'
+            }
+            self.send_package(ready_package, request_id)
+            header_package = self.receive_package(request_id, 'download_start')
+
+            received = False
+            if header_package['upload-time'] == upload_time:
+                with open(temp_path, 'r+b') as f:
+                    received = self.receive_file_range(request_id, f, start, end)
+
+            final_package = {
+                'type': 'download_final',
+                'received': received
+            }
+            self.send_package(final_package, request_id)
+            results[index] = received
+        except (InvalidPackageException, ConnectionError):
+            pass
+        finally:
+            self.close_request(request_id)
+
+    def receive_file_range(self, request_id: int, f: BinaryIO, start: int, end: int) -> bool:
+        '''
+        Receive the chunks of a byte range and write them to a file at their offsets
+
+        Args:
+            request_id [int]: Id of the download request
+            f [BinaryIO]: File to write to
+            start [int]: Offset the range starts at
+            end [int]: Offset the range ends at (exclusive)
+
+        Returns:
+            [bool]: Whether the whole range was received in order
+
+        Raises:
+            ConnectionError: If the connection was lost
+        '''
+        f.seek(start)
+        written = start
+        while written < end:
+            kind, offset, chunk = self.receive_record(request_id)
+            if (kind != CHUNK_RECORD) or (offset != written) or (written + len(chunk) > end):
+                return False
+
+            f.write(chunk)
+            written += len(chunk)
+
+        return True
+
+    def open_data_connections(self, count: int) -> list['Client']:
+        '''
+        Open extra connections bound to the logged-in session, to transfer stripes of a file in parallel (a single connection can't fill a link with a high bandwidth-delay product)
+
+        Args:
+            count [int]: Amount of data connections to open
+
+        Returns:
+            [list[Client]]: The data connections, empty if there is no logged-in session
+
+        Raises:
+            ConnectionError: If a connection failed
+        '''
+        if not self.session_ticket:
+            return []
+
+        return [Client(self.addr, self.session_ticket) for _ in range(count)]
+
+    def receive_records(self, reader: FrameReader, endec: RecordLayer, pending_requests: dict[int, queue.Queue], connection_lost: Event):
+        '''
+        Reads the server's records and hands each one to the queue of the request it belongs to, expected to run in a different thread. A full queue holds the reader back until the request reads its records or is closed (see close_request)\n
+        When the connection is lost, every pending request is woken up with None
+
+        Args:
+            reader [FrameReader]: Frame reader of the connection
+            endec [RecordLayer]: Record layer of the connection
+            pending_requests [dict[int, queue.Queue]]: Queues of the connection's pending requests, by request id
+            connection_lost [Event]: Set once the connection is lost
+
+        Returns:
+            None
+        '''
+        while True:
+            try:
+                kind, request_id, offset, data = endec.open(reader.read_frame())
+                if kind == PACKAGE_RECORD:
+                    data = json.loads(data)
+                    print(data)
+            except (OSError, FrameSizeError, InvalidTag, ValueError):
+                break
+
+            request_queue = pending_requests.get(request_id)
+            if request_queue is not None:
+                request_queue.put((kind, offset, data))
+
+        connection_lost.set()
+        for request_queue in list(pending_requests.values()):
+            request_queue.put(None)
+
+    def receive_record(self, request_id: int) -> tuple[int, int, dict | bytes]:
+        '''
+        Receive the next record the server sent for a request
+
+        Args:
+            request_id [int]: Id of the request
+
+        Returns:
+            [tuple[int, int, dict | bytes]]: Tuple containing 3 elements, first is the kind of record, second is the chunk's offset in its file (0 for packages), third is the package (for package records) or the chunk (for chunk records)
+
+        Raises:
+            ConnectionError: If the connection was lost
+        '''
+        record = self.pending_requests[request_id].get()
+        if record is None:
+            raise ConnectionError
+
+        return record
+
+    def receive_package(self, request_id: int, expected_type: str = '') -> dict:
         '''
         Receive a package from the server
 
         Args:
+            request_id [int]: Id of the request the package belongs to
             expected_type [str = ""]: Expect a specific type of package ("" will accept any package type)
 
         Returns:
             [dict]: Package received from server
 
         Raises:
-            InvalidPackageException: If type of package received does not match expected type
+            InvalidPackageException: If the record received isn't a package, or the type of package received does not match expected type
+            ConnectionError: If the connection was lost
         '''
-        header = self.client_socket.recv(1024)
-        header_package = json.loads(self.endec.decrypt(header).decode())
-        response = self.client_socket.recv(header_package['size-of-package'])
-        response_package = json.loads(self.endec.decrypt(response).decode())
-        print(response_package)
+        kind, _, response_package = self.receive_record(request_id)
+        if kind != PACKAGE_RECORD:
+            raise InvalidPackageException
 
         if (expected_type) and (response_package['type'] != expected_type):
             raise InvalidPackageException
         
         return response_package
 
-    def send_and_receive(self, package: dict, expected_response: str) -> tuple[bool, Any]:
+    def send_and_receive(self, package: dict, expected_response: str, request_id: int | None = None) -> tuple[bool, Any]:
         '''
         Send a package to the server, and return the response as a tuple
 
         Args:
             package [dict]: Package to send
             expected_response [str]: Expected response type
+            request_id [int | None = None]: Id of an already opened request to send the package in (left open), None to use a new request for this package only
 
         Returns:
             [tuple[bool, Any]]: Tuple containing 2 elements, first is whether the request was accepted, second is additional response by the server
 
         '''
-        self.send_package(package)
+        close_after = request_id is None
+        if close_after:
+            request_id = self.open_request()
+
         try:
-            response_package = self.receive_package(expected_response)
+            self.send_package(package, request_id)
+            response_package = self.receive_package(request_id, expected_response)
         except InvalidPackageException:
             return (False, 'Unexpected response package')
+        finally:
+            if close_after:
+                self.close_request(request_id)
         
+        if ('queue' in response_package) and (not close_after):
+            self.queued_requests[request_id] = response_package['queue']
+
+        if 'session-ticket' in response_package:
+            self.save_session_ticket(package['username'], response_package['session-ticket'])
+        elif (package['type'] == 'logout') and response_package['accepted']:
+            self.clear_session_ticket()
+
         return (response_package['accepted'], response_package['response'])
 
+    def load_session_ticket(self) -> dict | None:
+        '''
+        Load the session ticket saved by a previous login (if any)
+
+        Returns:
+            [dict | None]: The saved ticket, None if there is no saved ticket or it expired
+        '''
+        try:
+            with open(TICKET_PATH, 'r') as f:
+                ticket = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if ticket['expires'] < time.time():
+            return None
+
+        return ticket
+
+    def save_session_ticket(self, username: str, ticket: dict):
+        '''
+        Save a session ticket issued by the server, so later connections can resume the session without logging in
+
+        Args:
+            username [str]: Username the ticket was issued for
+            ticket [dict]: Ticket as issued by the server
+
+        Returns:
+            None
+        '''
+        self.session_ticket = ticket | {'username': username}
+        with open(TICKET_PATH, 'w') as f:
+            json.dump(self.session_ticket, f)
+
+    def clear_session_ticket(self):
+        '''
+        Forget the saved session ticket
+
+        Returns:
+            None
+        '''
+        self.session_ticket = None
+        try:
+            os.remove(TICKET_PATH)
+        except FileNotFoundError:
+            pass
+
     def hash_string(self, string: str) -> str:
         '''
         Hash a string in sha256
@@ -348,17 +922,16 @@ class Client:
         
         return (True, '')
 
-    def save_file(self, file_name: str, file_extension: str, file_data: bytes):
+    def get_download_path(self, file_name: str, file_extension: str) -> str:
         '''
-        Save a file after downloading from server. Downloaded files go to ./downloads
+        Get a free path to save a downloaded file to. Downloaded files go to ./downloads
 
         Args:
             file_name [str]: Name of downloaded file
             file_extension [str]: Extension of downloaded file
-            file_data [bytes]: Actual file data
 
         Returns:
-            None
+            [str]: Path to save the file to
         '''
         path = PATH + '\\downloads'
         file_path = os.path.join(path, f'{file_name}{file_extension}')
@@ -371,27 +944,66 @@ class Client:
                 new_file_name = f'{file_name}({i}){file_extension}'
             file_path = os.path.join(path, new_file_name)
 
-        with open(file_path, 'wb') as f:
-            f.write(file_data)
+        return file_path
 
     def connect_to_server(self, addr):
         '''
-        Connects the socket to the server following pre-planned connection stages        
+        Connects the socket to the server following pre-planned connection stages. Presents the saved session ticket (if any) to resume the logged-in session\n
+        Through the server's local listener (a path instead of an address), plaintext records are offered first. The server only accepts them if it trusts the user this process runs as
         '''
+        is_local = isinstance(addr, str)
+        self.client_socket = socket.socket(socket.AF_UNIX if is_local else socket.AF_INET, socket.SOCK_STREAM)
+        self.reader = FrameReader(self.client_socket)
+        self.resumed_username = None
+        self.pending_requests: dict[int, queue.Queue] = {}
+        self.connection_lost = Event()
         try:
             self.client_socket.connect(addr)
 
-            data = self.client_socket.recv(256)
-            signature = self.client_socket.recv(128)
+            identity = json.loads(bytes(self.reader.read_frame()))
+            public_key = identity['public-key'].encode()
+            static_public = bytes.fromhex(identity['static-key'])
 
-            rsa_key_public = rsa.PublicKey.load_pkcs1(data)
-            verified = rsa.verify(data, signature, rsa_key_public)
+            rsa_key_public = rsa.PublicKey.load_pkcs1(public_key)
+            verified = rsa.verify(public_key + static_public, bytes.fromhex(identity['signature']), rsa_key_public)
             if not verified:
                 raise Exception
 
-            symmetric_key = fernet.Fernet.generate_key()
-            self.endec = fernet.Fernet(symmetric_key)
-            self.client_socket.send(rsa.encrypt(symmetric_key, rsa_key_public))
+            ephemeral_key = X25519PrivateKey.generate()
+            client_share = ephemeral_key.public_key().public_bytes(Encoding.Raw, PublicFormat.Raw)
+            client_hello = {
+                'type': 'client_hello',
+                'ciphers': ([PLAINTEXT] if is_local else []) + list(CIPHER_SUITES),
+                'key-share': client_share.hex()
+            }
+            if self.session_ticket:
+                client_hello['session-ticket'] = self.session_ticket['ticket']
+            if self.is_data_connection:
+                client_hello['data-connection'] = True
+            send_frame(self.client_socket, json.dumps(client_hello).encode())
+
+            server_hello = json.loads(bytes(self.reader.read_frame()))
+            if (server_hello['cipher'] not in CIPHER_SUITES) and ((not is_local) or (server_hello['cipher'] != PLAINTEXT)):
+                raise Exception
+
+            server_share = bytes.fromhex(server_hello['key-share'])
+            server_public = X25519PublicKey.from_public_bytes(server_share)
+            if server_hello['resumed']:
+                secret = ephemeral_key.exchange(server_public) + bytes.fromhex(self.session_ticket['resumption-secret'])
+                self.resumed_username = self.session_ticket['username']
+            else:
+                if self.is_data_connection:
+                    raise Exception
+                if self.session_ticket:
+                    #ticket was rejected (expired or server restarted)
+                    self.clear_session_ticket()
+                static_key = X25519PublicKey.from_public_bytes(static_public)
+                secret = ephemeral_key.exchange(server_public) + ephemeral_key.exchange(static_key)
+
+            send_key, receive_key = derive_keys(secret, False, client_share + server_share)
+            self.endec = PlaintextRecordLayer() if server_hello['cipher'] == PLAINTEXT else RecordLayer(server_hello['cipher'], send_key, receive_key)
+
+            Thread(target=self.receive_records, args=(self.reader, self.endec, self.pending_requests, self.connection_lost), daemon=True).start()
 
         except:
             raise ConnectionError
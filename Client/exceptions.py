@@ -1,3 +1,7 @@
 class InvalidPackageException(Exception):
+    def __init__(self, *args):
+        super().__init__(*args)
+
+class FrameSizeError(Exception):
     def __init__(self, *args):
         super().__init__(*args)
\ No newline at end of file
@@ -0,0 +1,82 @@
+import socket
+import struct
+
+from exceptions import FrameSizeError
+
+HEADER = struct.Struct('!I') #4 byte big-endian length prefix
+MAX_FRAME_SIZE = 16 * 1024 * 1024 #16 MB
+
+class FrameReader:
+    def __init__(self, soc: socket.socket, initial_size: int = 4096) -> None:
+        '''
+        Reads length-prefixed frames from a socket into a single reusable buffer
+
+        Args:
+            soc [socket.socket]: Socket to read from
+            initial_size [int = 4096]: Initial size of the buffer (in bytes), grows when a larger frame arrives
+
+        Returns:
+            None
+        '''
+        self.soc = soc
+        self.buffer = bytearray(initial_size)
+
+    def read_exact(self, size: int) -> memoryview:
+        '''
+        Reads exactly "size" bytes from the socket. The returned view is only valid until the next read
+
+        Args:
+            size [int]: Amount of bytes to read
+
+        Returns:
+            [memoryview]: View over the bytes read
+
+        Raises:
+            ConnectionError: If the socket was closed before all bytes arrived
+        '''
+        if size > len(self.buffer):
+            #allocate a new buffer instead of resizing, older views might still be exported
+            self.buffer = bytearray(max(size, len(self.buffer) * 2))
+
+        view = memoryview(self.buffer)[:size]
+        received = 0
+        while received < size:
+            count = self.soc.recv_into(view[received:], size - received)
+            if not count:
+                raise ConnectionError('Socket closed while reading')
+            received += count
+
+        return view
+
+    def read_frame(self, max_size: int = MAX_FRAME_SIZE) -> memoryview:
+        '''
+        Reads a single frame (length prefix followed by the payload)
+
+        Args:
+            max_size [int = MAX_FRAME_SIZE]: Largest payload accepted
+
+        Returns:
+            [memoryview]: View over the frame's payload, only valid until the next read
+
+        Raises:
+            ConnectionError: If the socket was closed before the whole frame arrived
+            FrameSizeError: If the frame's length prefix is larger than "max_size"
+        '''
+        size, = HEADER.unpack(self.read_exact(HEADER.size))
+        if size > max_size:
+            raise FrameSizeError(f'Frame of {size} bytes exceeds {max_size} bytes')
+
+        return self.read_exact(size)
+
+def send_frame(soc: socket.socket, data: bytes) -> None:
+    '''
+    Sends data as a single length-prefixed frame
+
+    Args:
+        soc [socket.socket]: Socket to send through
+        data [bytes]: Frame payload
+
+    Returns:
+        None
+    '''
+    soc.sendall(HEADER.pack(len(data)) + data)
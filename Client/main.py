@@ -2,6 +2,7 @@ from customtkinter import *
 from CTkMessagebox import CTkMessagebox
 
 from PIL import Image
+from datetime import datetime
 
 from client import Client
 from utils import Colors, PATH, TITLE, FONT
@@ -43,7 +44,12 @@ class GUI(CTk):
         self.logout_button_is_shown = False
 
         self.create_frames(container)
-        self.show_frame('LoginPage' if connected else 'ConnectionFailPage')
+        if not connected:
+            self.show_frame('ConnectionFailPage')
+        elif self.client.resumed_username:
+            self.resume_session(self.client.resumed_username)
+        else:
+            self.show_frame('LoginPage')
 
     def create_frames(self, container: CTkFrame):
         self.frames: dict[str, CTkFrame] = {}
@@ -62,6 +68,13 @@ class GUI(CTk):
     def show_message_box(self, title: str, message: str, icon: str):
         CTkMessagebox(self, title=title, message=message, icon=icon).get()
 
+    def show_queue_status(self, queue_status: dict | None):
+        if queue_status is None:
+            return
+
+        start_time = datetime.fromtimestamp(queue_status['estimated-start']).strftime('%H:%M:%S')
+        self.show_message_box('Transfer Queued', f'The server is busy, the transfer is #{queue_status['position']} in line and should start around {start_time}', 'info')
+
     def connect_to_server(self, addr):
         try:
             self.client = Client(addr)
@@ -85,6 +98,14 @@ class GUI(CTk):
 
         return (accepted, response)
     
+    def resume_session(self, username: str):
+        accepted, response = self.client.send_user_files_request(username)
+
+        if accepted:
+            self.set_properties_after_login(username, response)
+        else:
+            self.show_frame('LoginPage')
+
     def set_properties_after_login(self, username: str, userfiles: list):
         self.username = username
         self.userfiles = userfiles
@@ -113,6 +134,8 @@ class GUI(CTk):
         if not accepted:
             self.show_message_box('Upload Request Denied', response, 'cancel')
             return (False, {})
+
+        self.show_queue_status(self.client.get_queue_status(file_path))
         
         uploaded, file_data = self.client.upload_file(file_path)
         if not accepted:
@@ -130,7 +153,8 @@ class GUI(CTk):
             self.show_message_box('Download Request Denied', response, 'cancel')
             return False
 
-        downloaded = self.client.download_file(file['file-name'])
+        self.show_queue_status(self.client.get_queue_status((file['file-name'], username)))
+        downloaded = self.client.download_file(file['file-name'], username)
         if not downloaded:
             self.show_message_box('Download Failed', 'Failed to download file', 'cancel')
             return False
@@ -0,0 +1,242 @@
+import os
+import struct
+import itertools
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+
+NONCE_SIZE = 12
+NONCE_PREFIX_SIZE = 4 #random per sender, the rest of the nonce is the sender's record counter
+TAG_SIZE = 16
+KEY_SIZE = 32
+#how far behind the newest record received a record may arrive. Records can be sealed out of order (on the crypto pool, or by several sending threads), so a few are always in flight
+REPLAY_WINDOW_SIZE = 1024 #records
+
+#every record starts with a plaintext header (authenticated as associated data) so it can be routed by request id
+RECORD_HEADER = struct.Struct('!BIQ') #record kind, request id, offset of the chunk in its file (0 for packages)
+PACKAGE_RECORD = 0
+CHUNK_RECORD = 1
+RECORD_OVERHEAD = RECORD_HEADER.size + NONCE_SIZE + TAG_SIZE
+
+#supported AEAD ciphers, in order of preference
+CIPHER_SUITES = {
+    'AES-256-GCM': AESGCM,
+    'CHACHA20-POLY1305': ChaCha20Poly1305
+}
+#records aren't encrypted at all, only selected for local connections of peers the server trusts (see PlaintextRecordLayer)
+PLAINTEXT = 'PLAINTEXT'
+
+class RecordLayer:
+    def __init__(self, cipher: str, send_key: bytes, receive_key: bytes) -> None:
+        '''
+        Encrypts and decrypts binary records using an AEAD cipher\n
+        Every record is laid out as: header (kind, request id and offset) + nonce (12 bytes) + ciphertext + tag (16 bytes). Each direction has its own key, and nonces are made of a random prefix and a counter so they never repeat under the same key. Records received are checked against a replay window (see ReplayWindow), so a record can't be replayed on the connection
+
+        Args:
+            cipher [str]: Name of the cipher (key of CIPHER_SUITES)
+            send_key [bytes]: Key for records sent by this side
+            receive_key [bytes]: Key for records received by this side
+
+        Returns:
+            None
+        '''
+        self.cipher = cipher
+        self.send_aead = CIPHER_SUITES[cipher](send_key)
+        self.receive_aead = CIPHER_SUITES[cipher](receive_key)
+
+        self.nonce_prefix = os.urandom(NONCE_PREFIX_SIZE)
+        self.nonce_counter = itertools.count()
+        self.replay_window = ReplayWindow()
+
+    def encrypt(self, data: bytes | memoryview, associated_data: bytes | None = None) -> bytes:
+        '''
+        Encrypts data, the result is laid out as: nonce + ciphertext + tag
+
+        Args:
+            data [bytes | memoryview]: Data to encrypt
+            associated_data [bytes | None = None]: Data to authenticate without encrypting
+
+        Returns:
+            [bytes]: The encrypted data
+        '''
+        nonce = self.nonce_prefix + struct.pack('!Q', next(self.nonce_counter))
+        return nonce + self.send_aead.encrypt(nonce, data, associated_data)
+
+    def decrypt(self, encrypted: bytes | memoryview, associated_data: bytes | None = None) -> bytes:
+        '''
+        Decrypts and authenticates data encrypted by encrypt(), any nonce is accepted (records are checked for replays by open)
+
+        Args:
+            encrypted [bytes | memoryview]: Data to decrypt
+            associated_data [bytes | None = None]: Data that was authenticated along with it
+
+        Returns:
+            [bytes]: The decrypted data
+
+        Raises:
+            InvalidTag: If the data is malformed or was tampered with
+        '''
+        if len(encrypted) < NONCE_SIZE + TAG_SIZE:
+            raise InvalidTag
+
+        encrypted = memoryview(encrypted)
+        return self.receive_aead.decrypt(encrypted[:NONCE_SIZE], encrypted[NONCE_SIZE:], associated_data)
+
+    def seal(self, kind: int, request_id: int, data: bytes | memoryview, offset: int = 0) -> bytes:
+        '''
+        Seals data into a single record
+
+        Args:
+            kind [int]: Kind of record (PACKAGE_RECORD or CHUNK_RECORD)
+            request_id [int]: Id of the request the record belongs to
+            data [bytes | memoryview]: Data to seal
+            offset [int = 0]: Offset of the chunk in its file (for chunk records)
+
+        Returns:
+            [bytes]: The record
+        '''
+        header = RECORD_HEADER.pack(kind, request_id, offset)
+        return header + self.encrypt(data, header)
+
+    def open(self, record: bytes | memoryview) -> tuple[int, int, int, bytes]:
+        '''
+        Opens a single record sealed by the other side, a record is only accepted once
+
+        Args:
+            record [bytes | memoryview]: Record to open
+
+        Returns:
+            [tuple[int, int, int, bytes]]: Tuple containing 4 elements: the record's kind, its request id, its offset and the decrypted data
+
+        Raises:
+            InvalidTag: If the record is malformed, was tampered with, or was replayed (or delayed past the replay window)
+        '''
+        if len(record) < RECORD_HEADER.size + NONCE_SIZE:
+            raise InvalidTag
+
+        header = bytes(record[:RECORD_HEADER.size])
+        kind, request_id, offset = RECORD_HEADER.unpack(header)
+        nonce = bytes(record[RECORD_HEADER.size:RECORD_HEADER.size + NONCE_SIZE])
+        self.replay_window.check(nonce)
+        data = self.decrypt(record[RECORD_HEADER.size:], header)
+        #only authenticated nonces move the window, a forged record can't make it skip ahead
+        self.replay_window.accept(nonce)
+        return (kind, request_id, offset, data)
+
+class ReplayWindow:
+    def __init__(self, size: int = REPLAY_WINDOW_SIZE) -> None:
+        '''
+        Nonces of the records received from the peer, so every record is accepted only once (a sliding window, as in IPsec and DTLS)\n
+        The peer's records may arrive out of counter order, so any counter less than "size" behind the highest one received is accepted if it wasn't received yet, older ones are refused. All of the peer's nonces share the prefix of the first record received
+
+        Args:
+            size [int = REPLAY_WINDOW_SIZE]: Amount of counters tracked behind the highest one
+
+        Returns:
+            None
+        '''
+        self.size = size
+        self.mask = (1 << size) - 1
+        self.prefix: bytes | None = None
+        self.highest = -1
+        self.received = 0 #bit i is set once counter (highest - i) was received
+
+    def check(self, nonce: bytes) -> None:
+        '''
+        Checks a nonce before its record is authenticated
+
+        Args:
+            nonce [bytes]: Nonce of a received record
+
+        Raises:
+            InvalidTag: If the nonce was already received, is too far behind, or doesn't have the peer's prefix
+        '''
+        if (self.prefix is not None) and (nonce[:NONCE_PREFIX_SIZE] != self.prefix):
+            raise InvalidTag
+
+        behind = self.highest - int.from_bytes(nonce[NONCE_PREFIX_SIZE:])
+        if (behind >= self.size) or ((behind >= 0) and ((self.received >> behind) & 1)):
+            raise InvalidTag
+
+    def accept(self, nonce: bytes) -> None:
+        '''
+        Marks a nonce as received, once its record was authenticated (see check)
+
+        Args:
+            nonce [bytes]: Nonce of the record
+
+        Returns:
+            None
+        '''
+        self.prefix = nonce[:NONCE_PREFIX_SIZE]
+        counter = int.from_bytes(nonce[NONCE_PREFIX_SIZE:])
+        if counter > self.highest:
+            self.received = ((self.received << (counter - self.highest)) | 1) & self.mask
+            self.highest = counter
+        else:
+            self.received |= 1 << (self.highest - counter)
+
+class PlaintextRecordLayer(RecordLayer):
+    def __init__(self) -> None:
+        '''
+        Record layer that doesn't encrypt, for local connections (Unix domain sockets) whose peer was authenticated by the OS, so nothing crosses the network\n
+        Every record is laid out as: header (kind, request id and offset) + data, so a chunk record's data can be sent straight from its file. Records have no nonce, there is no one in between to replay them
+
+        Returns:
+            None
+        '''
+        self.cipher = PLAINTEXT
+
+    def open(self, record: bytes | memoryview) -> tuple[int, int, int, bytes]:
+        if len(record) < RECORD_HEADER.size:
+            raise InvalidTag
+
+        kind, request_id, offset = RECORD_HEADER.unpack(record[:RECORD_HEADER.size])
+        return (kind, request_id, offset, bytes(record[RECORD_HEADER.size:]))
+
+    def encrypt(self, data: bytes | memoryview, associated_data: bytes | None = None) -> bytes:
+        return bytes(data)
+
+    def decrypt(self, encrypted: bytes | memoryview, associated_data: bytes | None = None) -> bytes:
+        return bytes(encrypted)
+
+def select_cipher(offered: list[str], allow_plaintext: bool = False) -> str | None:
+    '''
+    Picks the first cipher offered by the peer that is also supported locally
+
+    Args:
+        offered [list[str]]: Cipher names offered by the peer, in the peer's order of preference
+        allow_plaintext [bool = False]: Whether PLAINTEXT can be selected (local connections of trusted peers only)
+
+    Returns:
+        [str | None]: Name of the selected cipher, None if there is no common cipher
+    '''
+    for cipher in offered:
+        if (cipher in CIPHER_SUITES) or (allow_plaintext and cipher == PLAINTEXT):
+            return cipher
+
+    return None
+
+def derive_keys(secret: bytes, is_server: bool, salt: bytes | None = None) -> tuple[bytes, bytes]:
+    '''
+    Derives the two directional record keys from a shared secret
+
+    Args:
+        secret [bytes]: Secret shared by both sides
+        is_server [bool]: Whether the keys are derived for the server's side of the connection
+        salt [bytes | None = None]: Public values binding the keys to this handshake (such as both key shares)
+
+    Returns:
+        [tuple[bytes, bytes]]: Tuple containing 2 elements, first is the key for sending, second is the key for receiving
+    '''
+    key_material = HKDF(
+        algorithm=hashes.SHA256(),
+        length=2 * KEY_SIZE,
+        salt=salt,
+        info=b'file-transfer record keys'
+    ).derive(secret)
+    client_key, server_key = key_material[:KEY_SIZE], key_material[KEY_SIZE:]
+
+    return (server_key, client_key) if is_server else (client_key, server_key)
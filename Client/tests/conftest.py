@@ -0,0 +1,61 @@
+import itertools
+import os
+import queue
+import socket
+import sys
+from threading import Thread, Lock, Event
+
+import pytest
+
+#the client's modules import each other by name, as when running from the Client folder. Some of the server's modules have the same names, so those loaded by the server's tests are forgotten first
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+for name in ('exceptions', 'framing', 'record_layer'):
+    sys.modules.pop(name, None)
+
+from client import Client
+from framing import FrameReader, send_frame
+from record_layer import PlaintextRecordLayer
+
+class FakeServer:
+    def __init__(self, soc: socket.socket) -> None:
+        '''
+        The server's end of a client's connection, records are sent and received as plaintext
+
+        Args:
+            soc [socket.socket]: The server's end of the connection
+
+        Returns:
+            None
+        '''
+        self.soc = soc
+        self.reader = FrameReader(soc)
+        self.endec = PlaintextRecordLayer()
+
+    def send(self, kind: int, request_id: int, data: bytes, offset: int = 0) -> None:
+        send_frame(self.soc, self.endec.seal(kind, request_id, data, offset))
+
+    def receive(self) -> tuple[int, int, int, bytes]:
+        return self.endec.open(self.reader.read_frame())
+
+@pytest.fixture
+def connection() -> tuple[Client, FakeServer]:
+    '''
+    A client connected to a fake server, with its record reader running (set up as connect_to_server does after the handshake)
+    '''
+    client_soc, server_soc = socket.socketpair()
+    client = Client.__new__(Client)
+    client.client_socket = client_soc
+    client.reader = FrameReader(client_soc)
+    client.endec = PlaintextRecordLayer()
+    client.pending_requests: dict[int, queue.Queue] = {}
+    client.connection_lost = Event()
+    client.request_ids = itertools.count(1)
+    client.send_lock = Lock()
+    client.accepted_downloads = {}
+    client.unfinished_downloads = {}
+    client.queued_requests = {}
+    Thread(target=client.receive_records, args=(client.reader, client.endec, client.pending_requests, client.connection_lost), daemon=True).start()
+
+    yield (client, FakeServer(server_soc))
+    client_soc.close()
+    server_soc.close()
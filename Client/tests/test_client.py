@@ -0,0 +1,96 @@
+import json
+from threading import Thread
+
+import pytest
+
+from client import REQUEST_QUEUE_SIZE
+from record_layer import CHUNK_RECORD, PACKAGE_RECORD
+
+CHUNK = b'x' * 1024
+
+def send_package(server, request_id: int, package: dict) -> None:
+    server.send(PACKAGE_RECORD, request_id, json.dumps(package).encode())
+
+def answer_search(server) -> None:
+    '''
+    Waits for a search request (skipping anything sent before it) and answers it
+    '''
+    while True:
+        _, request_id, _, data = server.receive()
+        if json.loads(data)['type'] == 'search_users':
+            send_package(server, request_id, {'type': 'users_found', 'accepted': True, 'response': {'bob': 1}})
+            return
+
+def search(client) -> tuple[bool, dict | str]:
+    '''
+    Searches from another thread, so a client that hangs fails the test instead of blocking it
+    '''
+    results = []
+    searcher = Thread(target=lambda: results.append(client.send_user_search_request('bob')), daemon=True)
+    searcher.start()
+    searcher.join(5)
+    return results[0] if results else None
+
+def test_closed_request_frees_the_reader(connection):
+    client, server = connection
+    request_id = client.open_request()
+    request_queue = client.pending_requests[request_id]
+    def stream():
+        for i in range(4 * REQUEST_QUEUE_SIZE):
+            server.send(CHUNK_RECORD, request_id, CHUNK, i * len(CHUNK))
+        answer_search(server)
+    Thread(target=stream, daemon=True).start()
+
+    while not request_queue.full():
+        pass
+    #the request stops reading while the server still sends its chunks
+    client.close_request(request_id)
+
+    assert search(client) == (True, {'bob': 1})
+
+@pytest.mark.parametrize('case', ['replaced file', 'unexpected offset', 'read ranges'])
+def test_abandoned_download_keeps_the_connection(connection, tmp_path, monkeypatch, case):
+    '''
+    A download the client gives up on while the server still sends it (the file was replaced since the part file was saved, or a chunk came at an unexpected offset) doesn't hold up the connection's other requests
+    '''
+    client, server = connection
+    file_size = len(CHUNK) * 4 * REQUEST_QUEUE_SIZE
+    first_offset = len(CHUNK) if case == 'replaced file' else 0
+    def serve():
+        while True:
+            _, request_id, _, data = server.receive()
+            package = json.loads(data)
+            if package['type'] == 'download_request':
+                send_package(server, request_id, {'type': 'download_request_response', 'accepted': True, 'response': file_size})
+            elif package['type'] == 'download_ready':
+                break
+
+        send_package(server, request_id, {'type': 'download_start', 'file-size-bytes': file_size, 'upload-time': 2, 'ranges': [[first_offset, file_size]], 'chunk-size': len(CHUNK)})
+        if case != 'replaced file':
+            server.send(CHUNK_RECORD, request_id, CHUNK, len(CHUNK))
+        for offset in range(first_offset, file_size, len(CHUNK)):
+            server.send(CHUNK_RECORD, request_id, CHUNK, offset)
+        answer_search(server)
+    Thread(target=serve, daemon=True).start()
+
+    client_send = client.send_package
+    def send_final_once_full(package: dict, request_id: int):
+        #the chunks keep coming while the client gives up on the download
+        if package['type'] == 'download_final':
+            while not client.pending_requests[request_id].full():
+                pass
+        client_send(package, request_id)
+    monkeypatch.setattr(client, 'send_package', send_final_once_full)
+
+    if case == 'read ranges':
+        assert client.read_file_ranges('f.bin', 'bob', [(0, None)]) is None
+    else:
+        part_path = str(tmp_path / 'f.bin.part')
+        with open(part_path, 'wb') as f:
+            f.write(CHUNK)
+        unfinished = {'part-path': part_path, 'upload-time': 1} if case == 'replaced file' else None
+        monkeypatch.setattr(client, 'get_download_path', lambda base_name, extension: str(tmp_path / base_name) + extension)
+        client.accepted_downloads[('f.bin', 'bob')] = (client.open_request(), unfinished, file_size)
+        assert not client.download_file('f.bin', 'bob')
+
+    assert search(client) == (True, {'bob': 1})
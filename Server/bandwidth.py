@@ -0,0 +1,222 @@
+import time
+import asyncio
+import itertools
+
+class TokenBucket:
+    def __init__(self, rate: float | None) -> None:
+        '''
+        Token bucket limiting a rate of bytes. Tokens build up at "rate" bytes per second (up to a second's worth), and taking more tokens than the bucket holds leaves it in debt, so transfers can move in chunks of any size
+
+        Args:
+            rate [float | None]: Rate limit (in bytes per second), no limit if None
+
+        Returns:
+            None
+        '''
+        self.rate = rate
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+
+    def set_rate(self, rate: float | None) -> None:
+        '''
+        Changes the rate limit, whatever the bucket held is kept (up to the new limit's capacity)
+
+        Args:
+            rate [float | None]: New rate limit (in bytes per second), no limit if None
+
+        Returns:
+            None
+        '''
+        self.refill()
+        self.rate = rate
+        if rate is not None:
+            self.tokens = min(self.tokens, rate)
+
+    def refill(self) -> None:
+        '''
+        Adds the tokens built up since the last refill
+
+        Returns:
+            None
+        '''
+        now = time.monotonic()
+        if self.rate is not None:
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        '''
+        Returns:
+            [float]: Time (in seconds) until the bucket is out of debt, 0 if tokens can be taken right away
+        '''
+        if self.rate is None:
+            return 0.0
+
+        self.refill()
+        return max(0.0, -self.tokens / self.rate)
+
+    def take(self, amount: int) -> None:
+        '''
+        Takes tokens from the bucket, expected to be called once wait_time() is 0
+
+        Args:
+            amount [int]: Amount of tokens (bytes) to take
+
+        Returns:
+            None
+        '''
+        if self.rate is not None:
+            self.refill()
+            self.tokens -= amount
+
+class BandwidthShaper:
+    def __init__(self, global_rate: float | None = None, user_rate: float | None = None) -> None:
+        '''
+        Shapes the bandwidth of transfers with a global token bucket and a token bucket per user. Transfers ask for every chunk's bytes before moving it (see acquire)\n
+        While the buckets hold transfers back, the waiting transfers are served in weighted fair queuing order (self-clocked): every request is tagged with the virtual time it would finish at, given the transfer's weight, and the smallest tag is served first. A user's weight is split between all of its transfers, so running more transfers doesn't get a user more of the bandwidth
+
+        Args:
+            global_rate [float | None = None]: Rate limit of all transfers together (in bytes per second), no limit if None
+            user_rate [float | None = None]: Default rate limit of every user's transfers together (in bytes per second), no limit if None
+
+        Returns:
+            None
+        '''
+        self.global_bucket = TokenBucket(global_rate)
+        self.user_rate = user_rate
+        self.user_buckets: dict[str, TokenBucket] = {}
+        #rate limits and weights set for specific users, anyone else gets the default rate and a weight of 1
+        self.user_rates: dict[str, float | None] = {}
+        self.weights: dict[str, float] = {}
+
+        #waiting requests: [finish tag, arrival order, username, amount, future], the virtual time is the finish tag of the last served request
+        self.waiting: list[tuple[float, int, str, int, asyncio.Future]] = []
+        self.flows: dict[str, int] = {} #amount of transfers of every user currently asking for bytes
+        self.virtual_time = 0.0
+        self.arrivals = itertools.count()
+        self.timer: asyncio.TimerHandle | None = None
+
+    def is_limited(self) -> bool:
+        '''
+        Returns:
+            [bool]: Whether any rate limit is set
+        '''
+        return (self.global_bucket.rate is not None) or (self.user_rate is not None) or any(rate is not None for rate in self.user_rates.values())
+
+    def user_bucket(self, username: str) -> TokenBucket:
+        '''
+        Args:
+            username [str]: Username of a user
+
+        Returns:
+            [TokenBucket]: The user's bucket, created with the user's rate limit if needed
+        '''
+        bucket = self.user_buckets.get(username)
+        if bucket is None:
+            bucket = self.user_buckets[username] = TokenBucket(self.user_rates.get(username, self.user_rate))
+
+        return bucket
+
+    async def acquire(self, username: str, amount: int, weight: float = 1.0) -> None:
+        '''
+        Waits until a transfer may move "amount" bytes, returns right away if no limit is set
+
+        Args:
+            username [str]: Username of the user the transfer belongs to
+            amount [int]: Amount of bytes the transfer is about to move
+            weight [float = 1.0]: The transfer's own weight (by its priority class), multiplies the user's share
+
+        Returns:
+            None
+        '''
+        if (not self.waiting) and (not self.is_limited()):
+            return
+
+        weight *= self.weights.get(username, 1.0) / (self.flows.get(username, 0) + 1)
+        future = asyncio.get_running_loop().create_future()
+        self.waiting.append((self.virtual_time + amount / weight, next(self.arrivals), username, amount, future))
+        self.flows[username] = self.flows.get(username, 0) + 1
+        try:
+            self.schedule()
+            await future
+        finally:
+            self.flows[username] -= 1
+            if self.flows[username] == 0:
+                self.flows.pop(username)
+            if not future.done():
+                #cancelled while waiting
+                self.waiting = [request for request in self.waiting if request[4] is not future]
+                self.schedule()
+
+    def schedule(self) -> None:
+        '''
+        Serves waiting requests in order of their finish tags, skipping requests of users whose bucket is in debt. If nothing can be served, checks again once a bucket could be out of debt
+
+        Returns:
+            None
+        '''
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+        while self.waiting:
+            wait = self.global_bucket.wait_time()
+            if wait == 0:
+                ready = [request for request in self.waiting if self.user_bucket(request[2]).wait_time() == 0]
+                if ready:
+                    request = min(ready)
+                    self.waiting.remove(request)
+                    finish_tag, _, username, amount, future = request
+                    self.virtual_time = finish_tag
+                    self.global_bucket.take(amount)
+                    self.user_bucket(username).take(amount)
+                    future.set_result(None)
+                    continue
+
+                wait = min(self.user_bucket(request[2]).wait_time() for request in self.waiting)
+
+            self.timer = asyncio.get_running_loop().call_later(wait, self.schedule)
+            return
+
+        #every transfer is served, buckets of users without waiting requests can be recreated when needed
+        self.user_buckets = {username: bucket for username, bucket in self.user_buckets.items() if bucket.wait_time() > 0}
+
+    def set_global_rate(self, rate: float | None) -> None:
+        '''
+        Args:
+            rate [float | None]: New rate limit of all transfers together (in bytes per second), no limit if None
+
+        Returns:
+            None
+        '''
+        self.global_bucket.set_rate(rate)
+        self.schedule()
+
+    def set_user_rate(self, rate: float | None, username: str | None = None) -> None:
+        '''
+        Args:
+            rate [float | None]: New rate limit (in bytes per second), no limit if None
+            username [str | None = None]: User to set the limit of, sets the default limit of all users (without a limit of their own) if None
+
+        Returns:
+            None
+        '''
+        if username is None:
+            self.user_rate = rate
+        else:
+            self.user_rates[username] = rate
+
+        for bucket_username, bucket in self.user_buckets.items():
+            bucket.set_rate(self.user_rates.get(bucket_username, self.user_rate))
+        self.schedule()
+
+    def set_weight(self, username: str, weight: float) -> None:
+        '''
+        Args:
+            username [str]: Username of a user
+            weight [float]: The user's share of the bandwidth relative to other users (1 by default), applies to requests made from now on
+
+        Returns:
+            None
+        '''
+        self.weights[username] = weight
@@ -0,0 +1,203 @@
+import socket
+import struct
+import asyncio
+from typing import BinaryIO
+
+from exceptions import FrameSizeError
+from framing import HEADER, MAX_FRAME_SIZE
+from record_layer import RecordLayer
+
+PEER_CREDENTIALS = struct.Struct('3i') #struct ucred: pid, uid, gid
+
+def read_peer_credentials(sock: socket.socket) -> tuple[int, int, int] | None:
+    '''
+    Reads the credentials of the process on the other end of a Unix domain socket, as the kernel recorded them when it connected (SO_PEERCRED, Linux only)
+
+    Args:
+        sock [socket.socket]: A connected Unix domain socket
+
+    Returns:
+        [tuple[int, int, int] | None]: Tuple containing 3 elements: the peer's process id, user id and group id. None if the platform doesn't report them
+    '''
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+
+    try:
+        return PEER_CREDENTIALS.unpack(sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, PEER_CREDENTIALS.size))
+    except OSError:
+        return None
+
+class Connection:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        '''
+        A client's connection, read and written through asyncio streams. Stands in for the client's socket in the server's maps, so it is used as the key for everything tied to the connection
+
+        Args:
+            reader [asyncio.StreamReader]: Stream to read from
+            writer [asyncio.StreamWriter]: Stream to write to
+
+        Returns:
+            None
+        '''
+        self.reader = reader
+        self.writer = writer
+        self.addr = writer.get_extra_info('peername')
+        self.endec: RecordLayer | None = None #set once the handshake completes
+
+        #local connections (Unix domain sockets) have no address, they are known by the peer process's credentials instead
+        self.peer_credentials: tuple[int, int, int] | None = None
+        sock = writer.get_extra_info('socket')
+        if (sock is not None) and (sock.family == getattr(socket, 'AF_UNIX', None)):
+            self.peer_credentials = read_peer_credentials(sock)
+            self.addr = ('local', self.peer_credentials[0] if self.peer_credentials is not None else None)
+
+        #frames queued while a file frame is being sent, they can't be written until it is done (see send_file_frame)
+        self.held_frames: list[bytes] | None = None
+        self.file_frame_lock = asyncio.Lock()
+        self.file_frame_task: asyncio.Task | None = None
+
+        #let downloads queue up more than asyncio's default 64 KB before waiting for the network
+        writer.transport.set_write_buffer_limits(high=1024 * 1024)
+
+    def __repr__(self) -> str:
+        return f'<Connection {self.addr}>'
+
+    def getpeername(self) -> tuple:
+        '''
+        Returns:
+            [tuple]: Address of the client
+        '''
+        return self.addr
+
+    async def read_frame(self, max_size: int = MAX_FRAME_SIZE, timeout: float | None = None) -> bytes:
+        '''
+        Reads a single frame (length prefix followed by the payload). Waiting for a frame to start isn't limited, but once its first byte arrives the rest has to arrive within "timeout" seconds, so a client trickling bytes can't hold a request open
+
+        Args:
+            max_size [int = MAX_FRAME_SIZE]: Largest payload accepted
+            timeout [float | None = None]: Longest time (in seconds) the rest of the frame can take to arrive once it started, not limited if None
+
+        Returns:
+            [bytes]: The frame's payload
+
+        Raises:
+            ConnectionError: If the connection was closed before the whole frame arrived
+            FrameSizeError: If the frame's length prefix is larger than "max_size"
+            TimeoutError: If the rest of the frame didn't arrive within "timeout" seconds
+        '''
+        try:
+            first_byte = await self.reader.readexactly(1)
+            async with asyncio.timeout(timeout):
+                size, = HEADER.unpack(first_byte + await self.reader.readexactly(HEADER.size - 1))
+                if size > max_size:
+                    raise FrameSizeError(f'Frame of {size} bytes exceeds {max_size} bytes')
+
+                return await self.reader.readexactly(size)
+        except asyncio.IncompleteReadError:
+            raise ConnectionError('Connection closed while reading')
+
+    def send_frame(self, data: bytes) -> None:
+        '''
+        Queues data to be sent as a single length-prefixed frame. A frame is queued in one call, so frames of different requests never interleave\n
+        Frames queued once the connection is closing are dropped
+
+        Args:
+            data [bytes]: Frame payload
+
+        Returns:
+            None
+        '''
+        if self.writer.is_closing():
+            return
+
+        if self.held_frames is not None:
+            self.held_frames.append(HEADER.pack(len(data)) + data)
+            return
+
+        #a single write, writelines() doesn't apply the write buffer limits on every Python version (drain() would never wait)
+        self.writer.write(HEADER.pack(len(data)) + data)
+
+    async def send_file_frame(self, prefix: bytes, f: BinaryIO, offset: int, count: int) -> None:
+        '''
+        Sends a single frame made of "prefix" followed by "count" bytes of a file. The file's bytes are copied to the socket by the kernel (os.sendfile where supported), without passing through the process\n
+        Frames queued meanwhile are held, and sent once the file frame is done. If the frame can't be sent whole the connection is aborted, since the stream can't be read past a cut off frame
+
+        Args:
+            prefix [bytes]: Start of the frame's payload (a record header)
+            f [BinaryIO]: File to send from, opened in binary mode
+            offset [int]: Offset in the file to send from
+            count [int]: Amount of bytes of the file to send
+
+        Returns:
+            None
+
+        Raises:
+            ConnectionError: If the connection is closed or was lost
+        '''
+        async with self.file_frame_lock:
+            if self.writer.is_closing():
+                raise ConnectionError('Connection is closed')
+
+            self.writer.write(HEADER.pack(len(prefix) + count) + prefix)
+            self.held_frames = []
+            self.file_frame_task = asyncio.current_task()
+            try:
+                sent = await asyncio.get_running_loop().sendfile(self.writer.transport, f, offset, count)
+            except BaseException:
+                self.file_frame_task = None
+                self.abort()
+                raise
+            finally:
+                self.file_frame_task = None
+                held_frames, self.held_frames = self.held_frames, None
+
+            if sent != count:
+                #the file is shorter than expected
+                self.abort()
+                raise ConnectionError('File ended before the frame was sent')
+
+            if not self.writer.is_closing():
+                for frame in held_frames:
+                    self.writer.write(frame)
+
+    async def drain(self) -> None:
+        '''
+        Waits until the queued frames are (mostly) sent, used by transfers to not queue up a whole file
+
+        Returns:
+            None
+
+        Raises:
+            ConnectionError: If the connection was lost
+        '''
+        await self.writer.drain()
+
+    def cancel_file_frame(self) -> None:
+        '''
+        Cancels the file frame being sent (if any). The sendfile call has to let go of the transport before it is closed, so this is done first by close() and abort()
+
+        Returns:
+            None
+        '''
+        if self.file_frame_task is not None:
+            self.file_frame_task.cancel()
+
+    def close(self) -> None:
+        '''
+        Closes the connection
+
+        Returns:
+            None
+        '''
+        self.cancel_file_frame()
+        self.writer.close()
+
+    def abort(self) -> None:
+        '''
+        Closes the connection right away, dropping whatever wasn't sent yet (closing waits for it to be sent, which a client that stopped reading never lets happen)
+
+        Returns:
+            None
+        '''
+        self.cancel_file_frame()
+        self.writer.transport.abort()
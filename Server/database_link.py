@@ -1,16 +1,31 @@
 import sqlite3
 import os
+import queue
+from contextlib import contextmanager
+from typing import Iterator
 from exceptions import *
 
 PATH = os.path.dirname(os.path.realpath(__file__))
+
+CACHE_SIZE_KB = 16 * 1024 #16 MB page cache per connection
+BUSY_TIMEOUT_MS = 5000 #how long a connection waits for a lock held by another before failing with "database is locked"
+
+#schema changes made after the tables were first created, in order. A database's user_version is the amount of migrations it went through
+MIGRATIONS = [
+    #the primary key starts with the file name, so lookups by uploader (a user's files, counting public files, removing a user) scanned the whole table
+    #(uploader, is-public) serves lookups by uploader alone too, and covers counting a user's public files without reading the table
+    ['CREATE INDEX IF NOT EXISTS "files-by-uploader" ON files ("uploader", "is-public")']
+]
+
 class DatabaseLink:
-    def __init__(self, db_name: str, create: bool = True) -> None:
+    def __init__(self, db_name: str, create: bool = True, read_only: bool = False) -> None:
         '''
         Link to a .db file
 
         Args:
             db_name [str]: Name of database file (expects it in ./data/)
-            create [bool = True]: Try to auto create tables (if not exists)
+            create [bool = True]: Try to auto create tables (if not exists), switch the database to WAL journaling, and apply the migrations the database doesn't have yet
+            read_only [bool = False]: Refuse writes, and allow the link to be used from any thread (one thread at a time, see ReadPool)
         
         Returns:
             None
@@ -18,12 +33,20 @@ class DatabaseLink:
         if not os.path.exists(PATH + f'\\data\\{db_name}'):
             open(PATH + f'\\data\\{db_name}', 'w') #create file if not exists
 
-        self.connection = sqlite3.connect(f'{PATH}\\data\\{db_name}')
+        self.connection = sqlite3.connect(f'{PATH}\\data\\{db_name}', check_same_thread=not read_only)
         self.connection.row_factory = sqlite3.Row
         print('Connected to DB')
 
         self.cursor = self.connection.cursor()
+        #NORMAL only syncs at WAL checkpoints, a power loss can drop the last commits but can't corrupt the database
+        self.cursor.execute('PRAGMA synchronous = NORMAL')
+        self.cursor.execute(f'PRAGMA cache_size = -{CACHE_SIZE_KB}')
+        self.cursor.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+        if read_only:
+            self.cursor.execute('PRAGMA query_only = ON')
         if create:
+            #the journal mode is kept in the database file, so links opened later use WAL too. With WAL readers don't block the writer and the writer doesn't block readers
+            self.cursor.execute('PRAGMA journal_mode = WAL')
             self.cursor.execute('''CREATE TABLE IF NOT EXISTS users (
                             "username" TEXT PRIMARY KEY,
                             "password-hash" TEXT
@@ -39,14 +62,36 @@ class DatabaseLink:
                             PRIMARY KEY ("file-name", "uploader")
                             )''')
             self.connection.commit()
+            self.migrate()
+
+    def migrate(self) -> None:
+        '''
+        Applies the migrations (see MIGRATIONS) the database doesn't have yet, in a single transaction. The write lock is taken before the schema version is read, so processes opening the database at once don't apply a migration twice
+
+        Returns:
+            None
+        '''
+        self.cursor.execute('BEGIN IMMEDIATE')
+        try:
+            version = self.cursor.execute('PRAGMA user_version').fetchone()[0]
+            for statements in MIGRATIONS[version:]:
+                for statement in statements:
+                    self.cursor.execute(statement)
+            if version < len(MIGRATIONS):
+                self.cursor.execute(f'PRAGMA user_version = {len(MIGRATIONS)}')
+            self.connection.commit()
+        except sqlite3.Error:
+            self.connection.rollback()
+            raise
 
-    def add_user(self, username: str, password_hash: str) -> None:
+    def add_user(self, username: str, password_hash: str, commit: bool = True) -> None:
         '''
         Adds a user to the database
 
         Args:
             username [str]: Username for the user
             password_hash [str]: Password hash of the user
+            commit [bool = True]: Commit right away, otherwise the write is part of the open transaction until commit() is called
 
         Returns:
             None
@@ -58,7 +103,8 @@ class DatabaseLink:
         try:
             self.cursor.execute('INSERT INTO users ("username", "password-hash") VALUES (?, ?)',
                                 (username, password_hash))
-            self.connection.commit()
+            if commit:
+                self.connection.commit()
         except sqlite3.IntegrityError:
             raise UserExistsError
         
@@ -110,12 +156,13 @@ class DatabaseLink:
         
         return starts_with_usernames + contains_usernames
     
-    def add_file(self, file_data: dict) -> None:
+    def add_file(self, file_data: dict, commit: bool = True) -> None:
         '''
         Adds a file to the database
 
         Args:
             file_data [dict]: File data as a dictionary, expected keys are: 'file-name', 'uploader', 'file-size-bytes', 'upload-time', 'is-public'
+            commit [bool = True]: Commit right away, otherwise the write is part of the open transaction until commit() is called
 
         Returns:
             None
@@ -127,7 +174,8 @@ class DatabaseLink:
         try:
             self.cursor.execute('INSERT INTO files ("file-name", "uploader", "file-size-bytes", "upload-time", "is-public", "download-count") VALUES (?, ?, ?, ?, ?, ?)',
                                 (file_data['file-name'], file_data['uploader'], file_data['file-size-bytes'], file_data['upload-time'], file_data['is-public'], 0))
-            self.connection.commit()
+            if commit:
+                self.connection.commit()
         except sqlite3.IntegrityError:
             raise FileExistsError
         except KeyError:
@@ -156,28 +204,31 @@ class DatabaseLink:
         
         return dict(filedata)
     
-    def delete_file(self, file_name: str, username: str) -> None:
+    def delete_file(self, file_name: str, username: str, commit: bool = True) -> None:
         '''
         Delete a file by its name and uploader's username. Will stop silently if file isn't found
         
         Args:
             file_name [str]: File name to delete
             username [str]: Username of the file's uploader
+            commit [bool = True]: Commit right away, otherwise the write is part of the open transaction until commit() is called
 
         Returns:
             None
         '''
         self.cursor.execute('DELETE FROM files WHERE "file-name"=? AND uploader=?',
                             (file_name, username))
-        self.connection.commit()
+        if commit:
+            self.connection.commit()
 
-    def remove_user(self, username: str) -> None:
+    def remove_user(self, username: str, commit: bool = True) -> None:
         '''
         Remove a user by its username, will also remove all user's files. Will stop silently if user isn't found
         
         Args:
             file_name [str]: File name to delete
             username [str]: Username of the file's uploader
+            commit [bool = True]: Commit right away, otherwise the write is part of the open transaction until commit() is called
 
         Returns:
             None
@@ -186,9 +237,10 @@ class DatabaseLink:
                             (username,))
         self.cursor.execute('DELETE FROM files WHERE "uploader"=?',
                             (username,))
-        self.connection.commit()
+        if commit:
+            self.connection.commit()
 
-    def add_downloads_to_file(self, file_name: str, username: str, count: int=1) -> None:
+    def add_downloads_to_file(self, file_name: str, username: str, count: int=1, commit: bool = True) -> None:
         '''
         Increases the download count of a given file by a specified amount. Will stop silently if file isn't found
 
@@ -196,15 +248,39 @@ class DatabaseLink:
             file_name [str]: File name to modify
             username [str]: Username of the file's uploader
             count [int = 1]: Amount to increase by
+            commit [bool = True]: Commit right away, otherwise the write is part of the open transaction until commit() is called
 
         Returns:
             None
         '''
         self.cursor.execute('UPDATE files SET "download-count" = "download-count" + ? WHERE "file-name"=? AND "uploader"=?',
                             (count, file_name, username))
-        self.connection.commit()
+        if commit:
+            self.connection.commit()
+
+    def add_downloads_to_files(self, counts: dict[tuple[str, str], int], commit: bool = True) -> dict[tuple[str, str], int]:
+        '''
+        Increases the download counts of many files at once (meant for a single transaction, see commit). Files that aren't found are skipped, and returned
 
-    def change_file_publicity(self, file_name: str, username: str, new_status: bool | None = None) -> None:
+        Args:
+            counts [dict[tuple[str, str], int]]: Amount to increase by, by file (file name, username of the file's uploader)
+            commit [bool = True]: Commit right away, otherwise the write is part of the open transaction until commit() is called
+
+        Returns:
+            [dict[tuple[str, str], int]]: The counts of the files that weren't found
+        '''
+        missing = {}
+        for (file_name, username), count in counts.items():
+            self.cursor.execute('UPDATE files SET "download-count" = "download-count" + ? WHERE "file-name"=? AND "uploader"=?',
+                                (count, file_name, username))
+            if self.cursor.rowcount == 0:
+                missing[(file_name, username)] = count
+        if commit:
+            self.connection.commit()
+
+        return missing
+
+    def change_file_publicity(self, file_name: str, username: str, new_status: bool | None = None, commit: bool = True) -> None:
         '''
         Changes the publicity status (is_public) of a file. Will stop silently if file isn't found
 
@@ -212,6 +288,7 @@ class DatabaseLink:
             file_name [str]: File name to modify
             username [str]: Username of the file's uploader
             new_status [bool | None = None] New status (will oppose current if set to None)
+            commit [bool = True]: Commit right away, otherwise the write is part of the open transaction until commit() is called
 
         Returns:
             None
@@ -225,7 +302,8 @@ class DatabaseLink:
             
         self.cursor.execute('UPDATE files SET "is-public" = ? WHERE "file-name"=? AND "uploader"=?',
                             (new_status, file_name, username))
-        self.connection.commit()
+        if commit:
+            self.connection.commit()
 
     def get_all_user_files(self, username: str, exclude_private: bool = False) -> list[dict]:
         '''
@@ -265,6 +343,39 @@ class DatabaseLink:
         
         return dict(self.cursor.fetchone())['COUNT(*)']
     
+    def count_public_files_by_users(self, usernames: list[str]) -> dict[str, int]:
+        '''
+        Count all public files of every user in a list of usernames
+
+        Args:
+            usernames [list[str]]: Usernames of the target users
+
+        Returns:
+            [dict[str, int]]: Number of public files belonging to each user, by username
+        '''
+        return {username: self.count_public_files(username) for username in usernames}
+
+    def commit(self) -> None:
+        '''
+        Commits the open transaction (the writes made with commit=False)
+
+        Returns:
+            None
+
+        Raises:
+            sqlite3.Error: If the commit failed, the transaction should be rolled back (see rollback)
+        '''
+        self.connection.commit()
+
+    def rollback(self) -> None:
+        '''
+        Discards the open transaction (the writes made with commit=False since the last commit)
+
+        Returns:
+            None
+        '''
+        self.connection.rollback()
+
     def close(self) -> None:
         '''
         Closes connection with db
@@ -274,6 +385,66 @@ class DatabaseLink:
         '''
         self.connection.close()
 
+class ReadPool:
+    def __init__(self, db_name: str, size: int) -> None:
+        '''
+        Pool of read-only links to a .db file, safe to use from any thread. Every read checks a link out of the pool, so up to "size" reads run at once (in WAL mode they don't wait for each other or for the writer), and further reads wait for a link to be returned
+
+        Args:
+            db_name [str]: Name of database file (expects it in ./data/), its tables should already exist
+            size [int]: Amount of links in the pool
+
+        Returns:
+            None
+        '''
+        self.idle: queue.Queue[DatabaseLink] = queue.Queue()
+        for _ in range(size):
+            self.idle.put(DatabaseLink(db_name, False, True))
+
+    @contextmanager
+    def link(self) -> Iterator[DatabaseLink]:
+        '''
+        Checks a link out of the pool (waits for one if all are in use), and returns it once the block ends
+
+        Returns:
+            [Iterator[DatabaseLink]]: The link, for use by the current thread only until it's returned
+        '''
+        link = self.idle.get()
+        try:
+            yield link
+        finally:
+            self.idle.put(link)
+
+    def read(self, request: str, *args):
+        '''
+        Makes a DB read on a link of the pool
+
+        Args:
+            request [str]: The read to make (name of a DatabaseLink method)
+            *args: all arguments needed for that read
+
+        Returns:
+            The read's result
+
+        Raises:
+            Whatever the read raises
+        '''
+        with self.link() as link:
+            return getattr(link, request)(*args)
+
+    def close(self) -> None:
+        '''
+        Closes the links of the pool, expected to be called once no reads are running
+
+        Returns:
+            None
+        '''
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
 
         
 def main():
@@ -0,0 +1,115 @@
+from threading import Lock
+from typing import Callable
+
+class DownloadCounter:
+    def __init__(self) -> None:
+        '''
+        Download counts not yet written to the DB, by file (file name, uploader). Downloads are counted here instead of writing every one, and the DB writer adds the collected counts in a single transaction (see take and flushed)\n
+        Counts being written stay known until their transaction commits, so the counts read from the DB can be corrected by whatever isn't there yet (see merge). The generation changes when a commit of counts starts and again once it's done, so a read that may have seen the commit but not its end (counting the same downloads twice) can be told apart and made again\n
+        Safe to use from any thread, every method holds the counter's lock
+
+        Returns:
+            None
+        '''
+        self.lock = Lock()
+        self.pending: dict[tuple[str, str], int] = {}
+        self.flushing: dict[tuple[str, str], int] = {} #taken by the DB writer, not committed yet
+        self.generation = 0 #odd while counts are being committed
+
+    def __len__(self) -> int:
+        return len(self.pending) + len(self.flushing)
+
+    def add(self, file_name: str, uploader: str, count: int = 1) -> None:
+        '''
+        Counts downloads of a file
+
+        Args:
+            file_name [str]: Name of the file
+            uploader [str]: Username of the file's uploader
+            count [int = 1]: Amount of downloads
+
+        Returns:
+            None
+        '''
+        with self.lock:
+            key = (file_name, uploader)
+            self.pending[key] = self.pending.get(key, 0) + count
+
+    def discard(self, file_name: str | None, uploader: str) -> None:
+        '''
+        Forgets the pending counts of a deleted file (or of all files of a removed user), so a file uploaded later under the same name doesn't get them
+
+        Args:
+            file_name [str | None]: Name of the file, all of the user's files if None
+            uploader [str]: Username of the file's uploader
+
+        Returns:
+            None
+        '''
+        with self.lock:
+            if file_name is not None:
+                self.pending.pop((file_name, uploader), None)
+            else:
+                self.pending = {key: count for key, count in self.pending.items() if key[1] != uploader}
+
+    def take(self) -> dict[tuple[str, str], int]:
+        '''
+        Takes the pending counts for writing, they are still merged into reads until flushed is called. Counts taken earlier that failed to be written are given again
+
+        Returns:
+            [dict[tuple[str, str], int]]: Counts to add, by file (file name, uploader)
+        '''
+        with self.lock:
+            for key, count in self.pending.items():
+                self.flushing[key] = self.flushing.get(key, 0) + count
+            self.pending = {}
+            return dict(self.flushing)
+
+    def commit_started(self) -> None:
+        '''
+        Marks the start of the commit of the counts given by take, must be followed by flushed once the commit is done (or failed)
+
+        Returns:
+            None
+        '''
+        with self.lock:
+            self.generation += 1
+
+    def flushed(self, missing: dict[tuple[str, str], int] | None, is_pending: Callable[[str, str], bool]) -> None:
+        '''
+        Reports the outcome of writing the counts given by take
+
+        Args:
+            missing [dict[tuple[str, str], int] | None]: Counts of the files that weren't found in the DB, None if the counts weren't committed (they are given again by the next take)
+            is_pending [Callable[[str, str], bool]]: Whether a file (file name, uploader) is still being added by a queued write, the missing counts of such files are kept for the next flush and the rest are dropped. Called holding the lock, so a file deleted meanwhile has its counts discarded after they are kept (see discard)
+
+        Returns:
+            None
+        '''
+        with self.lock:
+            if missing is not None:
+                self.flushing = {}
+                for key, count in missing.items():
+                    if is_pending(*key):
+                        self.pending[key] = self.pending.get(key, 0) + count
+            self.generation += 1
+
+    def merge(self, files: list[dict], generation: int) -> list[dict] | None:
+        '''
+        Adds the downloads not yet written to the DB to the download counts of files read from it
+
+        Args:
+            files [list[dict]]: File data as read from the DB
+            generation [int]: The counter's generation from before the read
+
+        Returns:
+            [list[dict] | None]: The same files, with the corrected download counts. None if a commit of counts started or ended since "generation" (the read may or may not have the counts in it), the read should be made again
+        '''
+        with self.lock:
+            if (self.generation != generation) or (generation % 2):
+                return None
+
+            for file in files:
+                key = (file['file-name'], file['uploader'])
+                file['download-count'] += self.pending.get(key, 0) + self.flushing.get(key, 0)
+            return files
@@ -3,5 +3,9 @@ class UserNotFoundError(Exception):
         super().__init__(*args)
     
 class UserExistsError(Exception):
+    def __init__(self, *args):
+        super().__init__(*args)
+
+class FrameSizeError(Exception):
     def __init__(self, *args):
         super().__init__(*args)
\ No newline at end of file
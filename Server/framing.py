@@ -0,0 +1,4 @@
+import struct
+
+HEADER = struct.Struct('!I') #4 byte big-endian length prefix
+MAX_FRAME_SIZE = 16 * 1024 * 1024 #16 MB
@@ -1,73 +1,219 @@
 import socket
-import select
+import asyncio
 import rsa
-from cryptography import fernet
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey, X25519PublicKey
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
 
 import os
+import stat
+import time
+import sqlite3
 import shutil
 import json
 import queue
-import time
+import itertools
+import contextlib
+import multiprocessing
+from multiprocessing.connection import Connection as Pipe
 from datetime import datetime
-from threading import Thread, Event
+from threading import Thread, Event, Lock
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import colorama
 
 from exceptions import *
-from database_link import DatabaseLink
+from database_link import DatabaseLink, ReadPool
+from download_counter import DownloadCounter
+from pending_writes import PendingWrites
+from connection import Connection
+from record_layer import RecordLayer, PlaintextRecordLayer, KEY_SIZE, PACKAGE_RECORD, CHUNK_RECORD, RECORD_HEADER, PLAINTEXT, select_cipher, derive_keys
+from transfers import UploadTransfer
+from transfer_queue import TransferQueue
+from bandwidth import BandwidthShaper
+from worker_state import WorkerState
+from sessions import SessionRegistry, LOGGED_IN
 
 from package_formatter import PackageFormatter
 from package_validator import PackageValidator
 
 PATH = os.path.dirname(os.path.realpath(__file__))
 class Server:
-    def __init__(self, port: int, db_name: str):
+    def __init__(self, port: int, db_name: str, workers: int = 1, worker_state: WorkerState | None = None, unix_path: str | None = None):
         '''
         Creates the server\n
-        Requires files: package_formatter.py, package_validator.py, exceptions.py, database_link.py, and a directory "data" containing RSA encryption keys (in PEM format) in "encryption-keys", a sub-directory "files", and a .db file
+        Requires files: package_formatter.py, package_validator.py, exceptions.py, database_link.py, and a directory "data" containing RSA encryption keys (in PEM format) in "encryption-keys", a sub-directory "files", and a .db file\n
+        With more than one worker, connections are handled by worker processes (so the server can use more than one CPU core) and this process only accepts them and hands each to a worker (see dispatch_connection)\n
+        With "unix_path", clients on the same host can also connect through a Unix domain socket. Peers running as a trusted user (see is_trusted_local_peer) may skip encryption, and their downloads are sent straight from the files (see file_download)
     
         Args:
             port [int]: Port to open on
             db_name [str]: Name of .db file
+            workers [int = 1]: Amount of processes handling connections
+            worker_state [WorkerState | None = None]: State given by the main process, when created as one of its workers
+            unix_path [str | None = None]: Path of the Unix domain socket to listen on as well, no local listener if None
 
         Returns:
             None
         '''
         colorama.init(autoreset=True)
 
-        self.load_rsa_keys()
-        self.db_read = DatabaseLink(db_name)
-        self.db_write_queue = queue.Queue()
-
-        self.max_file_size = 25 * 1024 * 1024 #25 MB
+        self.worker_state = worker_state
+        self.workers: list[tuple[multiprocessing.Process, Pipe]] = []
+        if worker_state is None:
+            self.load_rsa_keys()
+            self.create_server_identity()
+            ticket_key = os.urandom(KEY_SIZE) #tickets are opened by the server that sealed them, so both directions share the key
+        else:
+            self.static_key = X25519PrivateKey.from_private_bytes(worker_state.static_key)
+            self.server_identity = worker_state.server_identity
+            ticket_key = worker_state.ticket_key
+        self.ticket_key = ticket_key
+        self.ticket_endec = RecordLayer('AES-256-GCM', ticket_key, ticket_key)
+        self.ticket_lifetime = 12 * 60 * 60 #12 hours
+        DatabaseLink(db_name).close() #creates the tables before anything reads them
+        #reads run on a pool of threads, each checking a connection out of the read pool, so a slow query only delays the request it belongs to
+        self.db_read_links = ReadPool(db_name, 4)
+        self.db_read_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='db-read')
+        #writes are committed in batches of up to "db_batch_size" writes, collected for at most "db_batch_delay" seconds (the writer never waits for writes to arrive, a batch is whatever queued up during the previous commit)
+        self.db_batch_size = 512
+        self.db_batch_delay = 0.005 #5 ms
+        #past "db_busy_threshold" queued writes, requests that would add writes are turned away. The rest of the queue is headroom for the writes of work already accepted (finished uploads, download counts)
+        self.db_write_queue = queue.Queue(maxsize=10000)
+        self.db_busy_threshold = 8000
+        #writes that found the queue full, in order, moved to the queue by a thread so the event loop never waits for room (see queue_write)
+        self.db_write_overflow: deque[tuple | None] = deque()
+        self.db_write_overflow_lock = Lock()
+        self.db_write_stats = {'batches': 0, 'writes': 0, 'failed': 0, 'rejected': 0, 'batch-time': 0.0, 'max-batch-time': 0.0, 'wait-time': 0.0, 'max-wait-time': 0.0, 'download-counts': 0}
+        #downloads are counted in memory, the writer adds the counts to the DB every "download_flush_interval" seconds (and when the server stops). Reads only see the counts of their own process in multi-process mode
+        self.download_counter = DownloadCounter()
+        #reads waiting for a commit of download counts to end (see read_db), woken by the writer
+        self.count_commit_waiters: list[asyncio.Future] = []
+        #writes in the write queue, reads of users and files apply them so a client sees its own changes right away (read-your-writes)
+        self.pending_writes = PendingWrites()
+        self.download_flush_interval = 5 #seconds
+
+        self.download_chunk_size = 64 * 1024 #64 KB
+        #large downloads are read and sealed in batches on the crypto pool (AEAD calls release the GIL), smaller ones and all control packages are sealed inline
+        #upload chunks are deliberately still opened inline: they are decrypted one record at a time as they're read, in order, and the write batching (see write_chunks) already keeps the disk off the event loop
+        self.crypto_offload_threshold = 1024 * 1024 #1 MB
+        self.crypto_batch_size = 256 * 1024 #256 KB
+        self.crypto_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix='crypto')
+        #received chunks are written, and deleted files removed, on the disk pool so a slow disk doesn't hold up the event loop
+        self.disk_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='disk')
+        self.max_queued_chunk_bytes = 1024 * 1024 #1 MB per upload stripe
+        #downloads over plaintext (local) connections are sent with sendfile, a record per call
+        self.sendfile_record_size = 1024 * 1024 #1 MB
+        #local peers running as these users may use plaintext records, anyone else is encrypted as usual
+        self.trusted_local_uids: set[int] = {os.getuid()} if hasattr(os, 'getuid') else set()
+        self.max_stripes = 8
+        self.min_stripe_size = 1024 * 1024 #1 MB
+        #transfers beyond these limits wait for a running one to finish, some slots are kept for small transfers. In multi-process mode the slots are split between the workers (a user's transfers all run on the worker its session is on, so its own limit isn't split)
+        worker_count = worker_state.workers if worker_state is not None else 1
+        self.transfers = TransferQueue(max_active=max(32 // worker_count, 2), max_active_per_user=10, reserved_slots=max(4 // worker_count, 1))
+        #bandwidth limits (in bytes per second, None for no limit) of all transfers together and of every user's transfers, adjustable from the admin console
+        self.shaper = BandwidthShaper(global_rate=None, user_rate=None)
+
+        #deadlines against slow (or silent) clients, enforced by the event loop without a thread per connection
+        self.handshake_timeout = 10 #seconds, to send the client hello
+        self.request_timeout = 30 #seconds, to send the rest of a record once it started arriving
+        #running transfers slower than this over a check window are cut off (including downloads the user never gets ready for)
+        self.min_transfer_rate = 16 * 1024 #16 KB/s
+        self.transfer_check_window = 30 #seconds
+
+        #interrupted uploads are kept here until resumed, or until they expire
+        self.staging_dir = PATH + '\\data\\files\\.staging'
+        self.staging_lifetime = 7 * 24 * 60 * 60 #7 days
+        os.makedirs(self.staging_dir, exist_ok=True)
 
         self.handle_map = {
             'login': self.handle_login_request,
             'signup': self.handle_signup_request,
             'logout': self.handle_logout_request,
             'upload_request': self.handle_upload_request,
+            'upload_resume': self.handle_upload_resume_request,
+            'upload_stripe': self.handle_upload_stripe_request,
             'download_request': self.handle_download_request,
+            'download_ready': self.handle_download_ready,
+            'download_final': self.handle_download_final,
             'file_publicity_change': self.handle_file_publicity_change_request,
             'delete_file': self.handle_file_deletion_request,
             'search_users': self.handle_user_search_request,
             'get_user_files': self.handle_user_files_request
         }
 
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server_socket.bind(('', port))
-
-        self.active_sockets: list[socket.socket] = []
-        self.socket_to_user: dict[socket.socket: str] = {}
-        self.user_endec_map: dict[socket.socket: fernet.Fernet] = {}
-        self.file_transfers: list[socket.socket] = []
+        #sessions of the connections that completed the handshake (including the data connections a logged-in client opens to transfer stripes of a file in parallel)
+        self.sessions = SessionRegistry()
+
+        #every map below is only used from the event loop's thread
+        #transfers in progress, by connection and request id
+        self.uploads: dict[tuple[Connection, int]: UploadTransfer] = {}
+        self.downloads: dict[tuple[Connection, int]: tuple[dict, list[tuple[int, int]] | None, bool]] = {}
+        #ranges of downloads the user is ready for, kept until the transfer queue lets them start
+        self.ready_downloads: dict[tuple[Connection, int]: list[tuple[int, int]]] = {}
+        self.download_tasks: dict[tuple[Connection, int]: asyncio.Task] = {}
+        #part files being closed (on the disk pool) by upload id, the upload is only opened or discarded again once that's done
+        self.closing_uploads: dict[str: asyncio.Future] = {}
+        #files of completed uploads being moved into their uploader's folder (on the disk pool), by (username, file name)
+        self.committing_files: set[tuple[str, str]] = set()
+        #write in progress of every upload stripe (on the disk pool), along with the stripe's chunks that arrived meanwhile
+        self.chunk_writes: dict[tuple[Connection, int]: tuple[asyncio.Future, list[tuple[int, bytes]]]] = {}
 
         self.close_server_event = Event()
-        
-        Thread(target=self.admin_input).start()
-        Thread(target=self.db_write, args=(db_name,)).start()
 
-    def handle_clients(self, backlog=1):
+        self.unix_path = unix_path
+        self.unix_socket: socket.socket | None = None
+        if worker_state is None:
+            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.server_socket.bind(('', port))
+            if unix_path is not None:
+                self.unix_socket = self.bind_unix_socket(unix_path)
+            self.worker_index = 0
+            staged_uploads = self.load_staged_uploads()
+            staged_upload_ids = {(meta['username'], meta['file-desc']['file-name']): upload_id for upload_id, meta in staged_uploads.items()}
+
+            if workers > 1:
+                #maps every process needs are kept by a manager process
+                self.manager = multiprocessing.get_context('spawn').Manager()
+                self.session_owners: dict[str: int] = self.manager.dict()
+                self.revoked_tickets: dict[str: int] = self.manager.dict()
+                self.staged_uploads: dict[str: dict] = self.manager.dict(staged_uploads)
+                self.staged_upload_ids: dict[tuple[str, str]: str] = self.manager.dict(staged_upload_ids)
+                self.start_workers(db_name, workers)
+            else:
+                self.session_owners: dict[str: int] = {}
+                self.revoked_tickets: dict[str: int] = {}
+                self.staged_uploads: dict[str: dict] = staged_uploads
+                self.staged_upload_ids: dict[tuple[str, str]: str] = staged_upload_ids
+
+            Thread(target=self.admin_input).start()
+        else:
+            self.worker_index = worker_state.index
+            self.session_owners: dict[str: int] = worker_state.session_owners
+            self.revoked_tickets: dict[str: int] = worker_state.revoked_tickets
+            self.staged_uploads: dict[str: dict] = worker_state.staged_uploads
+            self.staged_upload_ids: dict[tuple[str, str]: str] = worker_state.staged_upload_ids
+        #tickets this process revoked and when they can be forgotten, in revoking order (which is also expiry order). The shared maps are manager proxies in multi-process mode, where every access is a round trip to the manager, so they are only accessed by key
+        self.revoked_expiry: deque[tuple[float, str]] = deque()
+
+        if not self.workers:
+            Thread(target=self.db_write, args=(db_name,)).start()
+
+    def handle_clients(self, backlog=100):
+        '''
+        Allow the server to accept clients and handle their request. Runs the asyncio event loop until the server is stopped
+
+        Args:
+            backlog [int]: Backlog of sockets allowed to be queued for acception
+
+        Returns:
+            None
+        '''
+        asyncio.run(self.serve(backlog))
+
+    async def serve(self, backlog: int):
         '''
-        Allow the server to accept clients and handle their request
+        Accepts clients on the server socket, every connection is handled by its own task (see handle_connection)
 
         Args:
             backlog [int]: Backlog of sockets allowed to be queued for acception
@@ -75,79 +221,281 @@ class Server:
         Returns:
             None
         '''
-        self.server_socket.listen(backlog)
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        if not self.workers:
+            #transfers only run in processes that handle connections
+            self.transfer_watchdog = asyncio.create_task(self.cut_off_slow_transfers())
+
+        if self.worker_state is not None:
+            #connections are accepted by the main process
+            Thread(target=self.receive_from_main).start()
+            await self.stop_event.wait()
+            self.close_server()
+            return
+
+        handler = self.dispatch_connection if self.workers else self.handle_connection
+        server = await asyncio.start_server(handler, sock=self.server_socket, backlog=backlog)
+        if self.unix_socket is not None:
+            unix_server = await asyncio.start_unix_server(handler, sock=self.unix_socket, backlog=backlog)
+            print(f'Listening on {self.unix_path} for local clients')
+        else:
+            unix_server = contextlib.nullcontext()
         print('Server is listening...')
 
-        while not self.close_server_event.is_set():
-            r_list, _, _ = select.select(self.active_sockets + [self.server_socket], [], [], 1)
+        async with server, unix_server:
+            await self.stop_event.wait()
+        
+        self.close_server()
 
-            for client_soc in r_list:
-                if client_soc is self.server_socket:
-                    Thread(target=self.connect_new_socket).start()
-                    continue
+    def bind_unix_socket(self, path: str) -> socket.socket:
+        '''
+        Binds the local listener's Unix domain socket, a socket file left behind by an earlier run is replaced
 
-                if client_soc in self.file_transfers:
-                    continue
+        Args:
+            path [str]: Path of the socket file
+
+        Returns:
+            [socket.socket]: The bound socket
+
+        Raises:
+            OSError: If the platform has no Unix domain sockets, or the path is taken by a file that isn't a socket
+        '''
+        if not hasattr(socket, 'AF_UNIX'):
+            raise OSError('Unix domain sockets aren\'t supported on this platform')
+
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            os.remove(path)
+
+        unix_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        unix_socket.bind(path)
+        return unix_socket
+
+    def is_trusted_local_peer(self, client_soc: Connection) -> bool:
+        '''
+        Args:
+            client_soc [Connection]: A connection
+
+        Returns:
+            [bool]: Whether the connection is local, and the kernel reports its peer process runs as one of "trusted_local_uids". Only these connections may select the PLAINTEXT cipher
+        '''
+        return (client_soc.peer_credentials is not None) and (client_soc.peer_credentials[1] in self.trusted_local_uids)
+
+    def start_workers(self, db_name: str, count: int) -> None:
+        '''
+        Starts the worker processes of a multi-process server, each handling the connections handed to it through its own pipe\n
+        Workers share the server's identity and ticket key, and the maps that have to be the same for every process (who is logged-in where, revoked tickets and staged uploads)
+
+        Args:
+            db_name [str]: Name of .db file
+            count [int]: Amount of workers
+
+        Returns:
+            None
+        '''
+        context = multiprocessing.get_context('spawn')
+        static_key = self.static_key.private_bytes_raw()
+        for index in range(count):
+            receiving_pipe, sending_pipe = context.Pipe(duplex=False)
+            state = WorkerState(index, count, static_key, self.server_identity, self.ticket_key, self.session_owners, self.revoked_tickets, self.staged_uploads, self.staged_upload_ids, receiving_pipe)
+            worker = context.Process(target=run_worker, args=(db_name, state), name=f'worker-{index}')
+            worker.start()
+            receiving_pipe.close()
+            self.workers.append((worker, sending_pipe))
+
+        self.next_worker = itertools.cycle(range(count))
+        print(f'Started {count} workers.')
+
+    async def dispatch_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        '''
+        Hands a new connection to a worker process (multi-process mode). The server identity is sent and the client hello is read here, so a client presenting a session ticket is sent to the worker its session is on (data connections have to be on the same worker as their main connection)\n
+        Any other connection goes to the next worker in turn
+
+        Args:
+            reader [asyncio.StreamReader]: Stream to read from
+            writer [asyncio.StreamWriter]: Stream to write to
+
+        Returns:
+            None
+        '''
+        client_soc = Connection(reader, writer)
+        try:
+            client_soc.send_frame(self.server_identity)
+            async with asyncio.timeout(self.handshake_timeout):
+                client_hello = await client_soc.read_frame(4096)
+        except (ConnectionError, FrameSizeError, TimeoutError):
+            client_soc.close()
+            return
+
+        try:
+            ticket = self.open_session_ticket(json.loads(client_hello).get('session-ticket'))
+        except (ValueError, UnicodeDecodeError, AttributeError):
+            ticket = None
+        index = self.session_owners.get(ticket['username']) if ticket is not None else None
+        if index is None:
+            index = next(self.next_worker)
+
+        #the client only sends its hello after reading the identity, so nothing is left unsent or unread on the connection
+        transport_socket = writer.get_extra_info('socket')
+        with socket.socket(transport_socket.family, transport_socket.type, fileno=os.dup(transport_socket.fileno())) as soc:
+            self.workers[index][1].send(('connection', soc, client_hello))
+        client_soc.close()
+
+    def receive_from_main(self) -> None:
+        '''
+        Receives the connections and commands the main process sends to this worker, until told to stop
+
+        Returns:
+            None
+        '''
+        while True:
+            try:
+                message = self.worker_state.pipe.recv()
+            except EOFError:
+                #main process is gone
+                message = ('stop',)
+
+            if message[0] == 'connection':
+                _, soc, client_hello = message
+                asyncio.run_coroutine_threadsafe(self.handle_handed_connection(soc, client_hello), self.loop)
+
+            elif message[0] == 'command':
+                self.loop.call_soon_threadsafe(self.run_admin_command, message[1])
+
+            elif message[0] == 'stop':
+                self.close_server_event.set()
+                self.loop.call_soon_threadsafe(self.stop_event.set)
+                break
+
+    async def handle_handed_connection(self, soc: socket.socket, client_hello: bytes):
+        '''
+        Handles a connection handed over by the main process (multi-process mode)
+
+        Args:
+            soc [socket.socket]: The connection's socket
+            client_hello [bytes]: Client hello the main process already read from it
+
+        Returns:
+            None
+        '''
+        try:
+            reader, writer = await asyncio.open_connection(sock=soc)
+        except OSError:
+            soc.close()
+            return
+
+        await self.handle_connection(reader, writer, client_hello)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, client_hello: bytes | None = None):
+        '''
+        Handles a single connection, from the handshake until it closes. Records are handled in the order they arrive (DB reads are awaited off the event loop), transfers run in tasks of their own
+
+        Args:
+            reader [asyncio.StreamReader]: Stream to read from
+            writer [asyncio.StreamWriter]: Stream to write to
+            client_hello [bytes | None = None]: Client hello already read from the connection (multi-process mode), the handshake starts from the beginning if not given
+
+        Returns:
+            None
+        '''
+        client_soc = Connection(reader, writer)
+        if not await self.connect_new_socket(client_soc, client_hello):
+            return
 
-                data = self.read_from_socket(client_soc)
-                if not data:
-                    self.close_socket(client_soc)
+        try:
+            while True:
+                try:
+                    data = await client_soc.read_frame(timeout=self.request_timeout)
+                except (ConnectionError, FrameSizeError):
+                    break
+                except TimeoutError:
+                    print(f'{colorama.Fore.RED}{client_soc.getpeername()} didn\'t finish sending a record in time, closing')
+                    break
+
+                try:
+                    kind, request_id, offset, payload = client_soc.endec.open(data)
+                except InvalidTag:
+                    #nothing else on this connection can be trusted after a record fails authentication
+                    print(f'{colorama.Fore.RED}Received a record that failed authentication, closing')
+                    break
+
+                if kind == CHUNK_RECORD:
+                    upload = self.uploads.get((client_soc, request_id))
+                    await self.handle_chunk(client_soc, request_id, offset, payload)
+                    if upload is not None:
+                        #the next record is only read once the upload got its share of the bandwidth, which holds the client back
+                        await self.acquire_bandwidth(upload.stripe_owner(0), upload.username, len(payload))
                     continue
 
-                converted, package = self.data_to_package(data, self.user_endec_map[client_soc])
+                converted, package = self.data_to_package(payload)
                 if not converted:
                     response_package = PackageFormatter.invalid_package(package)
-                    self.send_package(client_soc, response_package)
+                    self.send_package(client_soc, response_package, request_id)
                     continue
+                package['request-id'] = request_id
                 print(f'{colorama.Fore.GREEN}{package}')
 
                 is_valid, invalid_response = PackageValidator.validate_package(package)
                 if is_valid:
+                    #handlers reading the DB are awaited here, so responses on a connection keep the order of its requests
                     response_package = self.handle_map[package['type']](client_soc, package)
+                    if asyncio.iscoroutine(response_package):
+                        response_package = await response_package
                 else:
                     response_package = PackageFormatter.invalid_package(invalid_response)
 
+                if response_package is None:
+                    #handled without a response (transfer control packages)
+                    continue
+
                 print(f'{colorama.Fore.BLUE}{response_package}')
-                self.send_package(client_soc, response_package)
-        
-        self.close_server()
+                self.send_package(client_soc, response_package, request_id)
+        finally:
+            self.close_socket(client_soc)
 
-    def handle_login_request(self, client_soc: socket.socket, package: dict):
+    async def handle_login_request(self, client_soc: Connection, package: dict):
         '''
         Handles a login request by a user
 
         Args:
-            client_soc [socket.socket]: The user's socket
+            client_soc [Connection]: The user's connection
             package [dict]: Package sent by the user
 
         Returns:
             [dict]: Response package for the user
         '''
         try:
-            user = self.db_read.get_user(package['username'])
+            user = await self.read_db('get_user', package['username'])
         except UserNotFoundError:
             return PackageFormatter.response_package('login_response', False, 'User doesn\'t exist')
         
         if package['password-hash'] != user['password-hash']:
             return PackageFormatter.response_package('login_response', False, 'Incorrect password')
         
-        if package['username'] in self.socket_to_user.values():
+        if self.sessions.is_logged_in(package['username']) or (not self.claim_session(package['username'])):
             return PackageFormatter.response_package('login_response', False, 'User is logged-in from another location')
         
-        self.socket_to_user[client_soc] = package['username']
-        return PackageFormatter.response_package('login_response', True, self.db_read.get_all_user_files(package['username']))
+        self.end_session(client_soc)
+        self.sessions.log_in(client_soc, package['username'])
+        response_package = PackageFormatter.response_package('login_response', True)
+        response_package['session-ticket'] = self.issue_session_ticket(client_soc, package['username'])
+        response_package['response'] = await self.read_db('get_all_user_files', package['username'])
+        return response_package
     
-    def handle_signup_request(self, client_soc: socket.socket, package: dict):
+    def handle_signup_request(self, client_soc: Connection, package: dict):
         '''
         Handles a signup request by a user
 
         Args:
-            client_soc [socket.socket]: The user's socket
+            client_soc [Connection]: The user's connection
             package [dict]: Package sent by the user
 
         Returns:
             [dict]: Response package for the user
         '''
+        if self.db_write_backpressure():
+            return PackageFormatter.response_package('signup_response', False, 'Server is busy, try again later')
+
         user_folder_path = PATH + f'\\data\\files\\{package['username']}'
         try:
             os.makedirs(user_folder_path)
@@ -155,216 +503,708 @@ class Server:
             return PackageFormatter.response_package('signup_response', False, 'Username taken')
         
         self.add_to_write_queue('add_user', package['username'], package['password-hash'])
-        self.socket_to_user[client_soc] = package['username']
-        return PackageFormatter.response_package('signup_response', True)
+        self.end_session(client_soc)
+        self.session_owners[package['username']] = self.worker_index
+        self.sessions.log_in(client_soc, package['username'])
+        response_package = PackageFormatter.response_package('signup_response', True)
+        response_package['session-ticket'] = self.issue_session_ticket(client_soc, package['username'])
+        return response_package
     
-    def handle_logout_request(self, client_soc: socket.socket, package: dict):
+    def handle_logout_request(self, client_soc: Connection, package: dict):
         '''
         Handles a logout request by a user
 
         Args:
-            client_soc [socket.socket]: The user's socket
+            client_soc [Connection]: The user's connection
             package [dict]: Package sent by the user
 
         Returns:
             [dict]: Response package for the user
         '''
-        try:
-            self.socket_to_user.pop(client_soc)
-        except KeyError:
+        if self.end_session(client_soc) is None:
             return PackageFormatter.response_package('logout_response', False, 'User was not connected')
         
         return PackageFormatter.response_package('logout_response', True)
+
+    def end_session(self, client_soc: Connection) -> str | None:
+        '''
+        Logs a connection out: its session ticket is revoked, its data connections are closed and the user's session is released. Done on logout, and before a logged-in connection logs in (or signs up) as another user
+
+        Args:
+            client_soc [Connection]: The user's connection
+
+        Returns:
+            [str | None]: Username the connection was logged-in as, None if it wasn't logged-in
+        '''
+        username = self.sessions.log_out(client_soc)
+        if username is not None:
+            self.revoke_session_ticket(client_soc)
+            self.close_data_connections(client_soc)
+            self.release_session(username)
+
+        return username
     
-    def handle_upload_request(self, client_soc: socket.socket, package: dict):
+    async def handle_upload_request(self, client_soc: Connection, package: dict):
         '''
-        Handles a file upload request by a user
+        Handles a file upload request by a user. Once accepted, the file's chunks are expected as chunk records carrying the request's id\n
+        The upload is staged under an upload id, which the user can use to resume the upload if it gets interrupted (see handle_upload_resume_request)\n
+        If the package has "stripes", the file is split into up to that many stripes. The request sends the first one, the rest are claimed by data connections (see handle_upload_stripe_request)\n
+        On a busy server the upload waits for a free slot, small uploads (and ones marked with "urgent") are started first (see TransferQueue)
 
         Args:
-            client_soc [socket.socket]: The user's socket
+            client_soc [Connection]: The user's connection
             package [dict]: Package sent by the user
 
         Returns:
             [dict]: Response package for the user
         '''
+        if self.db_write_backpressure():
+            return PackageFormatter.response_package('upload_request_response', False, 'Server is busy, try again later')
+
         file_data = package['file-data']
+        username = self.sessions.username(client_soc)
         try:
-            self.db_read.get_file(file_data['file-name'], self.socket_to_user[client_soc])
+            await self.read_db('get_file', file_data['file-name'], username)
         except FileNotFoundError:
             pass
         else:
             #file exists
             return PackageFormatter.response_package('upload_request_response', False, 'File already exists')
 
-        if (file_data['file-size-bytes']) > self.max_file_size:
+        if any((upload.username, upload.file_desc['file-name']) == (username, file_data['file-name']) for upload in self.uploads.values()) or ((username, file_data['file-name']) in self.committing_files):
+            return PackageFormatter.response_package('upload_request_response', False, 'File is already being uploaded')
+
+        if (file_data['file-size-bytes']) > shutil.disk_usage(PATH).free:
             return PackageFormatter.response_package('upload_request_response', False, 'File too large')
 
-        Thread(target=self.file_upload, args=(client_soc, file_data)).start()
-        return PackageFormatter.response_package('upload_request_response', True)
+        #a new upload of the same file replaces an older interrupted one
+        staged_id = self.staged_upload_ids.pop((username, file_data['file-name']), None)
+        if staged_id is not None:
+            self.staged_uploads.pop(staged_id, None)
+            await self.wait_for_upload_close(staged_id)
+            await self.loop.run_in_executor(self.disk_pool, UploadTransfer.discard, self.staging_dir, staged_id)
+
+        file_data['upload-time'] = round(datetime.now().timestamp())
+        upload_id, meta = await self.loop.run_in_executor(self.disk_pool, UploadTransfer.stage, self.staging_dir, username, file_data)
+        self.staged_uploads[upload_id] = meta
+        self.staged_upload_ids[(username, file_data['file-name'])] = upload_id
+        upload = await self.open_upload(upload_id, meta, package)
+        stripes, position = self.start_upload(client_soc, package, upload)
+        print(f'{client_soc.getpeername()[0]} started uploading {file_data['file-name']}')
+
+        response_package = PackageFormatter.response_package('upload_request_response', True, {'upload-id': upload_id, 'offset': 0, 'stripes': stripes})
+        if position:
+            response_package['queue'] = self.queue_status((client_soc, package['request-id']), position)
+        return response_package
+
+    async def handle_upload_resume_request(self, client_soc: Connection, package: dict):
+        '''
+        Handles an upload resume request by a user, for an upload that was interrupted. Responds with the committed offset, the rest of the file's chunks are expected from it as chunk records carrying the request's id (or split into stripes, like in handle_upload_request)
+
+        Args:
+            client_soc [Connection]: The user's connection
+            package [dict]: Package sent by the user
+
+        Returns:
+            [dict]: Response package for the user
+        '''
+        username = self.sessions.username(client_soc)
+        upload_id = package['upload-id']
+
+        meta = self.staged_uploads.get(upload_id)
+        if (meta is None) or (meta['username'] != username):
+            return PackageFormatter.response_package('upload_resume_response', False, 'Upload doesn\'t exist')
+
+        #the upload might still be attached to the connection the user reconnected from
+        for upload in {id(upload): upload for upload in self.uploads.values() if upload.upload_id == upload_id}.values():
+            self.detach_upload(upload)
+            self.close_upload(upload)
+
+        upload = await self.open_upload(upload_id, meta, package)
+        if (upload.file_desc['file-size-bytes'] - upload.offset) > shutil.disk_usage(PATH).free:
+            self.close_upload(upload)
+            return PackageFormatter.response_package('upload_resume_response', False, 'File too large')
+
+        stripes, position = self.start_upload(client_soc, package, upload)
+        print(f'{client_soc.getpeername()[0]} resumed uploading {upload.file_desc['file-name']} from {upload.offset}')
+
+        response_package = PackageFormatter.response_package('upload_resume_response', True, {'upload-id': upload_id, 'offset': upload.offset, 'stripes': stripes})
+        if position:
+            response_package['queue'] = self.queue_status((client_soc, package['request-id']), position)
+        return response_package
+
+    def start_upload(self, client_soc: Connection, package: dict, upload: UploadTransfer) -> tuple[list[tuple[int, int]], int]:
+        '''
+        Registers the request as the sender of the first stripe of an accepted upload (split by open_upload)\n
+        The upload is added to the transfer queue, if it has to wait the user is sent upload_start once it can start
+
+        Args:
+            client_soc [Connection]: The user's connection
+            package [dict]: Upload (or upload resume) request package
+            upload [UploadTransfer]: The accepted upload
+
+        Returns:
+            [tuple[list[tuple[int, int]], int]]: Tuple containing 2 elements, first is the [start, end) byte range of every stripe, second is the upload's position in the transfer queue (0 if it can start right away)
+        '''
+        stripes = [(start, end) for start, _, end in upload.stripes]
+
+        transfer_key = (client_soc, package['request-id'])
+        upload.claim_stripe(transfer_key, 0)
+        self.uploads[transfer_key] = upload
+
+        start = lambda: self.send_package(client_soc, PackageFormatter.response_package('upload_start', True), package['request-id'])
+        position = self.transfers.request(transfer_key, upload.username, upload.file_desc['file-size-bytes'] - upload.offset, start, package.get('urgent') is True)
+        return (stripes, position)
+
+    async def open_upload(self, upload_id: str, meta: dict, package: dict) -> UploadTransfer:
+        '''
+        Opens a staged upload's part file and splits the rest of the file into the stripes asked for, on the disk pool. Waits for the upload to be closed first if it's still being closed
+
+        Args:
+            upload_id [str]: Id of the upload
+            meta [dict]: Description of the upload
+            package [dict]: Upload (or upload resume) request package
+
+        Returns:
+            [UploadTransfer]: The opened upload
+        '''
+        def open_and_split() -> UploadTransfer:
+            upload = UploadTransfer(upload_id, self.staging_dir, meta)
+            upload.split(min(package.get('stripes', 1), self.max_stripes), self.min_stripe_size)
+            return upload
+
+        await self.wait_for_upload_close(upload_id)
+        return await self.loop.run_in_executor(self.disk_pool, open_and_split)
+
+    def close_upload(self, upload: UploadTransfer) -> None:
+        '''
+        Closes an upload's part file on the disk pool (see UploadTransfer.close), it waits there for a chunk being written instead of holding up the event loop
+
+        Args:
+            upload [UploadTransfer]: The upload
+
+        Returns:
+            None
+        '''
+        closing = self.loop.run_in_executor(self.disk_pool, upload.close)
+        self.closing_uploads[upload.upload_id] = closing
+        def closed(_):
+            if self.closing_uploads.get(upload.upload_id) is closing:
+                self.closing_uploads.pop(upload.upload_id)
+        closing.add_done_callback(closed)
+
+    async def wait_for_upload_close(self, upload_id: str) -> None:
+        '''
+        Waits for an upload's part file to be closed, if it's being closed (see close_upload)
+
+        Args:
+            upload_id [str]: Id of the upload
+
+        Returns:
+            None
+        '''
+        closing = self.closing_uploads.get(upload_id)
+        if closing is not None:
+            await asyncio.wait([closing])
+
+    def handle_upload_stripe_request(self, client_soc: Connection, package: dict):
+        '''
+        Handles an upload stripe request, sent (usually through a data connection) to send one stripe of an accepted striped upload. Once accepted, the stripe's chunks are expected as chunk records carrying the request's id
+
+        Args:
+            client_soc [Connection]: The user's connection
+            package [dict]: Package sent by the user
+
+        Returns:
+            [dict]: Response package for the user
+        '''
+        username = self.sessions.username(client_soc)
+        upload = next((upload for upload in self.uploads.values() if upload.upload_id == package['upload-id']), None)
+        if (upload is None) or (upload.username != username) or (not self.transfers.is_active(upload.stripe_owner(0))):
+            return PackageFormatter.response_package('upload_stripe_response', False, 'Upload isn\'t active')
+
+        transfer_key = (client_soc, package['request-id'])
+        if not upload.claim_stripe(transfer_key, package['stripe']):
+            return PackageFormatter.response_package('upload_stripe_response', False, 'Invalid stripe')
+
+        self.uploads[transfer_key] = upload
+        return PackageFormatter.response_package('upload_stripe_response', True)
     
-    def file_upload(self, client_soc: socket.socket, file_desc: dict):
+    async def handle_chunk(self, client_soc: Connection, request_id: int, offset: int, chunk: bytes):
         '''
-        File upload function, expected to run in a different thread from main server
+        Handles a chunk record, writing it to the upload it belongs to on the disk pool. Finishes the upload once all of the file's bytes arrived (see chunks_written)\n
+        Chunks are written as they arrive so memory use stays the same for any file size. Chunks that arrive while the stripe's previous chunks are being written are written together once that's done, past "max_queued_chunk_bytes" the connection's next record waits for it
 
         Args:
-            client_soc [socket.socket]: The user's socket
-            file_desc [dict]: Description of file to upload
+            client_soc [Connection]: The user's connection
+            request_id [int]: Id of the upload request the chunk belongs to
+            offset [int]: Offset of the chunk in the file
+            chunk [bytes]: Decrypted chunk
 
         Returns:
             None
         '''
-        self.file_transfers.append(client_soc)
-        print(f'{client_soc.getpeername()[0]} entered file transfer')
+        transfer_key = (client_soc, request_id)
+        upload = self.uploads.get(transfer_key)
+        if upload is None:
+            #chunks of an upload that already failed
+            return
 
-        data = self.read_from_socket(client_soc)
-        if not data:
-            self.close_socket(client_soc)
+        if (upload.stripe_owners[transfer_key] == 0) and (not self.transfers.is_active(transfer_key)):
+            self.finish_upload(upload, False, 'Upload is still queued')
             return
-        
-        converted, header_package = self.data_to_package(data, self.user_endec_map[client_soc])
-        if not converted:
-            response_package = PackageFormatter.invalid_package('Could not convert data to package')
-            self.send_package(client_soc, response_package)
+
+        writes = self.chunk_writes.get(transfer_key)
+        if writes is None:
+            self.write_chunks(upload, transfer_key, [(offset, chunk)])
             return
-        
-        keys = ['type', 'encrypted-size']
-        if (not all(key in header_package for key in keys)) or (header_package['type'] != 'upload_start'):
-            response_package = PackageFormatter.invalid_package('Invalid header package')
-            self.send_package(client_soc, response_package)
+
+        write, queued = writes
+        queued.append((offset, chunk))
+        if sum(len(queued_chunk) for _, queued_chunk in queued) >= self.max_queued_chunk_bytes:
+            await asyncio.wait([write])
+
+    def write_chunks(self, upload: UploadTransfer, transfer_key: tuple[Connection, int], chunks: list[tuple[int, bytes]]):
+        '''
+        Writes chunks of an upload stripe on the disk pool, chunks of the stripe that arrive meanwhile are queued for its next write (see handle_chunk)
+
+        Args:
+            upload [UploadTransfer]: The upload
+            transfer_key [tuple[Connection, int]]: Connection and request id sending the stripe
+            chunks [list[tuple[int, bytes]]]: Offset and data of every chunk, in the order they arrived
+
+        Returns:
+            None
+        '''
+        write = self.loop.run_in_executor(self.disk_pool, upload.write_chunks, transfer_key, chunks)
+        queued = []
+        self.chunk_writes[transfer_key] = (write, queued)
+        write.add_done_callback(lambda write: self.chunks_written(upload, transfer_key, sum(len(chunk) for _, chunk in chunks), queued, write))
+
+    def chunks_written(self, upload: UploadTransfer, transfer_key: tuple[Connection, int], size: int, queued: list[tuple[int, bytes]], write: asyncio.Future):
+        '''
+        Handles the result of writing chunks of an upload stripe (see write_chunks). Writes the chunks queued meanwhile, or finishes the upload if a chunk was unexpected or the file is complete
+
+        Args:
+            upload [UploadTransfer]: The upload
+            transfer_key [tuple[Connection, int]]: Connection and request id sending the stripe
+            size [int]: Size of the written chunks together
+            queued [list[tuple[int, bytes]]]: Chunks of the stripe that arrived while they were written
+            write [asyncio.Future]: The finished write, its result is whether all of the chunks were accepted
+
+        Returns:
+            None
+        '''
+        self.chunk_writes.pop(transfer_key, None)
+        if (self.uploads.get(transfer_key) is not upload) or write.cancelled():
+            #the upload was finished (or its connection closed) while the chunks were written
             return
-        
-        unix_timestamp = round(datetime.now().timestamp())
-        file_desc['upload-time'] = unix_timestamp
 
-        file_encrypted = client_soc.recv(header_package['encrypted-size'])
-        try:
-            file = self.user_endec_map[client_soc].decrypt(file_encrypted)
-        except fernet.InvalidToken:
-            completed = False
+        if write.exception() is not None:
+            print(f'{colorama.Fore.RED}Failed to write chunks of {upload.file_desc['file-name']}: {write.exception()}')
+            self.finish_upload(upload, False, 'Failed to write the file')
+        elif not write.result():
+            self.finish_upload(upload, False, 'Unexpected chunk')
         else:
-            completed = True
+            self.transfers.add_progress(upload.stripe_owner(0), size)
+            if upload.is_complete():
+                self.finish_upload(upload, True)
+            elif queued:
+                self.write_chunks(upload, transfer_key, queued)
+
+    def finish_upload(self, upload: UploadTransfer, completed: bool, reason: str = ''):
+        '''
+        Finishes an upload, adding the file to the user's files if completed. An upload that isn't completed stays staged so it can be resumed\n
+        The result is sent to the request that started the upload
+
+        Args:
+            upload [UploadTransfer]: The upload
+            completed [bool]: Whether the whole file was received
+            reason [str = ""]: Reason the upload failed (if not completed)
+
+        Returns:
+            None
+        '''
+        client_soc, request_id = self.detach_upload(upload)
 
-        file_data = file_desc.copy() if completed else 'Failed to decrypt file'
         if completed:
+            self.staged_uploads.pop(upload.upload_id)
+            self.staged_upload_ids.pop((upload.username, upload.file_desc['file-name']), None)
+            self.committing_files.add((upload.username, upload.file_desc['file-name']))
+            self.loop.create_task(self.commit_upload(upload, client_soc, request_id))
+            return
+
+        self.close_upload(upload)
+        file_data = f'{reason}, upload can be resumed from offset {upload.committed_offset()}'
+        finish_package = PackageFormatter.response_package('upload_final', False, file_data)
+        self.send_package(client_soc, finish_package, request_id)
+        print(f'{client_soc.getpeername()[0]} finished uploading {upload.file_desc['file-name']}')
+
+    async def commit_upload(self, upload: UploadTransfer, client_soc: Connection, request_id: int) -> None:
+        '''
+        Adds the file of a completed upload to the user's files (see add_file_by_username), then sends the result to the request that started the upload. The file's name can't be uploaded again meanwhile (see committing_files)
+
+        Args:
+            upload [UploadTransfer]: The completed upload
+            client_soc [Connection]: Connection of the request that started the upload
+            request_id [int]: Id of the request that started the upload
+
+        Returns:
+            None
+        '''
+        try:
+            await self.add_file_by_username(upload.username, upload, upload.file_desc)
+        except OSError as e:
+            print(f'{colorama.Fore.RED}Failed to store {upload.file_desc['file-name']}: {e}')
+            finish_package = PackageFormatter.response_package('upload_final', False, 'Failed to store the file')
+        else:
+            file_data = upload.file_desc.copy()
             file_data['download-count'] = 0
+            finish_package = PackageFormatter.response_package('upload_final', True, file_data)
+        finally:
+            self.committing_files.discard((upload.username, upload.file_desc['file-name']))
 
-        finish_package = PackageFormatter.response_package('upload_final', completed, file_data)
-        self.send_package(client_soc, finish_package)
+        self.send_package(client_soc, finish_package, request_id)
+        print(f'{client_soc.getpeername()[0]} finished uploading {upload.file_desc['file-name']}')
 
-        if completed:
-            self.add_file_by_username(self.socket_to_user[client_soc], file, file_desc)
+    def detach_upload(self, upload: UploadTransfer) -> tuple[Connection, int]:
+        '''
+        Removes an upload from every request sending it
 
-        self.file_transfers.remove(client_soc)
-        print(f'{client_soc.getpeername()[0]} finished file transfer')
+        Args:
+            upload [UploadTransfer]: The upload
 
-    def handle_download_request(self, client_soc: socket.socket, package: dict):
+        Returns:
+            [tuple[Connection, int]]: Connection and request id of the request that started the upload (sender of the first stripe)
         '''
-        Handles a file download request by a user
+        for transfer_key, index in upload.stripe_owners.items():
+            self.uploads.pop(transfer_key, None)
+            if index == 0:
+                owner = transfer_key
+
+        self.transfers.release(owner, upload.received)
+        return owner
+
+    async def handle_download_request(self, client_soc: Connection, package: dict):
+        '''
+        Handles a file download request by a user. The download starts once the user sends download_ready with the same request id\n
+        If the package has "ranges" (list of [start, end] byte ranges, end is exclusive or None for the end of the file), only those ranges of the file are sent. Ranged downloads are only counted as downloads if marked with "resumed" (the rest of a cut off download)\n
+        On a busy server the download waits for a free slot, small downloads (and ones marked with "urgent") are started first (see TransferQueue)
 
         Args:
-            client_soc [socket.socket]: The user's socket
+            client_soc [Connection]: The user's connection
             package [dict]: Package sent by the user
 
         Returns:
             [dict]: Response package for the user
         '''
-        file = self.db_read.get_file(package['file-name'], package['username'])
-        if (package['username'] != self.socket_to_user[client_soc]) and (not file['is-public']):
+        username = self.sessions.username(client_soc)
+        try:
+            file = await self.read_db('get_file', package['file-name'], package['username'])
+        except FileNotFoundError:
+            return PackageFormatter.response_package('download_request_response', False, 'File doesn\'t exist')
+
+        if (package['username'] != username) and (not file['is-public']):
             return PackageFormatter.response_package('download_request_response', False, 'No access to file')
         
-        Thread(target=self.file_download, args=(client_soc, file, package['username'])).start()
-        return PackageFormatter.response_package('download_request_response', True)
+        ranges = package.get('ranges')
+        if ranges is not None:
+            ranges = self.normalize_ranges(ranges, file['file-size-bytes'])
+
+        counted = (ranges is None) or (package.get('resumed') is True)
+        transfer_key = (client_soc, package['request-id'])
+        self.downloads[transfer_key] = (file, ranges, counted)
+
+        size = file['file-size-bytes'] if ranges is None else sum(end - start for start, end in ranges)
+        start = lambda: self.start_download(client_soc, package['request-id'])
+        position = self.transfers.request(transfer_key, username, size, start, package.get('urgent') is True)
+
+        response_package = PackageFormatter.response_package('download_request_response', True, file['file-size-bytes'])
+        if position:
+            response_package['queue'] = self.queue_status(transfer_key, position)
+        return response_package
+
+    def handle_download_ready(self, client_soc: Connection, package: dict):
+        '''
+        Handles a download ready package, starting the download it belongs to in a task of its own (once the transfer queue lets it start)\n
+        A whole-file download can still be narrowed to "ranges" here (the first stripe of a striped download, while data connections download the other stripes). A download is only started once, another download ready for it is refused
+
+        Args:
+            client_soc [Connection]: The user's connection
+            package [dict]: Package sent by the user
+
+        Returns:
+            [dict | None]: Response package for the user, None if the download started
+        '''
+        transfer_key = (client_soc, package['request-id'])
+        download = self.downloads.get(transfer_key)
+        if download is None:
+            return PackageFormatter.invalid_package('No accepted download for this request')
+
+        if (transfer_key in self.ready_downloads) or (transfer_key in self.download_tasks):
+            return PackageFormatter.invalid_package('Download already started')
+
+        file, ranges, _ = download
+        if 'ranges' in package:
+            if ranges is not None:
+                return PackageFormatter.invalid_package('Download is already ranged')
+            ranges = self.normalize_ranges(package['ranges'], file['file-size-bytes'])
+        elif ranges is None:
+            ranges = [(0, file['file-size-bytes'])]
+
+        self.ready_downloads[transfer_key] = ranges
+        self.start_download(client_soc, package['request-id'])
+        return None
+
+    def start_download(self, client_soc: Connection, request_id: int) -> None:
+        '''
+        Starts a download in a task of its own, once the user is ready for it and the transfer queue lets it start
+
+        Args:
+            client_soc [Connection]: The user's connection
+            request_id [int]: Id of the download request
+
+        Returns:
+            None
+        '''
+        transfer_key = (client_soc, request_id)
+        if (transfer_key not in self.ready_downloads) or (not self.transfers.is_active(transfer_key)):
+            return
+
+        file, _, _ = self.downloads[transfer_key]
+        ranges = self.ready_downloads.pop(transfer_key)
+        self.download_tasks[transfer_key] = asyncio.create_task(self.file_download(client_soc, request_id, self.sessions.username(client_soc), file, file['uploader'], ranges))
+
+    def handle_download_final(self, client_soc: Connection, package: dict):
+        '''
+        Handles a download final package, counting the download if the user received the file (a whole file, or the rest of a cut off download). A download that is still being sent is stopped, the user is done with it either way
+
+        Args:
+            client_soc [Connection]: The user's connection
+            package [dict]: Package sent by the user
+
+        Returns:
+            None
+        '''
+        transfer_key = (client_soc, package['request-id'])
+        self.ready_downloads.pop(transfer_key, None)
+        task = self.download_tasks.pop(transfer_key, None)
+        if task is not None:
+            task.cancel()
+        self.transfers.release(transfer_key)
+        try:
+            file, _, counted = self.downloads.pop(transfer_key)
+        except KeyError:
+            return None
+
+        if package['received'] and counted:
+            self.download_counter.add(file['file-name'], file['uploader'])
+        return None
     
-    def file_download(self, client_soc: socket.socket, file_desc: dict, uploader: str):
+    async def file_download(self, client_soc: Connection, request_id: int, username: str, file_desc: dict, uploader: str, ranges: list[tuple[int, int]]):
         '''
-        File download function, expected to run in a different thread from main server
+        File download task\n
+        Streams the requested ranges of the file as separately encrypted chunk records. Downloads of at least "crypto_offload_threshold" bytes are read and sealed in batches on the crypto pool, so the event loop only queues the ready records; smaller ones are sealed inline. Every batch waits for its share of the bandwidth (see BandwidthShaper), and for the connection to drain, so a slow client doesn't make the server queue the whole file. The connection stays available for other requests meanwhile\n
+        On plaintext (local) connections nothing has to be sealed, so every chunk record's data is sent straight from the file by the kernel (see Connection.send_file_frame)
 
         Args:
-            client_soc [socket.socket]: The user's socket
+            client_soc [Connection]: The user's connection
+            request_id [int]: Id of the download request
+            username [str]: Username of the user downloading the file
             file_desc [dict]: Description of file to download
             uploader [str]: Username of file's uploader
+            ranges [list[tuple[int, int]]]: Sorted, non-overlapping [start, end) byte ranges to send
             
         Returns:
             None
         '''
-        #delay to adjust for client time
-        time.sleep(1)
+        file_path = PATH + f'\\data\\files\\{uploader}\\{file_desc['file-name']}'
+        zero_copy = client_soc.endec.cipher == PLAINTEXT
+        f = None
+        sent = 0
+        try:
+            loop = asyncio.get_running_loop()
+            file_size = os.path.getsize(file_path)
+            header_package = {
+                "type": "download_start",
+                "file-size-bytes": file_size,
+                "upload-time": file_desc['upload-time'],
+                "ranges": ranges,
+                "chunk-size": self.sendfile_record_size if zero_copy else self.download_chunk_size
+            }
+            self.send_package(client_soc, header_package, request_id)
+
+            if zero_copy:
+                f = open(file_path, 'rb')
+            offload = sum(end - start for start, end in ranges) >= self.crypto_offload_threshold
+            for start, end in ranges:
+                offset = start
+                while offset < end:
+                    if zero_copy:
+                        batch_end = min(end, file_size, offset + self.sendfile_record_size)
+                        if batch_end <= offset:
+                            break #the file is shorter than expected
+
+                        await self.acquire_bandwidth((client_soc, request_id), username, batch_end - offset)
+                        await client_soc.send_file_frame(RECORD_HEADER.pack(CHUNK_RECORD, request_id, offset), f, offset, batch_end - offset)
+                    else:
+                        batch_end = min(end, offset + self.crypto_batch_size)
+                        await self.acquire_bandwidth((client_soc, request_id), username, batch_end - offset)
+                        if offload:
+                            records, batch_end = await loop.run_in_executor(self.crypto_pool, self.seal_file_range, client_soc.endec, file_path, request_id, offset, batch_end)
+                        else:
+                            records, batch_end = self.seal_file_range(client_soc.endec, file_path, request_id, offset, batch_end)
+                        if batch_end == offset:
+                            break #the file is shorter than expected
+
+                        for record in records:
+                            client_soc.send_frame(record)
+                    self.transfers.add_progress((client_soc, request_id), batch_end - offset)
+                    sent += batch_end - offset
+                    offset = batch_end
+                    await client_soc.drain()
+        except OSError:
+            #connection lost mid-download
+            self.downloads.pop((client_soc, request_id), None)
+        finally:
+            if f is not None:
+                f.close()
+            if self.download_tasks.get((client_soc, request_id)) is asyncio.current_task():
+                self.download_tasks.pop((client_soc, request_id))
+            self.transfers.release((client_soc, request_id), sent)
+
+    def seal_file_range(self, endec: RecordLayer, file_path: str, request_id: int, start: int, end: int) -> tuple[list[bytes], int]:
+        '''
+        Reads a byte range of a file and seals it as chunk records, through a single reused buffer. Runs on the crypto pool for large downloads, the file is opened by every call so a cancelled download never closes it under a running batch
 
-        file_name: str = file_desc['file-name']
-        user_endec: fernet.Fernet = self.user_endec_map[client_soc]
+        Args:
+            endec [RecordLayer]: Record layer of the connection the records are sent on
+            file_path [str]: Path to the file
+            request_id [int]: Id of the download request
+            start [int]: Offset to start reading from
+            end [int]: Offset to stop reading at
 
-        file_path = PATH + f'\\data\\files\\{uploader}\\{file_name}'
+        Returns:
+            [tuple[list[bytes], int]]: Tuple containing 2 elements, first is the sealed records, second is the offset reading stopped at (before "end" if the file is shorter)
+        '''
+        buffer = bytearray(self.download_chunk_size)
+        view = memoryview(buffer)
+        records = []
         with open(file_path, 'rb') as f:
-            file_data = f.read()
+            f.seek(start)
+            offset = start
+            while (offset < end) and (count := f.readinto(view[:min(self.download_chunk_size, end - offset)])):
+                records.append(endec.seal(CHUNK_RECORD, request_id, view[:count], offset))
+                offset += count
 
-        encrypted = user_endec.encrypt(file_data)
-        header_package = {
-            "type": "download_start",
-            "encrypted-size": len(encrypted)
+        return (records, offset)
+
+    def queue_status(self, transfer_key: tuple[Connection, int], position: int) -> dict:
+        '''
+        Describes where a waiting transfer is in the transfer queue, sent to the user along with the accepted request
+
+        Args:
+            transfer_key [tuple[Connection, int]]: Connection and request id of the transfer
+            position [int]: Position of the transfer in the queue
+
+        Returns:
+            [dict]: Queue description, containing the position and the estimated start time
+        '''
+        return {
+            "position": position,
+            "estimated-start": round(datetime.now().timestamp() + self.transfers.estimated_wait(transfer_key))
         }
-        self.send_package(client_soc, header_package)
-        client_soc.sendall(encrypted)
-        
-        confirmation = self.read_from_socket(client_soc)
-        converted, confirmation_package = self.data_to_package(confirmation, self.user_endec_map[client_soc])
-        if converted and confirmation_package['received']:
-            self.add_to_write_queue('add_downloads_to_file', file_name, uploader)
 
-    def handle_file_publicity_change_request(self, client_soc: socket.socket, package: dict):
+    @staticmethod
+    def normalize_ranges(ranges: list[list[int | None]], file_size: int) -> list[tuple[int, int]]:
+        '''
+        Clamps byte ranges to a file's size, then sorts and merges them. Ranges outside of the file are dropped (like reading past the end of a file)
+
+        Args:
+            ranges [list[list[int | None]]]: [start, end] byte ranges, end is exclusive or None for the end of the file
+            file_size [int]: Size of the file (in bytes)
+
+        Returns:
+            [list[tuple[int, int]]]: Sorted, non-overlapping [start, end) byte ranges
+        '''
+        clamped = sorted((start, file_size if end is None else min(end, file_size)) for start, end in ranges)
+
+        merged = []
+        for start, end in clamped:
+            if start >= end:
+                continue
+
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+
+        return merged
+
+    async def handle_file_publicity_change_request(self, client_soc: Connection, package: dict):
         '''
         Handles a file publicity change request by a user
 
         Args:
-            client_soc [socket.socket]: The user's socket
+            client_soc [Connection]: The user's connection
             package [dict]: Package sent by the user
 
         Returns:
             [dict]: Response package for the user
         '''
-        username = self.socket_to_user[client_soc]
+        if self.db_write_backpressure():
+            return PackageFormatter.response_package('file_publicity_change_response', False, 'Server is busy, try again later')
+
+        username = self.sessions.username(client_soc)
         try:
-            self.db_read.get_file(package['file-name'], username)
+            file = await self.read_db('get_file', package['file-name'], username)
         except FileNotFoundError:
             return PackageFormatter.response_package('file_publicity_change_response', False, 'File doesn\'t exist')
         
-        self.add_to_write_queue('change_file_publicity', package['file-name'], username)
+        #the new status is decided here (rather than by the writer), so reads of the pending write know it
+        self.add_to_write_queue('change_file_publicity', package['file-name'], username, not file['is-public'])
         return PackageFormatter.response_package('file_publicity_change_response', True)
     
-    def handle_file_deletion_request(self, client_soc: socket.socket, package: dict):
+    async def handle_file_deletion_request(self, client_soc: Connection, package: dict):
         '''
         Handles a file deletion request by a user
 
         Args:
-            client_soc [socket.socket]: The user's socket
+            client_soc [Connection]: The user's connection
             package [dict]: Package sent by the user
 
         Returns:
             [dict]: Response package for the user
         '''
-        username = self.socket_to_user[client_soc]
+        if self.db_write_backpressure():
+            return PackageFormatter.response_package('file_deletion_response', False, 'Server is busy, try again later')
+
+        username = self.sessions.username(client_soc)
         try:
-            self.db_read.get_file(package['file-name'], username)
+            await self.read_db('get_file', package['file-name'], username)
         except FileNotFoundError:
             return PackageFormatter.response_package('file_deletion_response', False, 'File doesn\'t exist')
         
-        os.remove(PATH + f'\\data\\files\\{username}\\{package['file-name']}')
+        #removed before the DB write is queued, so the file can't be uploaded again (and removed along with the new one) meanwhile
+        await self.loop.run_in_executor(self.disk_pool, os.remove, PATH + f'\\data\\files\\{username}\\{package['file-name']}')
         self.add_to_write_queue('delete_file', package['file-name'], username)
+        self.download_counter.discard(package['file-name'], username)
         return PackageFormatter.response_package('file_deletion_response', True)
     
-    def handle_user_search_request(self, client_soc: socket.socket, package: dict):
+    async def handle_user_search_request(self, client_soc: Connection, package: dict):
         '''
         Handles a user search request by a user
 
         Args:
-            client_soc [socket.socket]: The user's socket
+            client_soc [Connection]: The user's connection
             package [dict]: Package sent by the user
 
         Returns:
             [dict]: Response package for the user
         '''
-        username = self.socket_to_user[client_soc]
+        username = self.sessions.username(client_soc)
 
-        matching_users = self.db_read.get_all_matching_users(package['search-key'])
+        matching_users = await self.read_db('get_all_matching_users', package['search-key'])
         try:
             #remove request maker from matching users
             matching_users.remove(username)
@@ -372,188 +1212,467 @@ class Server:
             #user doesnt exist in matching users
             pass
 
-        users = {username: self.db_read.count_public_files(username) for username in matching_users}
+        users = await self.read_db('count_public_files_by_users', matching_users)
         return PackageFormatter.response_package('users_found', True, users)
     
-    def handle_user_files_request(self, client_soc: socket.socket, package: dict):
+    async def handle_user_files_request(self, client_soc: Connection, package: dict):
         '''
         Handles a user files request by a user
 
         Args:
-            client_soc [socket.socket]: The user's socket
+            client_soc [Connection]: The user's connection
             package [dict]: Package sent by the user
 
         Returns:
             [dict]: Response package for the user
         '''
-        files = self.db_read.get_all_user_files(package['username'], True)
+        if package['username'] == self.sessions.get(client_soc).username:
+            #users get their own files in full (needed after resuming a session without a login response)
+            return PackageFormatter.response_package('user_files', True, await self.read_db('get_all_user_files', package['username']))
+
+        files = await self.read_db('get_all_user_files', package['username'], True)
         for file in files:
             file.pop('is-public')
             file.pop('download-count')
 
         return PackageFormatter.response_package('user_files', True, files)
 
-    def add_file_by_username(self, username: str, file: bytes, file_desc: dict):
+    async def add_file_by_username(self, username: str, upload: UploadTransfer, file_desc: dict):
         '''
-        Add a file to the database
+        Add a file to the database, once its file was moved on the disk pool
 
         Args:
             username [str]: File's uploader's username
-            file [bytes]: Actual file in bytes
+            upload [UploadTransfer]: The completed upload, its file will be moved from the staging folder into the user's folder
             file_desc [dict]: Description of file
 
         Returns:
             None
         '''
         file_path = PATH + f'\\data\\files\\{username}\\{file_desc['file-name']}'
-        with open(file_path, 'wb') as f:
-            f.write(file)
+        await self.loop.run_in_executor(self.disk_pool, upload.commit, file_path)
 
         file_desc['uploader'] = username
         self.add_to_write_queue('add_file', file_desc)
 
-    def connect_new_socket(self):
+    async def connect_new_socket(self, client_soc: Connection, client_hello: bytes | None = None) -> bool:
         '''
-        Allows new socket to connect and go through initial connection process, expected to run in a seperate thread
+        Takes a new connection through the initial connection process, the client has "handshake_timeout" seconds to send its hello
         
+        Args:
+            client_soc [Connection]: The new connection
+            client_hello [bytes | None = None]: Client hello already read from the connection, if the server identity was already sent (multi-process mode)
+
         Returns:
-            None
+            [bool]: Whether the connection completed, it is closed otherwise
         '''
-        client_soc, client_addr = self.server_socket.accept()
+        client_addr = client_soc.getpeername()
         print(f'Connection from {client_addr}')
         try:
-            key = self.rsa_key_public.save_pkcs1()
-            client_soc.send(key)
-            print(f'Public key sent to {client_addr}')
-
-            signature = rsa.sign(key, self.rsa_key_private, 'SHA-1')
-            client_soc.send(signature)
-            print(f'Signature sent to {client_addr}')
+            if client_hello is None:
+                client_soc.send_frame(self.server_identity)
+                print(f'Server identity sent to {client_addr}')
+                async with asyncio.timeout(self.handshake_timeout):
+                    client_hello = await client_soc.read_frame(4096)
 
-            data = client_soc.recv(1024)
             try:
-                symmetric_key = rsa.decrypt(data, self.rsa_key_private)
-            except rsa.DecryptionError:
-                print(f'Received invalid data from {client_addr}, aborting')
+                client_hello = json.loads(client_hello)
+                client_share = bytes.fromhex(client_hello['key-share'])
+                client_public = X25519PublicKey.from_public_bytes(client_share)
+                cipher = select_cipher(client_hello['ciphers'], self.is_trusted_local_peer(client_soc))
+            except (ValueError, UnicodeDecodeError, KeyError, TypeError):
+                print(f'Received invalid client hello from {client_addr}, aborting')
                 client_soc.close()
-                return
-            print(f'Received symmetric key from {client_addr}')
+                return False
+            print(f'Received client hello from {client_addr}')
+
+            #a valid ticket resumes the session, anything else falls back to a full handshake in the same round trip
+            ticket = self.open_session_ticket(client_hello.get('session-ticket'))
+
+            #data connections join the session of a logged-in main connection instead of replacing it
+            is_data_connection = client_hello.get('data-connection') is True
+            main_soc = None
+            if is_data_connection and (ticket is not None):
+                main_soc = self.sessions.main_by_ticket(ticket['ticket-id'])
+                if main_soc is None:
+                    ticket = None
+            elif (ticket is not None) and (cipher is not None) and (not self.claim_session(ticket['username'])):
+                #the user's session is on another worker (multi-process mode)
+                ticket = None
+
+            ephemeral_key = X25519PrivateKey.generate()
+            server_share = ephemeral_key.public_key().public_bytes(Encoding.Raw, PublicFormat.Raw)
+            server_hello = {
+                "type": "server_hello",
+                "cipher": cipher,
+                "key-share": server_share.hex(),
+                "resumed": ticket is not None
+            }
+            client_soc.send_frame(json.dumps(server_hello).encode())
+            if cipher is None:
+                print(f'No common cipher with {client_addr}, aborting')
+                client_soc.close()
+                return False
+
+            if is_data_connection and (ticket is None):
+                print(f'Data connection from {client_addr} has no logged-in session, aborting')
+                client_soc.close()
+                return False
 
+            #ephemeral-ephemeral gives forward secrecy, static-ephemeral (or the ticket's resumption secret) authenticates the server
             try:
-                client_endec = fernet.Fernet(symmetric_key)
+                if ticket is None:
+                    secret = ephemeral_key.exchange(client_public) + self.static_key.exchange(client_public)
+                else:
+                    secret = ephemeral_key.exchange(client_public) + bytes.fromhex(ticket['resumption-secret'])
             except ValueError:
-                print(f'Received invalid symmetric key from {client_addr}, aborting')
+                print(f'Received invalid key share from {client_addr}, aborting')
+                if (ticket is not None) and (not is_data_connection):
+                    self.release_session(ticket['username'])
                 client_soc.close()
-                return
+                return False
+
+            send_key, receive_key = derive_keys(secret, True, client_share + server_share)
+            #the key agreement runs for plaintext connections too, so the client still knows it reached the real server
+            client_soc.endec = PlaintextRecordLayer() if cipher == PLAINTEXT else RecordLayer(cipher, send_key, receive_key)
             
-            self.active_sockets.append(client_soc)
-            self.user_endec_map[client_soc] = client_endec
+            self.sessions.add(client_soc, main_soc)
+            if (ticket is not None) and (not is_data_connection):
+                self.resume_session(client_soc, ticket)
             print(f'{client_addr}, completed connection!')
+            return True
 
-        except ConnectionError:
+        except (ConnectionError, FrameSizeError):
             print(f'{client_addr} disconnected during connection, aborting')
             client_soc.close()
+            return False
+        except TimeoutError:
+            print(f'{client_addr} didn\'t complete the handshake in time, aborting')
+            client_soc.close()
+            return False
+
+    def issue_session_ticket(self, client_soc: Connection, username: str) -> dict:
+        '''
+        Issues a resumption ticket for a logged-in socket. The ticket is sealed with the server's ticket key, so it can be checked later without any DB work
+
+        Args:
+            client_soc [Connection]: The user's connection
+            username [str]: Username the socket is logged-in as
+
+        Returns:
+            [dict]: Ticket description for the client, containing the sealed ticket, the resumption secret and the expiry time
+        '''
+        resumption_secret = os.urandom(KEY_SIZE)
+        ticket = {
+            "ticket-id": os.urandom(16).hex(),
+            "username": username,
+            "resumption-secret": resumption_secret.hex(),
+            "expires": round(datetime.now().timestamp()) + self.ticket_lifetime
+        }
+        self.sessions.set_ticket(client_soc, ticket['ticket-id'])
+
+        return {
+            "ticket": self.ticket_endec.encrypt(json.dumps(ticket).encode()).hex(),
+            "resumption-secret": ticket['resumption-secret'],
+            "expires": ticket['expires']
+        }
 
-    def read_from_socket(self, client_soc: socket.socket) -> bytes:
+    def open_session_ticket(self, sealed_ticket: str | None) -> dict | None:
         '''
-        Reads 2048 bytes from a socket
+        Opens a resumption ticket presented by a client
 
         Args:
-            client_soc [socket.socket]: Socket to read from
+            sealed_ticket [str | None]: The sealed ticket in hex, as issued by issue_session_ticket()
 
         Returns:
-            [bytes]: Data read from the socket
+            [dict | None]: The ticket's contents, None if no ticket was given or it is invalid, expired or revoked
         '''
+        if not sealed_ticket:
+            return None
+
         try:
-            data = client_soc.recv(2048)
-        except ConnectionError:
-            data = b''
+            ticket = json.loads(self.ticket_endec.decrypt(bytes.fromhex(sealed_ticket)))
+        except (InvalidTag, ValueError, TypeError):
+            return None
+
+        if (ticket['expires'] < datetime.now().timestamp()) or (ticket['ticket-id'] in self.revoked_tickets):
+            return None
+
+        return ticket
+
+    def revoke_session_ticket(self, client_soc: Connection) -> None:
+        '''
+        Revokes the resumption ticket issued to a socket (if any), revoked tickets are remembered until they expire (and forgotten by the process that revoked them)
+
+        Args:
+            client_soc [Connection]: The user's connection
+
+        Returns:
+            None
+        '''
+        now = datetime.now().timestamp()
+        while self.revoked_expiry and (self.revoked_expiry[0][0] < now):
+            self.revoked_tickets.pop(self.revoked_expiry.popleft()[1], None)
+
+        ticket_id = self.sessions.pop_ticket(client_soc)
+        if ticket_id is not None:
+            self.revoked_tickets[ticket_id] = now + self.ticket_lifetime
+            self.revoked_expiry.append((now + self.ticket_lifetime, ticket_id))
+
+    def resume_session(self, client_soc: Connection, ticket: dict) -> None:
+        '''
+        Logs a socket in using an opened resumption ticket. A stale socket still logged-in as the same user is logged out, since the client reconnected from it
+
+        Args:
+            client_soc [Connection]: The user's new connection
+            ticket [dict]: The opened ticket
+
+        Returns:
+            None
+        '''
+        self.sessions.log_in(client_soc, ticket['username'])
+        self.sessions.set_ticket(client_soc, ticket['ticket-id'])
+
+    def claim_session(self, username: str) -> bool:
+        '''
+        Registers this process as the one a user's session is on, unless the session is on another worker (multi-process mode)
+
+        Args:
+            username [str]: Username of the user logging in
+
+        Returns:
+            [bool]: Whether the session is on this process
+        '''
+        return self.session_owners.setdefault(username, self.worker_index) == self.worker_index
 
-        return data
+    def release_session(self, username: str) -> None:
+        '''
+        Unregisters a user's session once none of this process's connections are logged-in as the user
+
+        Args:
+            username [str]: Username of the user
+
+        Returns:
+            None
+        '''
+        if not self.sessions.is_logged_in(username):
+            self.session_owners.pop(username, None)
 
-    def data_to_package(self, data: bytes, endec: fernet.Fernet) -> tuple[bool, dict | str]:
+    def data_to_package(self, data: bytes) -> tuple[bool, dict | str]:
         '''
-        Convert bytes to a formatted package
+        Convert a decrypted package record to a formatted package
 
         Args:
             data [bytes]: Data to convert
-            endec [fernet.Fernet]: User's Fernet endec
 
         Returns:
             [tuple[bool, dict | str]]: Tuple containing 2 elements, first indicating whether the package was converted successfully, second will be the package as a dict (if converted successfully) else an error message (str)
         '''
         try:
-            package = json.loads(endec.decrypt(data))
-        except fernet.InvalidToken:
-            return (False, 'Failed to decrypt data')
+            package = json.loads(data)
         except UnicodeDecodeError:
             return (False, 'Failed to decode data')
         except json.JSONDecodeError:
             return (False, 'Failed to format as json')
 
+        if type(package) != dict:
+            return (False, 'Package must be a json object')
+
         return (True, package)
     
-    def send_package(self, client_soc: socket.socket, package: dict) -> None:
+    def send_package(self, client_soc: Connection, package: dict, request_id: int = 0) -> None:
         '''
-        Sends a package to a socket, assumes socket completed connection through connect_new_socket(). Encrypts the package using the socket's mapped endec, and sends a header package containing size of packge (in bytes) first.
+        Sends a package to a connection, assumes it completed connection through connect_new_socket(). Encrypts the package using the connection's endec, and sends it as a single length-prefixed frame.
 
         Args:
-            client_soc [socket.socket]: Socket to send package to
+            client_soc [Connection]: Connection to send package to
             package [dict]: Packge to send
+            request_id [int = 0]: Id of the request the package responds to (0 for packages not tied to a request)
 
         Returns:
             None
         '''
-        encrypted = self.encrypt(self.user_endec_map[client_soc], package)
+        client_soc.send_frame(self.encrypt(client_soc.endec, package, request_id))
 
-        header = {
-            "type": "header_package",
-            "size-of-package": len(encrypted)
-        }
-        encrypted_header = self.encrypt(self.user_endec_map[client_soc], header)
-
-        client_soc.send(encrypted_header)
-        client_soc.sendall(encrypted)
-
-    def encrypt(self, endec: fernet.Fernet, package: dict) -> bytes:
+    def encrypt(self, endec: RecordLayer, package: dict, request_id: int = 0) -> bytes:
         '''
-        Encrypts a package using a socket's mapped endec
+        Encrypts a package using a connection's endec
 
         Args:
-            endec [fernet.Fernet]: Fernet object to encrypt through
+            endec [RecordLayer]: Record layer to encrypt through
             package [dict]: Package to encrypt
+            request_id [int = 0]: Id of the request the package belongs to
 
         Returns:
-            [bytes]: package as encrypted bytes
+            [bytes]: package as an encrypted record
         '''
         data = json.dumps(package).encode()
-        return endec.encrypt(data)
+        return endec.seal(PACKAGE_RECORD, request_id, data)
     
-    def close_socket(self, client_soc: socket.socket):
+    def close_socket(self, client_soc: Connection):
         '''
-        Closes connection with a socket, and removes it from any internal variables that might store it
+        Closes a connection, and removes it from any internal variables that might store it. Closing an already closed connection does nothing
 
         Args:
-            client_soc [socket.socket]: Socket to close
+            client_soc [Connection]: Connection to close
 
         Returns:
             None
         '''
-        addr = client_soc.getpeername()[0]
+        if client_soc not in self.sessions:
+            return
 
-        self.active_sockets.remove(client_soc)
-        self.user_endec_map.pop(client_soc)
-        try:
-            self.socket_to_user.pop(client_soc)
-        except KeyError:
-            pass
+        self.close_data_connections(client_soc)
+        session = self.sessions.remove(client_soc)
+        for transfer_key in [key for key in self.uploads if key[0] is client_soc]:
+            upload = self.uploads.get(transfer_key)
+            if upload is None:
+                continue
+
+            if upload.stripe_owners[transfer_key] == 0:
+                #keep what was received staged, the user can resume the upload after reconnecting
+                self.detach_upload(upload)
+                self.close_upload(upload)
+            else:
+                self.finish_upload(upload, False, 'Lost a stripe\'s connection')
+        for transfer_key in [key for key in self.downloads if key[0] is client_soc]:
+            self.downloads.pop(transfer_key)
+            self.ready_downloads.pop(transfer_key, None)
+            self.transfers.release(transfer_key)
+        for transfer_key in [key for key in self.download_tasks if key[0] is client_soc]:
+            self.download_tasks.pop(transfer_key).cancel()
+        if session.state == LOGGED_IN:
+            self.release_session(session.username)
 
         client_soc.close()
-        print(f'Closed connection with {addr}')
+        print(f'Closed connection with {client_soc.getpeername()[0]}')
+
+    def close_data_connections(self, client_soc: Connection) -> None:
+        '''
+        Closes the data connections opened by a client. Each data connection is cleaned up by its own task once its pending request is handled (see handle_connection)
+
+        Args:
+            client_soc [Connection]: The client's main connection
+
+        Returns:
+            None
+        '''
+        for data_soc in self.sessions.data_connections(client_soc):
+            data_soc.close()
+
+    async def acquire_bandwidth(self, transfer_key: tuple[Connection, int], username: str, amount: int) -> None:
+        '''
+        Waits until a transfer may move "amount" bytes (see BandwidthShaper), the time it waits doesn't count against its speed (see cut_off_slow_transfers)
+
+        Args:
+            transfer_key [tuple[Connection, int]]: Key of the transfer
+            username [str]: Username of the user the transfer belongs to
+            amount [int]: Amount of bytes the transfer is about to move
+
+        Returns:
+            None
+        '''
+        self.transfers.throttle(transfer_key)
+        try:
+            await self.shaper.acquire(username, amount, self.transfers.weight(transfer_key))
+        finally:
+            self.transfers.unthrottle(transfer_key)
+
+    async def cut_off_slow_transfers(self):
+        '''
+        Closes the connections of running transfers slower than "min_transfer_rate" over a "transfer_check_window" seconds window, a single task checks every transfer. Time a transfer is held back by the bandwidth limits doesn't count, only a client that doesn't keep up gets cut off. Interrupted uploads stay staged, so they can be resumed
+
+        Returns:
+            None
+        '''
+        while True:
+            #checked a few times per window, so a transfer is measured soon after its window ends
+            await asyncio.sleep(self.transfer_check_window / 4)
+            for client_soc, request_id in self.transfers.slow_transfers(self.min_transfer_rate, self.transfer_check_window):
+                print(f'{colorama.Fore.RED}Transfer {request_id} of {client_soc.getpeername()} is slower than {self.min_transfer_rate} bytes per second, closing')
+                client_soc.abort()
+                self.close_socket(client_soc)
+
+    async def read_db(self, request: str, *args):
+        '''
+        Runs a DB read on the read pool, without blocking the event loop\n
+        Reads of a user (get_user) and of files (get_file, get_all_user_files) apply the writes still in the write queue (see PendingWrites), so they never miss a change the server already accepted. Download counts of files read are corrected by the downloads not yet written to the DB (see DownloadCounter)
+
+        Args:
+            request [str]: The read to make (name of a DatabaseLink method)
+            *args: all arguments needed for that read
+
+        Returns:
+            The read's result
+
+        Raises:
+            Whatever the read raises
+        '''
+        def read(*read_args) -> asyncio.Future:
+            return self.loop.run_in_executor(self.db_read_pool, self.db_read_links.read, *read_args)
+
+        if request not in ('get_user', 'get_file', 'get_all_user_files'):
+            return await read(request, *args)
+
+        username = args[1] if request == 'get_file' else args[0]
+        if request == 'get_user':
+            #taken before reading, whatever gets committed meanwhile is in the read and applying it again changes nothing
+            writes = self.pending_writes.writes(username)
+            try:
+                user = await read('get_user', username)
+            except UserNotFoundError:
+                user = None
+            user = PendingWrites.overlay_user(writes, username, user)
+            if user is None:
+                raise UserNotFoundError
+
+            return user
+
+        while True:
+            #download counts committed during the read may or may not be in it, in which case the read is made again (see DownloadCounter.merge)
+            generation = self.download_counter.generation
+            writes = self.pending_writes.writes(username)
+            if request == 'get_file':
+                file_name = args[0]
+                try:
+                    files = [await read('get_file', file_name, username)]
+                except FileNotFoundError:
+                    files = []
+                files = [file for file in PendingWrites.overlay_files(writes, username, files) if file['file-name'] == file_name]
+                if not files:
+                    raise FileNotFoundError
+            else:
+                #a pending write can make a file public, so with pending writes private files are left out only after applying them
+                exclude_private = (len(args) > 1) and args[1]
+                files = PendingWrites.overlay_files(writes, username, await read('get_all_user_files', username, exclude_private and not writes))
+                files = [file for file in files if file['is-public'] or not exclude_private]
+
+            files = self.download_counter.merge(files, generation)
+            if files is not None:
+                return files[0] if request == 'get_file' else files
+
+            if self.download_counter.generation % 2:
+                #the commit is still running (a slow fsync for example), reading again right away would only see it running again
+                waiter = self.loop.create_future()
+                self.count_commit_waiters.append(waiter)
+                if self.download_counter.generation % 2:
+                    await waiter
+
+    def wake_count_commit_waiters(self) -> None:
+        '''
+        Wakes the reads waiting for a commit of download counts to end, so they read again (see read_db)
+
+        Returns:
+            None
+        '''
+        waiters, self.count_commit_waiters = self.count_commit_waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
 
     def add_to_write_queue(self, request: str, *args) -> None:
         '''
-        Add a db write request to the write queue
+        Add a db write request to the write queue, reads apply it until it's committed (see read_db). Never blocks, if the queue is full the write waits for room off the event loop (see queue_write). Requests that add writes should check db_write_backpressure first so it doesn't come to that
 
         Args:
             request [str]: The request to make
@@ -562,12 +1681,69 @@ class Server:
         Returns:
             None
         '''
-        self.db_write_queue.put((request, (*args,)))
-        self.db_queue_not_empty.set()
+        self.pending_writes.add(request, args)
+        self.queue_write((request, (*args,), time.monotonic()))
+
+    def queue_write(self, write: tuple | None) -> None:
+        '''
+        Puts a write (or None, to stop the writer) on the write queue without blocking. If the queue is full, the write and every write after it wait in "db_write_overflow" until a thread of the default executor moves them to the queue, so they keep their order (the order PendingWrites expects)
+
+        Args:
+            write [tuple | None]: The write, as taken by db_write
+
+        Returns:
+            None
+        '''
+        with self.db_write_overflow_lock:
+            if not self.db_write_overflow:
+                try:
+                    self.db_write_queue.put_nowait(write)
+                    return
+                except queue.Full:
+                    pass
+
+            self.db_write_overflow.append(write)
+            if len(self.db_write_overflow) > 1:
+                #already being moved
+                return
+
+        self.loop.run_in_executor(None, self.move_write_overflow)
+
+    def move_write_overflow(self) -> None:
+        '''
+        Moves the writes waiting in "db_write_overflow" to the write queue in order, waiting for room as needed. Runs on a thread until the overflow is empty
+
+        Returns:
+            None
+        '''
+        with self.db_write_overflow_lock:
+            write = self.db_write_overflow[0]
+        while True:
+            self.db_write_queue.put(write)
+            with self.db_write_overflow_lock:
+                self.db_write_overflow.popleft()
+                if not self.db_write_overflow:
+                    return
+                write = self.db_write_overflow[0]
+
+    def db_write_backpressure(self) -> bool:
+        '''
+        Checks whether the write queue is backed up (past "db_busy_threshold"), in which case requests that add writes should be turned away. Every time it is, the request is counted as rejected (see dbstats)
+
+        Returns:
+            [bool]: Whether to turn the request away
+        '''
+        if self.db_write_queue.qsize() + len(self.db_write_overflow) < self.db_busy_threshold:
+            return False
+
+        self.db_write_stats['rejected'] += 1
+        return True
 
     def db_write(self, db_name: str):
         '''
-        Creates a connection to the DB and reads request through "db_write_queue", should only be used for write requests as nothing will be returned
+        Creates a connection to the DB and reads request through "db_write_queue", should only be used for write requests as nothing will be returned\n
+        Writes are group committed: whatever is queued (up to "db_batch_size" writes, or what was taken off the queue in "db_batch_delay" seconds) runs in a single transaction with a single commit, so a burst of writes costs a few syncs instead of one each. A lone write is committed right away. A write that fails is skipped, the rest of its batch is still committed\n
+        Every "download_flush_interval" seconds the counted downloads (see DownloadCounter) are added by the next batch, or by a batch of their own if nothing is queued. Runs until a None request is queued (see close_server), after committing everything queued before it
 
         Args:
             db_name [str]: Name of .db file
@@ -576,7 +1752,6 @@ class Server:
             None
         '''
         write_db = DatabaseLink(db_name, False)
-        self.db_queue_not_empty = Event()
         function_map = {
             "add_user": write_db.add_user,
             "add_file": write_db.add_file,
@@ -588,25 +1763,124 @@ class Server:
             "change_file_publicity": write_db.change_file_publicity,
         }
 
-        while not self.close_server_event.is_set():
-            while not self.db_write_queue.empty():
-                r = self.db_write_queue.get()
-                function_map[r[0]](*r[1])
-            
-            self.db_queue_not_empty.clear()
-            self.db_queue_not_empty.wait()
+        stopping = False
+        next_flush = time.monotonic() + self.download_flush_interval
+        while not stopping:
+            try:
+                batch = [self.db_write_queue.get(timeout=max(0.0, next_flush - time.monotonic()))]
+            except queue.Empty:
+                batch = []
+            deadline = time.monotonic() + self.db_batch_delay
+            while batch and (batch[-1] is not None) and (len(batch) < self.db_batch_size) and (time.monotonic() < deadline):
+                try:
+                    batch.append(self.db_write_queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch and (batch[-1] is None):
+                stopping = True
+                batch.pop()
+
+            download_counts = {}
+            if stopping or (time.monotonic() >= next_flush):
+                download_counts = self.download_counter.take()
+                next_flush = time.monotonic() + self.download_flush_interval
+
+            if batch or download_counts:
+                self.commit_db_batch(write_db, function_map, batch, download_counts)
 
         write_db.close()
 
+    def commit_db_batch(self, write_db: DatabaseLink, function_map: dict, batch: list[tuple[str, tuple, float]], download_counts: dict[tuple[str, str], int]) -> None:
+        '''
+        Runs a batch of queued writes in a single transaction, and records the batch in "db_write_stats"\n
+        Download counts are added after the writes, so files added by the batch get theirs. Counts of files that aren't in the DB are kept for the next flush if the file is still being added by a queued write (it can be downloaded before that, see PendingWrites), the rest are dropped
+
+        Args:
+            write_db [DatabaseLink]: The writer's DB link
+            function_map [dict]: The write methods of the link, by request
+            batch [list[tuple[str, tuple, float]]]: The writes, each with its arguments and when it was queued
+            download_counts [dict[tuple[str, str], int]]: Download counts to add (taken from "download_counter"), by file (file name, uploader)
+
+        Returns:
+            None
+        '''
+        started = time.monotonic()
+        failed = 0
+        for request, args, _ in batch:
+            try:
+                function_map[request](*args, commit=False)
+            except (UserExistsError, FileExistsError, ValueError, sqlite3.Error) as e:
+                failed += 1
+                print(f'{colorama.Fore.RED}DB write {request}{args} failed: {e!r}')
+
+        missing = None
+        if download_counts:
+            try:
+                missing = write_db.add_downloads_to_files(download_counts, commit=False)
+            except sqlite3.Error as e:
+                print(f'{colorama.Fore.RED}Adding {len(download_counts)} download counts failed, retrying with the next flush: {e!r}')
+            self.download_counter.commit_started()
+
+        try:
+            write_db.commit()
+        except sqlite3.Error as e:
+            write_db.rollback()
+            failed = len(batch)
+            missing = None
+            print(f'{colorama.Fore.RED}Commit of {len(batch)} DB writes failed, they were discarded: {e!r}')
+
+        self.pending_writes.committed(len(batch))
+        if download_counts:
+            self.download_counter.flushed(missing, self.pending_writes.has_file)
+            try:
+                self.loop.call_soon_threadsafe(self.wake_count_commit_waiters)
+            except RuntimeError:
+                #the event loop is closed (the last flush, once the server stopped)
+                pass
+
+        finished = time.monotonic()
+        stats = self.db_write_stats
+        stats['batches'] += 1
+        stats['writes'] += len(batch)
+        stats['download-counts'] += len(download_counts) - len(missing) if missing is not None else 0
+        stats['failed'] += failed
+        stats['batch-time'] += finished - started
+        stats['max-batch-time'] = max(stats['max-batch-time'], finished - started)
+        for _, _, queued in batch:
+            stats['wait-time'] += finished - queued
+            stats['max-wait-time'] = max(stats['max-wait-time'], finished - queued)
+
+    def print_db_stats(self) -> None:
+        '''
+        Prints the write queue's depth and the writer's batch statistics, see admin_input
+
+        Returns:
+            None
+        '''
+        stats = self.db_write_stats
+        batches = max(1, stats['batches'])
+        writes = max(1, stats['writes'])
+        print(f'DB write queue: {self.db_write_queue.qsize()}/{self.db_write_queue.maxsize} queued (busy past {self.db_busy_threshold}), {len(self.db_write_overflow)} waiting for room, {stats['rejected']} requests rejected\n'
+              f'{stats['writes']} writes ({stats['failed']} failed) in {stats['batches']} batches, {stats['writes'] / batches:.1f} writes per batch\n'
+              f'batch time: {stats['batch-time'] / batches * 1000:.2f} ms average, {stats['max-batch-time'] * 1000:.2f} ms max\n'
+              f'time from queueing to commit: {stats['wait-time'] / writes * 1000:.2f} ms average, {stats['max-wait-time'] * 1000:.2f} ms max\n'
+              f'download counts: {stats['download-counts']} file counts written, {len(self.download_counter)} waiting\n'
+              f'{len(self.pending_writes)} writes applied to reads until committed')
+
     def admin_input(self) -> None:
         '''
-        allows input on the server program to enter basic commands
+        allows input on the server program to enter basic commands, the commands run on the event loop's thread (or are sent to the workers in multi-process mode)
 
         command list:\n
         -stop -> will stop the server\n
         -sockets -> print all currently connected sockets\n
         -logged in -> show all sockets mapped to a user and which user they are mapped to\n
-        -removeuser {username} -> will completely remove a user and all its files (UNREVERSABLE)
+        -removeuser {username} -> will completely remove a user and all its files (UNREVERSABLE)\n
+        -limit global {KB/s | off} -> set the bandwidth limit of all transfers together (split evenly between the workers in multi-process mode)\n
+        -limit users {KB/s | off} -> set the default bandwidth limit of every user\n
+        -limit user {username} {KB/s | off} -> set the bandwidth limit of a single user\n
+        -weight {username} {weight} -> set a user's share of the bandwidth relative to other users (1 by default)\n
+        -dbstats -> show the DB write queue's depth and the writer's batch statistics (per process in multi-process mode)
 
         Returns:
             None
@@ -615,25 +1889,95 @@ class Server:
             command = input()
             if command == 'stop':
                 self.close_server_event.set()
+                self.loop.call_soon_threadsafe(self.stop_event.set)
 
-            elif command == 'sockets':
-                print(self.active_sockets)
-
-            elif command == 'logged_in':
-                print(self.socket_to_user)
+            elif (command in ('sockets', 'logged_in', 'dbstats')) or command.startswith(('limit ', 'weight ')):
+                if self.workers:
+                    for _, pipe in self.workers:
+                        pipe.send(('command', command))
+                else:
+                    self.loop.call_soon_threadsafe(self.run_admin_command, command)
 
             elif command.startswith('removeuser '):
                 if len(command) == len('removeuser '):
                     print(f'username cannot be empty')
                     continue
-                self.remove_user(command[len('removeuser '):])
+                if self.workers:
+                    #a single worker is enough, the user's files and staged uploads are shared
+                    self.workers[0][1].send(('command', command))
+                else:
+                    self.loop.call_soon_threadsafe(self.run_admin_command, command)
 
             else:
                 print('unrecognized command')
 
-    def remove_user(self, username: str) -> None:
+    def run_admin_command(self, command: str) -> None:
+        '''
+        Runs an admin command (other than stop) on the event loop's thread, see admin_input
+
+        Args:
+            command [str]: The command
+
+        Returns:
+            None
+        '''
+        if command == 'sockets':
+            print(self.sessions.connections())
+
+        elif command == 'logged_in':
+            print({client_soc: self.sessions.username(client_soc) for client_soc in self.sessions.connections(LOGGED_IN)})
+
+        elif command.startswith('removeuser '):
+            self.loop.create_task(self.remove_user(command[len('removeuser '):]))
+
+        elif command == 'dbstats':
+            self.print_db_stats()
+
+        elif command.startswith(('limit ', 'weight ')):
+            self.set_bandwidth(command.split())
+
+    def set_bandwidth(self, args: list[str]) -> None:
+        '''
+        Changes the bandwidth limits or a user's weight, see admin_input. A worker of a multi-process server takes its share of the global limit, the limits and weights of users apply as is (a user's transfers all run on the worker its session is on)
+
+        Args:
+            args [list[str]]: The command's words
+
+        Returns:
+            None
+        '''
+        try:
+            if args[0] == 'weight':
+                _, username, weight = args
+                if float(weight) <= 0:
+                    raise ValueError
+                self.shaper.set_weight(username, float(weight))
+                print(f'Weight of {username} set to {weight}')
+                return
+
+            *target, limit = args[1:]
+            rate = None if limit == 'off' else float(limit) * 1024
+            if (rate is not None) and (rate <= 0):
+                raise ValueError
+
+            if target == ['global']:
+                if (self.worker_state is not None) and (rate is not None):
+                    rate /= self.worker_state.workers
+                    limit = f'{limit} ({rate / 1024:g} on worker {self.worker_state.index})'
+                self.shaper.set_global_rate(rate)
+            elif target == ['users']:
+                self.shaper.set_user_rate(rate)
+            elif (len(target) == 2) and (target[0] == 'user'):
+                self.shaper.set_user_rate(rate, target[1])
+            else:
+                raise ValueError
+            print(f'Bandwidth limit of {' '.join(target)} set to {limit}')
+        except ValueError:
+            print('invalid bandwidth command')
+
+    async def remove_user(self, username: str) -> None:
         '''
-        Removes a user and all its files
+        Removes a user and all its files, the files are removed on the disk pool
 
         Args:
             username [str]: Username of target user
@@ -642,9 +1986,55 @@ class Server:
             None
         '''
         self.add_to_write_queue('remove_user', username)
-        shutil.rmtree(PATH + '\\data\\files\\' + username)
+        self.download_counter.discard(None, username)
+        await self.loop.run_in_executor(self.disk_pool, shutil.rmtree, PATH + '\\data\\files\\' + username)
+        if self.closing_uploads:
+            #a part file being closed would be written after it's discarded
+            await asyncio.wait(list(self.closing_uploads.values()))
+        await self.loop.run_in_executor(self.disk_pool, self.discard_staged_uploads, username)
         print(f'Removed user {username}')
 
+    def discard_staged_uploads(self, username: str) -> None:
+        '''
+        Discards all of a user's staged uploads. Goes over all of the staged uploads, so it's run on the disk pool rather than the event loop
+
+        Args:
+            username [str]: Username of the user
+
+        Returns:
+            None
+        '''
+        for upload_id, meta in list(self.staged_uploads.items()):
+            if meta['username'] == username:
+                self.staged_uploads.pop(upload_id, None)
+                self.staged_upload_ids.pop((username, meta['file-desc']['file-name']), None)
+                UploadTransfer.discard(self.staging_dir, upload_id)
+
+    def load_staged_uploads(self) -> dict[str, dict]:
+        '''
+        Loads the uploads staged in the staging folder, discarding the expired ones and the older uploads of a file staged more than once
+
+        Returns:
+            [dict[str, dict]]: Descriptions of the staged uploads, by upload id
+        '''
+        staged_uploads = UploadTransfer.load_staged(self.staging_dir)
+        expiry = datetime.now().timestamp() - self.staging_lifetime
+        latest: dict[tuple[str, str], str] = {}
+        for upload_id, meta in sorted(staged_uploads.items(), key=lambda item: item[1]['staged-time']):
+            file_key = (meta['username'], meta['file-desc']['file-name'])
+            if meta['staged-time'] < expiry:
+                staged_uploads.pop(upload_id)
+                UploadTransfer.discard(self.staging_dir, upload_id)
+                continue
+
+            if file_key in latest:
+                staged_uploads.pop(latest[file_key])
+                UploadTransfer.discard(self.staging_dir, latest[file_key])
+            latest[file_key] = upload_id
+
+        print(f'Loaded {len(staged_uploads)} staged uploads.')
+        return staged_uploads
+
     def load_rsa_keys(self):
         '''
         Loads the RSA keys from ./data/encryption_keys and stores them
@@ -660,21 +2050,76 @@ class Server:
 
         print('Loaded RSA keys.')
 
+    def create_server_identity(self):
+        '''
+        Creates the server's static X25519 key and signs it with the RSA private key. Done once at startup, so new connections only pay for the X25519 key agreement\n
+        The signed identity is stored as the ready-to-send server_identity package
+
+        Returns:
+            None
+        '''
+        self.static_key = X25519PrivateKey.generate()
+        static_public = self.static_key.public_key().public_bytes(Encoding.Raw, PublicFormat.Raw)
+        public_key = self.rsa_key_public.save_pkcs1()
+
+        signature = rsa.sign(public_key + static_public, self.rsa_key_private, 'SHA-256')
+        identity = {
+            "type": "server_identity",
+            "public-key": public_key.decode(),
+            "static-key": static_public.hex(),
+            "signature": signature.hex()
+        }
+        self.server_identity = json.dumps(identity).encode()
+
+        print('Created server identity.')
+
     def close_server(self):
         '''
-        Closes the server and disconnects all sockets
+        Closes the server and disconnects all connections
 
         Returns:
             None
         '''
-        for client_soc in self.active_sockets:
+        for client_soc in self.sessions.connections():
             self.close_socket(client_soc)
 
-        self.db_read.close()
-        self.db_queue_not_empty.set()
+        for worker, pipe in self.workers:
+            pipe.send(('stop',))
+        for worker, pipe in self.workers:
+            worker.join()
+            pipe.close()
+        if self.workers:
+            self.manager.shutdown()
+        else:
+            #the writer commits what is still queued before it stops
+            self.queue_write(None)
+
+        self.db_read_pool.shutdown()
+        self.db_read_links.close()
+        self.crypto_pool.shutdown()
+        self.disk_pool.shutdown()
+        if self.unix_socket is not None:
+            try:
+                os.remove(self.unix_path)
+            except FileNotFoundError:
+                pass
+
+def run_worker(db_name: str, worker_state: WorkerState):
+    '''
+    Entry point of a worker process of a multi-process server
+
+    Args:
+        db_name [str]: Name of .db file
+        worker_state [WorkerState]: State given by the main process
+
+    Returns:
+        None
+    '''
+    s = Server(0, db_name, worker_state=worker_state)
+    s.handle_clients()
 
 def main():
-    s = Server(11111, 'database.db')
+    s = Server(11111, 'database.db', os.cpu_count() or 1)
     s.handle_clients()
 
 if __name__ == '__main__':
@@ -1,6 +1,8 @@
 import re
 from typing import Callable
 
+MAX_DOWNLOAD_RANGES = 64
+
 class PackageValidator:
     @staticmethod
     def validate_package(package: dict) -> tuple[bool, str]:
@@ -24,6 +26,10 @@ class PackageValidator:
         if not all(key in package for key in keys):
             return (False, 'Invalid keys')
         
+        #transfer requests can be marked as urgent, to move them up a priority class
+        if ('urgent' in package) and (type(package['urgent']) != bool):
+            return (False, 'Invalid urgency')
+        
         return func(package)
     
     @staticmethod
@@ -42,6 +48,49 @@ class PackageValidator:
         if (type(package['file-data']) != dict) or (not all(key in package['file-data'] for key in file_data_required)):
             return (False, 'Invalid file data')
         
+        if (type(package['file-data']['file-size-bytes']) != int) or (package['file-data']['file-size-bytes'] < 0):
+            return (False, 'Invalid file size')
+        
+        return PackageValidator._validate_stripe_count(package)
+    
+    @staticmethod
+    def _validate_upload_resume_package(package: dict):
+        if (type(package['upload-id']) != str) or (not re.match(r'^[0-9a-f]{32}$', package['upload-id'])):
+            return (False, 'Invalid upload id')
+        
+        return PackageValidator._validate_stripe_count(package)
+    
+    @staticmethod
+    def _validate_stripe_count(package: dict):
+        if ('stripes' in package) and ((type(package['stripes']) != int) or (package['stripes'] < 1)):
+            return (False, 'Invalid stripe count')
+        
+        return (True, '')
+    
+    @staticmethod
+    def _validate_upload_stripe_package(package: dict):
+        if (type(package['upload-id']) != str) or (type(package['stripe']) != int):
+            return (False, 'Invalid stripe')
+        
+        return (True, '')
+    
+    @staticmethod
+    def _validate_ranges(package: dict):
+        if 'ranges' not in package:
+            return (True, '')
+        
+        ranges = package['ranges']
+        if (type(ranges) != list) or (not ranges) or (len(ranges) > MAX_DOWNLOAD_RANGES):
+            return (False, 'Invalid ranges')
+        
+        for byte_range in ranges:
+            if (type(byte_range) != list) or (len(byte_range) != 2):
+                return (False, 'Invalid ranges')
+            
+            start, end = byte_range
+            if (type(start) != int) or (start < 0) or ((end is not None) and ((type(end) != int) or (end <= start))):
+                return (False, 'Invalid ranges')
+        
         return (True, '')
     
     @staticmethod
@@ -57,7 +106,11 @@ class PackageValidator:
         "signup": (_validate_login_signup_package, ['type', 'username', 'password-hash']),
         "logout": (lambda _: (True, ''), ['type']),
         "upload_request": (_validate_upload_request_package, ['type', 'file-data']),
-        "download_request": (lambda _: (True, ''), ['type', 'file-name', 'username']),
+        "upload_resume": (_validate_upload_resume_package, ['type', 'upload-id']),
+        "upload_stripe": (_validate_upload_stripe_package, ['type', 'upload-id', 'stripe']),
+        "download_request": (_validate_ranges, ['type', 'file-name', 'username']),
+        "download_ready": (_validate_ranges, ['type']),
+        "download_final": (lambda _: (True, ''), ['type', 'received']),
         "file_publicity_change": (lambda _: (True, ''), ['type', 'file-name']),
         "delete_file": (lambda _: (True, ''), ['type', 'file-name']),
         "search_users": (_validate_user_search_package, ['type', 'search-key']),
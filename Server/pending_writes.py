@@ -0,0 +1,148 @@
+from collections import deque
+from threading import Lock
+
+class PendingWrites:
+    def __init__(self) -> None:
+        '''
+        DB writes that were queued but not committed yet, in queueing order and indexed by the user they change, so reads can see them (read-your-writes)\n
+        Every write sets the state of a user or of files, regardless of what was there, so replaying the writes over a read made after some of them were committed still gives the state after all of them (see overlay_user and overlay_files)\n
+        Safe to use from any thread, every method holds the lock
+
+        Returns:
+            None
+        '''
+        self.lock = Lock()
+        self.order: deque[str] = deque() #username of every pending write, in queueing order
+        self.by_user: dict[str, deque[tuple[str, tuple]]] = {}
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    @staticmethod
+    def username_of(request: str, args: tuple) -> str:
+        '''
+        Args:
+            request [str]: A write (name of a DatabaseLink method)
+            args [tuple]: The write's arguments
+
+        Returns:
+            [str]: Username of the user the write changes (or whose file it changes)
+        '''
+        if request == 'add_file':
+            return args[0]['uploader']
+        if request in ('add_user', 'remove_user'):
+            return args[0]
+
+        return args[1]
+
+    def add(self, request: str, args: tuple) -> None:
+        '''
+        Records a write, expected to be called in the order writes are queued
+
+        Args:
+            request [str]: The write (name of a DatabaseLink method)
+            args [tuple]: The write's arguments
+
+        Returns:
+            None
+        '''
+        username = self.username_of(request, args)
+        with self.lock:
+            self.order.append(username)
+            self.by_user.setdefault(username, deque()).append((request, args))
+
+    def committed(self, count: int) -> None:
+        '''
+        Forgets the oldest writes once the writer is done with them (committed, or discarded by a failed commit)
+
+        Args:
+            count [int]: Amount of writes
+
+        Returns:
+            None
+        '''
+        with self.lock:
+            for _ in range(count):
+                username = self.order.popleft()
+                writes = self.by_user[username]
+                writes.popleft()
+                if not writes:
+                    self.by_user.pop(username)
+
+    def writes(self, username: str) -> list[tuple[str, tuple]]:
+        '''
+        Args:
+            username [str]: Username of a user
+
+        Returns:
+            [list[tuple[str, tuple]]]: The pending writes changing the user or its files, in queueing order. Should be taken before the DB is read, so whatever gets committed meanwhile is in the read
+        '''
+        with self.lock:
+            return list(self.by_user.get(username, ()))
+
+    def has_file(self, file_name: str, uploader: str) -> bool:
+        '''
+        Args:
+            file_name [str]: Name of a file
+            uploader [str]: Username of the file's uploader
+
+        Returns:
+            [bool]: Whether a pending write adds the file (and no later one deletes it)
+        '''
+        return any(file['file-name'] == file_name for file in self.overlay_files(self.writes(uploader), uploader, []))
+
+    @staticmethod
+    def overlay_user(writes: list[tuple[str, tuple]], username: str, user: dict | None) -> dict | None:
+        '''
+        Applies pending writes to a user read from the DB
+
+        Args:
+            writes [list[tuple[str, tuple]]]: Pending writes of the user (see writes)
+            username [str]: Username of the user
+            user [dict | None]: The user's data as read, None if it wasn't found
+
+        Returns:
+            [dict | None]: The user's data once the writes are committed, None if it won't exist
+        '''
+        for request, args in writes:
+            if request == 'add_user':
+                user = {'username': username, 'password-hash': args[1]}
+            elif request == 'remove_user':
+                user = None
+
+        return user
+
+    @staticmethod
+    def overlay_files(writes: list[tuple[str, tuple]], username: str, files: list[dict]) -> list[dict]:
+        '''
+        Applies pending writes to files of a user read from the DB, files added by the writes are placed last
+
+        Args:
+            writes [list[tuple[str, tuple]]]: Pending writes of the user (see writes)
+            username [str]: Username of the files' uploader
+            files [list[dict]]: The files as read (all of the user's files, or the ones the caller asked for)
+
+        Returns:
+            [list[dict]]: The files once the writes are committed, download counts are the ones read (new files start at 0)
+        '''
+        by_name = {file['file-name']: file for file in files}
+        for request, args in writes:
+            if request == 'add_file':
+                file_data = args[0]
+                read = by_name.get(file_data['file-name'])
+                by_name[file_data['file-name']] = {
+                    'file-name': file_data['file-name'],
+                    'uploader': username,
+                    'file-size-bytes': file_data['file-size-bytes'],
+                    'upload-time': file_data['upload-time'],
+                    'is-public': int(file_data['is-public']),
+                    'download-count': read['download-count'] if read is not None else 0
+                }
+            elif request == 'delete_file':
+                by_name.pop(args[0], None)
+            elif request == 'remove_user':
+                by_name.clear()
+            elif (request == 'change_file_publicity') and (args[0] in by_name):
+                by_name[args[0]] = {**by_name[args[0]], 'is-public': int(args[2])}
+
+        return list(by_name.values())
@@ -0,0 +1,285 @@
+from threading import RLock
+
+from connection import Connection
+
+#states of a session
+CONNECTED = 'connected' #handshake completed, not logged-in
+LOGGED_IN = 'logged-in'
+DATA = 'data' #data connection of a logged-in session
+
+class Session:
+    __slots__ = ('connection', 'username', 'ticket_id', 'main', 'data_sessions')
+
+    def __init__(self, connection: Connection, main: 'Session | None' = None) -> None:
+        '''
+        State of a single connection, kept in slots since the server holds one per connection
+
+        Args:
+            connection [Connection]: The connection
+            main [Session | None = None]: Session of the main connection, if this is a data connection
+
+        Returns:
+            None
+        '''
+        self.connection = connection
+        self.username: str | None = main.username if main is not None else None
+        self.ticket_id: str | None = None
+        self.main = main
+        self.data_sessions: set[Session] | None = None #created once the session gets a data connection
+
+    def __repr__(self) -> str:
+        return f'<Session {self.connection.addr} {self.state} {self.username}>'
+
+    @property
+    def state(self) -> str:
+        '''
+        Returns:
+            [str]: State of the session, one of CONNECTED, LOGGED_IN, DATA
+        '''
+        if self.main is not None:
+            return DATA
+
+        return LOGGED_IN if self.username is not None else CONNECTED
+
+class SessionRegistry:
+    def __init__(self) -> None:
+        '''
+        Sessions of all connections that completed the handshake, indexed by connection, by logged-in user, by ticket id and by state so every lookup takes constant time\n
+        Safe to use from any thread, every method holds the registry's lock
+
+        Returns:
+            None
+        '''
+        self.lock = RLock()
+        self.by_connection: dict[Connection, Session] = {}
+        self.by_user: dict[str, Session] = {}
+        self.by_ticket: dict[str, Session] = {}
+        self.by_state: dict[str, set[Session]] = {CONNECTED: set(), LOGGED_IN: set(), DATA: set()}
+
+    def __len__(self) -> int:
+        return len(self.by_connection)
+
+    def __contains__(self, connection: Connection) -> bool:
+        return connection in self.by_connection
+
+    def add(self, connection: Connection, main_connection: Connection | None = None) -> Session:
+        '''
+        Registers a connection that completed the handshake
+
+        Args:
+            connection [Connection]: The connection
+            main_connection [Connection | None = None]: Main connection of the logged-in session the connection joins as a data connection, if it is one
+
+        Returns:
+            [Session]: The connection's session
+
+        Raises:
+            KeyError: If "main_connection" isn't registered
+        '''
+        with self.lock:
+            main = self.by_connection[main_connection] if main_connection is not None else None
+            session = Session(connection, main)
+            if main is not None:
+                if main.data_sessions is None:
+                    main.data_sessions = set()
+                main.data_sessions.add(session)
+
+            self.by_connection[connection] = session
+            self.by_state[session.state].add(session)
+            return session
+
+    def remove(self, connection: Connection) -> Session | None:
+        '''
+        Unregisters a connection, a main connection's data connections stay registered until they are removed themselves
+
+        Args:
+            connection [Connection]: The connection
+
+        Returns:
+            [Session | None]: The connection's session, None if it wasn't registered
+        '''
+        with self.lock:
+            session = self.by_connection.pop(connection, None)
+            if session is None:
+                return None
+
+            self.by_state[session.state].discard(session)
+            if (session.username is not None) and (self.by_user.get(session.username) is session):
+                self.by_user.pop(session.username)
+            if (session.ticket_id is not None) and (self.by_ticket.get(session.ticket_id) is session):
+                self.by_ticket.pop(session.ticket_id)
+            if (session.main is not None) and (session.main.data_sessions is not None):
+                session.main.data_sessions.discard(session)
+
+            return session
+
+    def get(self, connection: Connection) -> Session | None:
+        '''
+        Args:
+            connection [Connection]: A connection
+
+        Returns:
+            [Session | None]: The connection's session, None if it isn't registered
+        '''
+        return self.by_connection.get(connection)
+
+    def username(self, connection: Connection) -> str:
+        '''
+        Args:
+            connection [Connection]: A logged-in connection (or a data connection)
+
+        Returns:
+            [str]: Username the connection is logged-in as
+
+        Raises:
+            KeyError: If the connection isn't logged-in
+        '''
+        username = self.by_connection[connection].username
+        if username is None:
+            raise KeyError(connection)
+
+        return username
+
+    def is_logged_in(self, username: str) -> bool:
+        '''
+        Args:
+            username [str]: Username of a user
+
+        Returns:
+            [bool]: Whether a connection is logged-in as the user
+        '''
+        return username in self.by_user
+
+    def log_in(self, connection: Connection, username: str) -> None:
+        '''
+        Logs a connection in, a connection already logged-in as the same user is logged out (a resumed session replaces the stale one). If the connection itself is logged-in as another user, it's logged out of that user first
+
+        Args:
+            connection [Connection]: The connection
+            username [str]: Username to log in as
+
+        Returns:
+            None
+        '''
+        with self.lock:
+            stale = self.by_user.get(username)
+            if (stale is not None) and (stale.connection is not connection):
+                self.log_out(stale.connection)
+
+            session = self.by_connection[connection]
+            if (session.username is not None) and (self.by_user.get(session.username) is session):
+                self.by_user.pop(session.username)
+            self.by_state[session.state].discard(session)
+            session.username = username
+            self.by_state[session.state].add(session)
+            self.by_user[username] = session
+
+    def log_out(self, connection: Connection) -> str | None:
+        '''
+        Logs a connection out, its ticket id is kept until popped (see pop_ticket)
+
+        Args:
+            connection [Connection]: The connection
+
+        Returns:
+            [str | None]: Username the connection was logged-in as, None if it wasn't logged-in
+        '''
+        with self.lock:
+            session = self.by_connection.get(connection)
+            if (session is None) or (session.state != LOGGED_IN):
+                return None
+
+            username = session.username
+            self.by_state[LOGGED_IN].discard(session)
+            session.username = None
+            self.by_state[CONNECTED].add(session)
+            if self.by_user.get(username) is session:
+                self.by_user.pop(username)
+
+            return username
+
+    def set_ticket(self, connection: Connection, ticket_id: str) -> None:
+        '''
+        Records the session ticket issued to (or resumed by) a connection
+
+        Args:
+            connection [Connection]: The connection
+            ticket_id [str]: Id of the ticket
+
+        Returns:
+            None
+        '''
+        with self.lock:
+            session = self.by_connection[connection]
+            if (session.ticket_id is not None) and (self.by_ticket.get(session.ticket_id) is session):
+                self.by_ticket.pop(session.ticket_id)
+
+            session.ticket_id = ticket_id
+            self.by_ticket[ticket_id] = session
+
+    def pop_ticket(self, connection: Connection) -> str | None:
+        '''
+        Removes the ticket id recorded for a connection
+
+        Args:
+            connection [Connection]: The connection
+
+        Returns:
+            [str | None]: Id of the connection's ticket, None if it has none
+        '''
+        with self.lock:
+            session = self.by_connection.get(connection)
+            if (session is None) or (session.ticket_id is None):
+                return None
+
+            ticket_id = session.ticket_id
+            session.ticket_id = None
+            if self.by_ticket.get(ticket_id) is session:
+                self.by_ticket.pop(ticket_id)
+
+            return ticket_id
+
+    def main_by_ticket(self, ticket_id: str) -> Connection | None:
+        '''
+        Finds the logged-in main connection a session ticket was issued to, data connections presenting the ticket join its session
+
+        Args:
+            ticket_id [str]: Id of the ticket
+
+        Returns:
+            [Connection | None]: The logged-in connection, None if no logged-in connection has the ticket
+        '''
+        session = self.by_ticket.get(ticket_id)
+        if (session is None) or (session.state != LOGGED_IN):
+            return None
+
+        return session.connection
+
+    def data_connections(self, connection: Connection) -> list[Connection]:
+        '''
+        Args:
+            connection [Connection]: A main connection
+
+        Returns:
+            [list[Connection]]: Data connections opened by the connection's client
+        '''
+        with self.lock:
+            session = self.by_connection.get(connection)
+            if (session is None) or (session.data_sessions is None):
+                return []
+
+            return [data_session.connection for data_session in session.data_sessions]
+
+    def connections(self, state: str | None = None) -> list[Connection]:
+        '''
+        Args:
+            state [str | None = None]: State of the connections to get (CONNECTED, LOGGED_IN or DATA), all connections if not given
+
+        Returns:
+            [list[Connection]]: The registered connections in the state
+        '''
+        with self.lock:
+            if state is None:
+                return list(self.by_connection)
+
+            return [session.connection for session in self.by_state[state]]
@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+#the server's modules import each other by name, as when running from the Server folder. Some of the client's modules have the same names, so those loaded by the client's tests are forgotten first
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+for name in ('exceptions', 'framing', 'record_layer'):
+    sys.modules.pop(name, None)
+
+import database_link
+
+@pytest.fixture
+def db_name(tmp_path, monkeypatch) -> str:
+    '''
+    Name of a fresh .db file, kept in a temporary folder instead of ./data/
+    '''
+    (tmp_path / 'data').mkdir()
+    monkeypatch.setattr(database_link, 'PATH', str(tmp_path))
+    return 'test.db'
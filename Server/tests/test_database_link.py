@@ -0,0 +1,82 @@
+import pytest
+
+import database_link
+from database_link import DatabaseLink
+
+def query_plans(link: DatabaseLink, request: str, *args) -> list[str]:
+    '''
+    Runs a DatabaseLink method and returns the query plan of every statement it ran (parameters are filled in)
+    '''
+    statements = []
+    link.connection.set_trace_callback(statements.append)
+    try:
+        getattr(link, request)(*args)
+    finally:
+        link.connection.set_trace_callback(None)
+
+    plans = []
+    for statement in statements:
+        if statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+            rows = link.cursor.execute('EXPLAIN QUERY PLAN ' + statement).fetchall()
+            plans.append(' | '.join(row[3] for row in rows))
+    return plans
+
+def add_files(link: DatabaseLink, users: int, files_per_user: int) -> None:
+    for user in range(users):
+        link.add_user(f'user{user}', 'hash', False)
+        for file in range(files_per_user):
+            link.add_file({'file-name': f'file{file}.bin', 'uploader': f'user{user}', 'file-size-bytes': 1, 'upload-time': 0, 'is-public': file % 2 == 0}, False)
+    link.commit()
+
+@pytest.fixture
+def old_db(db_name, monkeypatch) -> str:
+    '''
+    A database created before any migration, with a few users and files
+    '''
+    migrations = database_link.MIGRATIONS
+    monkeypatch.setattr(database_link, 'MIGRATIONS', [])
+    link = DatabaseLink(db_name)
+    add_files(link, 20, 10)
+    link.close()
+    monkeypatch.setattr(database_link, 'MIGRATIONS', migrations)
+    return db_name
+
+def test_new_database_is_migrated(db_name):
+    link = DatabaseLink(db_name)
+    assert link.cursor.execute('PRAGMA user_version').fetchone()[0] == len(database_link.MIGRATIONS)
+    assert link.cursor.execute('SELECT name FROM sqlite_master WHERE type="index" AND name="files-by-uploader"').fetchone()
+    link.close()
+
+def test_migration_keeps_data(old_db):
+    link = DatabaseLink(old_db)
+    assert link.cursor.execute('PRAGMA user_version').fetchone()[0] == len(database_link.MIGRATIONS)
+    assert link.cursor.execute('SELECT COUNT(*) FROM files').fetchone()[0] == 200
+    assert len(link.get_all_user_files('user3')) == 10
+    link.close()
+
+def test_migrations_apply_once(old_db):
+    DatabaseLink(old_db).close()
+    link = DatabaseLink(old_db)
+    assert link.cursor.execute('PRAGMA user_version').fetchone()[0] == len(database_link.MIGRATIONS)
+    link.close()
+
+@pytest.mark.parametrize('request_name, args', [
+    ('get_all_user_files', ('user3',)),
+    ('get_all_user_files', ('user3', True)),
+    ('count_public_files', ('user3',)),
+    ('count_public_files_by_users', (['user3', 'user4'],)),
+    ('remove_user', ('user3', False))
+])
+def test_uploader_queries_use_index(old_db, request_name, args):
+    link = DatabaseLink(old_db)
+    plans = [plan for plan in query_plans(link, request_name, *args) if 'files' in plan]
+    assert plans
+    for plan in plans:
+        assert 'files-by-uploader' in plan, plan
+    link.close()
+
+def test_uploader_queries_scan_without_migration(old_db, monkeypatch):
+    monkeypatch.setattr(database_link, 'MIGRATIONS', [])
+    link = DatabaseLink(old_db)
+    assert all('files-by-uploader' not in plan for plan in query_plans(link, 'get_all_user_files', 'user3'))
+    link.close()
@@ -0,0 +1,71 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from cryptography.exceptions import InvalidTag
+
+from record_layer import CHUNK_RECORD, PACKAGE_RECORD, RECORD_HEADER, REPLAY_WINDOW_SIZE, RecordLayer
+
+@pytest.fixture
+def layers() -> tuple[RecordLayer, RecordLayer]:
+    '''
+    Sending and receiving record layers of a connection
+    '''
+    send_key, receive_key = os.urandom(32), os.urandom(32)
+    return (RecordLayer('AES-256-GCM', send_key, receive_key), RecordLayer('AES-256-GCM', receive_key, send_key))
+
+def test_records_in_order(layers):
+    sender, receiver = layers
+    for i in range(10):
+        assert receiver.open(sender.seal(CHUNK_RECORD, 1, b'chunk', i)) == (CHUNK_RECORD, 1, i, b'chunk')
+
+def test_replayed_record_is_refused(layers):
+    sender, receiver = layers
+    record = sender.seal(PACKAGE_RECORD, 1, b'{}')
+    receiver.open(record)
+    receiver.open(sender.seal(PACKAGE_RECORD, 2, b'{}'))
+    with pytest.raises(InvalidTag):
+        receiver.open(record)
+
+def test_reordered_records_are_accepted_once(layers):
+    sender, receiver = layers
+    records = [sender.seal(CHUNK_RECORD, 1, b'x', i) for i in range(50)]
+    order = list(range(50))
+    order[5:25] = reversed(order[5:25])
+    for i in order:
+        assert receiver.open(records[i])[2] == i
+    for i in (0, 10, 49):
+        with pytest.raises(InvalidTag):
+            receiver.open(records[i])
+
+def test_record_behind_window_is_refused(layers):
+    sender, receiver = layers
+    late = sender.seal(CHUNK_RECORD, 1, b'x')
+    for _ in range(REPLAY_WINDOW_SIZE):
+        receiver.open(sender.seal(CHUNK_RECORD, 1, b'x'))
+    with pytest.raises(InvalidTag):
+        receiver.open(late)
+
+def test_forged_record_does_not_move_window(layers):
+    sender, receiver = layers
+    record = sender.seal(CHUNK_RECORD, 1, b'x')
+    forged = bytearray(sender.seal(CHUNK_RECORD, 1, b'x'))
+    forged[RECORD_HEADER.size + 4:RECORD_HEADER.size + 12] = (2 ** 40).to_bytes(8) #far ahead, breaks the tag
+    with pytest.raises(InvalidTag):
+        receiver.open(bytes(forged))
+    assert receiver.open(record)[3] == b'x'
+
+def test_records_of_another_sender_are_refused(layers):
+    sender, receiver = layers
+    receiver.open(sender.seal(PACKAGE_RECORD, 1, b'{}'))
+    #same keys, another nonce prefix (as a record layer of an earlier connection would have)
+    sender.nonce_prefix = os.urandom(4)
+    with pytest.raises(InvalidTag):
+        receiver.open(sender.seal(PACKAGE_RECORD, 2, b'{}'))
+
+def test_records_sealed_on_threads(layers):
+    sender, receiver = layers
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        batches = list(pool.map(lambda batch: [sender.seal(CHUNK_RECORD, 1, b'x' * 1024, batch * 4 + i) for i in range(4)], range(200)))
+    opened = [receiver.open(record)[2] for batch in batches for record in batch]
+    assert opened == list(range(800))
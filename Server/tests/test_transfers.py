@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+from transfers import UploadTransfer
+
+CHUNK = b'x' * 1024
+FILE_SIZE = 8 * len(CHUNK)
+
+@pytest.fixture
+def staged(tmp_path) -> tuple[str, str, dict]:
+    '''
+    Staging folder, id and description of a freshly staged upload
+    '''
+    staging_dir = str(tmp_path / 'staging')
+    upload_id, meta = UploadTransfer.stage(staging_dir, 'bob', {'file-name': 'f.bin', 'file-size-bytes': FILE_SIZE, 'is-public': True})
+    return (staging_dir, upload_id, meta)
+
+def send_stripes(upload: UploadTransfer, first_stripe_chunks: int) -> None:
+    '''
+    Sends the whole second stripe of an upload split in two, and "first_stripe_chunks" chunks of the first one
+    '''
+    stripes = upload.split(2, len(CHUNK))
+    for index, (start, end) in enumerate(stripes):
+        upload.claim_stripe(index, index)
+        count = first_stripe_chunks if index == 0 else (end - start) // len(CHUNK)
+        assert upload.write_chunks(index, [(start + i * len(CHUNK), CHUNK) for i in range(count)])
+
+def test_unclosed_striped_upload_resumes_from_recorded_offset(staged):
+    staging_dir, upload_id, meta = staged
+    upload = UploadTransfer(upload_id, staging_dir, meta)
+    send_stripes(upload, 1)
+    #the server exits without closing the upload, the second stripe leaves a gap after the first chunk
+    upload.file.close()
+    assert os.path.getsize(upload.part_path) == FILE_SIZE
+
+    resumed = UploadTransfer(upload_id, staging_dir, meta)
+    assert resumed.offset == 0
+    assert os.path.getsize(resumed.part_path) == 0
+
+def test_closed_striped_upload_resumes_from_committed_offset(staged):
+    staging_dir, upload_id, meta = staged
+    upload = UploadTransfer(upload_id, staging_dir, meta)
+    send_stripes(upload, 2)
+    upload.close()
+
+    resumed = UploadTransfer(upload_id, staging_dir, meta)
+    assert resumed.offset == 2 * len(CHUNK)
+    assert resumed.load_committed_offset() is None
+
+    #resuming as a single stripe, the part file's size is the committed offset even if the server exits
+    resumed.split(1, len(CHUNK))
+    resumed.claim_stripe(0, 0)
+    assert resumed.write_chunks(0, [(2 * len(CHUNK), CHUNK)])
+    resumed.file.close()
+    assert UploadTransfer(upload_id, staging_dir, meta).offset == 3 * len(CHUNK)
+
+def test_unclosed_resumed_striped_upload_keeps_earlier_progress(staged):
+    staging_dir, upload_id, meta = staged
+    upload = UploadTransfer(upload_id, staging_dir, meta)
+    send_stripes(upload, 2)
+    upload.close()
+
+    resumed = UploadTransfer(upload_id, staging_dir, meta)
+    send_stripes(resumed, 1)
+    resumed.file.close()
+    assert UploadTransfer(upload_id, staging_dir, meta).offset == 2 * len(CHUNK)
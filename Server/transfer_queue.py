@@ -0,0 +1,285 @@
+import time
+import heapq
+from typing import Callable
+
+DEFAULT_SLOT_RATE = 8 * 1024 * 1024 #8 MB/s, assumed transfer speed until transfers finish and the real one is known
+
+#transfers up to these sizes are in the first priority classes (class 0 is served first), larger ones are in the last class
+PRIORITY_CLASS_SIZES = (1024 * 1024, 32 * 1024 * 1024) #1 MB, 32 MB
+#share of the bandwidth running transfers of every class get, relative to each other (see BandwidthShaper)
+PRIORITY_WEIGHTS = (4.0, 2.0, 1.0)
+PRIORITY_AGING = 10 #seconds a waiting transfer waits to move up a class, so large transfers still start
+
+class TransferQueue:
+    def __init__(self, max_active: int, max_active_per_user: int, reserved_slots: int = 0) -> None:
+        '''
+        Admission control for transfers. At most "max_active" transfers run at once (and at most "max_active_per_user" of a single user), the rest wait\n
+        Waiting transfers start in order of priority class (by size, urgent transfers move up a class), then arrival. A transfer moves up a class for every "PRIORITY_AGING" seconds it waited, so large transfers aren't starved. "reserved_slots" of the slots are kept for transfers of the first class, so small transfers don't wait for large ones to finish\n
+        Start times of waiting transfers are estimated from the transfer speed measured on finished transfers. The progress of running transfers is tracked too, so transfers that stall can be found (see slow_transfers), time a transfer is held back by the bandwidth shaper doesn't count against it (see throttle)
+
+        Args:
+            max_active [int]: Most transfers running at once
+            max_active_per_user [int]: Most transfers of a single user running at once
+            reserved_slots [int = 0]: Amount of the "max_active" slots only transfers of the first priority class can use
+
+        Returns:
+            None
+        '''
+        self.max_active = max_active
+        self.max_active_per_user = max_active_per_user
+        self.reserved_slots = reserved_slots
+
+        #running transfers: key -> (username, size, start time, priority class), waiting transfers: [key, username, size, start callback, priority class, queueing time] in order of arrival
+        self.active: dict[object, tuple[str, int, float, int]] = {}
+        self.waiting: list[tuple[object, str, int, Callable[[], None], int, float]] = []
+        self.slot_rate = DEFAULT_SLOT_RATE
+
+        #bytes moved by every running transfer, and when (and at how many bytes) its speed was last checked
+        self.transferred: dict[object, int] = {}
+        self.checkpoints: dict[object, tuple[float, int]] = {}
+        #running transfers held back by the bandwidth shaper: key -> (amount of requests waiting, when the first started waiting), and how long every transfer was held back since its speed was last checked
+        self.throttled: dict[object, tuple[int, float]] = {}
+        self.throttled_time: dict[object, float] = {}
+
+    @staticmethod
+    def priority_class(size: int, urgent: bool = False) -> int:
+        '''
+        Args:
+            size [int]: Amount of bytes to transfer
+            urgent [bool = False]: Whether the user marked the transfer as urgent
+
+        Returns:
+            [int]: Priority class of the transfer, 0 is served first
+        '''
+        priority = sum(1 for class_size in PRIORITY_CLASS_SIZES if size > class_size)
+        return max(0, priority - 1) if urgent else priority
+
+    def request(self, key: object, username: str, size: int, start: Callable[[], None], urgent: bool = False) -> int:
+        '''
+        Asks to run a transfer. The transfer either runs right away, or waits and "start" is called once it can run
+
+        Args:
+            key [object]: Key of the transfer (by connection and request id)
+            username [str]: Username of the user the transfer belongs to
+            size [int]: Amount of bytes to transfer
+            start [Callable[[], None]]: Starts the transfer, called only if it had to wait
+            urgent [bool = False]: Whether the user marked the transfer as urgent
+
+        Returns:
+            [int]: Position of the transfer in the queue, 0 if it runs right away
+        '''
+        priority = self.priority_class(size, urgent)
+        if self.can_run(username, priority):
+            self.activate(key, username, size, priority)
+            return 0
+
+        self.waiting.append((key, username, size, start, priority, time.monotonic()))
+        return [waiting[0] for waiting in self.queue_order()].index(key) + 1
+
+    def release(self, key: object, transferred: int = 0) -> None:
+        '''
+        Removes a transfer (running or waiting), starting the waiting transfers that can now run. Releasing a transfer that isn't queued does nothing
+
+        Args:
+            key [object]: Key of the transfer
+            transferred [int = 0]: Amount of bytes the transfer moved, used to measure the transfer speed
+
+        Returns:
+            None
+        '''
+        transfer = self.active.pop(key, None)
+        self.transferred.pop(key, None)
+        self.checkpoints.pop(key, None)
+        self.throttled.pop(key, None)
+        self.throttled_time.pop(key, None)
+        if transfer is None:
+            self.waiting = [waiting for waiting in self.waiting if waiting[0] != key]
+            return
+
+        duration = time.monotonic() - transfer[2]
+        if (transferred > 0) and (duration > 0.1):
+            self.slot_rate = 0.8 * self.slot_rate + 0.2 * (transferred / duration)
+
+        for waiting in self.queue_order():
+            if len(self.active) >= self.max_active:
+                break
+
+            waiting_key, username, size, start, priority, _ = waiting
+            if self.can_run(username, self.aged_priority(waiting)):
+                self.waiting.remove(waiting)
+                self.activate(waiting_key, username, size, priority)
+                start()
+
+    def queue_order(self) -> list[tuple[object, str, int, Callable[[], None], int, float]]:
+        '''
+        Returns:
+            [list[tuple[object, str, int, Callable[[], None], int, float]]]: The waiting transfers in the order they start in, by priority class (aged by the time they waited) then arrival
+        '''
+        return sorted(self.waiting, key=lambda waiting: (self.aged_priority(waiting), waiting[5]))
+
+    @staticmethod
+    def aged_priority(waiting: tuple[object, str, int, Callable[[], None], int, float]) -> int:
+        '''
+        Args:
+            waiting [tuple[object, str, int, Callable[[], None], int, float]]: A waiting transfer
+
+        Returns:
+            [int]: Priority class of the transfer, moved up a class for every "PRIORITY_AGING" seconds it waited
+        '''
+        return max(0, waiting[4] - int((time.monotonic() - waiting[5]) // PRIORITY_AGING))
+
+    def activate(self, key: object, username: str, size: int, priority: int) -> None:
+        '''
+        Marks a transfer as running
+
+        Args:
+            key [object]: Key of the transfer
+            username [str]: Username of the user the transfer belongs to
+            size [int]: Amount of bytes to transfer
+            priority [int]: Priority class of the transfer
+
+        Returns:
+            None
+        '''
+        now = time.monotonic()
+        self.active[key] = (username, size, now, priority)
+        self.transferred[key] = 0
+        self.checkpoints[key] = (now, 0)
+
+    def add_progress(self, key: object, count: int) -> None:
+        '''
+        Records bytes moved by a running transfer, progress of a transfer that isn't running is ignored
+
+        Args:
+            key [object]: Key of the transfer
+            count [int]: Amount of bytes moved
+
+        Returns:
+            None
+        '''
+        if key in self.transferred:
+            self.transferred[key] += count
+
+    def throttle(self, key: object) -> None:
+        '''
+        Marks a running transfer as held back by the bandwidth shaper until unthrottle is called, calls can overlap (stripes of a transfer wait separately). Time a transfer is held back doesn't count against its speed, so a transfer limited below the lowest accepted speed isn't taken as stalled
+
+        Args:
+            key [object]: Key of the transfer
+
+        Returns:
+            None
+        '''
+        if key in self.checkpoints:
+            waiting, since = self.throttled.get(key, (0, time.monotonic()))
+            self.throttled[key] = (waiting + 1, since)
+
+    def unthrottle(self, key: object) -> None:
+        '''
+        Marks the end of a wait started by throttle, a transfer that isn't throttled is ignored
+
+        Args:
+            key [object]: Key of the transfer
+
+        Returns:
+            None
+        '''
+        throttled = self.throttled.get(key)
+        if throttled is None:
+            return
+
+        waiting, since = throttled
+        if waiting > 1:
+            self.throttled[key] = (waiting - 1, since)
+            return
+
+        self.throttled.pop(key)
+        self.throttled_time[key] = self.throttled_time.get(key, 0.0) + time.monotonic() - since
+
+    def slow_transfers(self, min_rate: float, window: float) -> list[object]:
+        '''
+        Finds the running transfers that moved less than "min_rate" bytes per second since their speed was last checked, not counting the time they were held back by the bandwidth shaper (see throttle). Meant to be called periodically, a transfer is checked once at least "window" seconds passed since it started or was last checked
+
+        Args:
+            min_rate [float]: Lowest accepted speed (in bytes per second)
+            window [float]: Shortest time (in seconds) a transfer's speed is measured over
+
+        Returns:
+            [list[object]]: Keys of the slow transfers
+        '''
+        now = time.monotonic()
+        slow = []
+        for key, (checked_at, checked_bytes) in list(self.checkpoints.items()):
+            if now - checked_at < window:
+                continue
+
+            held_back = self.throttled_time.pop(key, 0.0)
+            if key in self.throttled:
+                waiting, since = self.throttled[key]
+                held_back += now - since
+                self.throttled[key] = (waiting, now)
+
+            if self.transferred[key] - checked_bytes < min_rate * (now - checked_at - held_back):
+                slow.append(key)
+            self.checkpoints[key] = (now, self.transferred[key])
+
+        return slow
+
+    def can_run(self, username: str, priority: int = 0) -> bool:
+        '''
+        Args:
+            username [str]: Username of a user
+            priority [int = 0]: Priority class of the transfer
+
+        Returns:
+            [bool]: Whether another transfer of the user (in the priority class) can run right now
+        '''
+        max_active = self.max_active if priority == 0 else self.max_active - self.reserved_slots
+        if len(self.active) >= max_active:
+            return False
+
+        return sum(1 for active_username, _, _, _ in self.active.values() if active_username == username) < self.max_active_per_user
+
+    def is_active(self, key: object) -> bool:
+        '''
+        Args:
+            key [object]: Key of a transfer
+
+        Returns:
+            [bool]: Whether the transfer is running
+        '''
+        return key in self.active
+
+    def weight(self, key: object) -> float:
+        '''
+        Args:
+            key [object]: Key of a transfer
+
+        Returns:
+            [float]: Share of the bandwidth the transfer gets by its priority class (see PRIORITY_WEIGHTS), the last class's if it isn't running
+        '''
+        transfer = self.active.get(key)
+        return PRIORITY_WEIGHTS[transfer[3] if transfer is not None else -1]
+
+    def estimated_wait(self, key: object) -> float:
+        '''
+        Estimates how long until a waiting transfer starts, by replaying the queue (in its current order): running transfers free their slot once their remaining bytes are sent, and each waiting transfer takes the first slot freed (per user limits and reserved slots are ignored)
+
+        Args:
+            key [object]: Key of a waiting transfer
+
+        Returns:
+            [float]: Estimated wait (in seconds), 0 if the transfer isn't waiting
+        '''
+        now = time.monotonic()
+        slots = [max(0.0, (size - (now - started) * self.slot_rate) / self.slot_rate) for _, size, started, _ in self.active.values()]
+        slots += [0.0] * (self.max_active - len(slots))
+        heapq.heapify(slots)
+
+        for waiting_key, _, size, _, _, _ in self.queue_order():
+            free_at = heapq.heappop(slots)
+            if waiting_key == key:
+                return free_at
+            heapq.heappush(slots, free_at + size / self.slot_rate)
+
+        return 0.0
@@ -0,0 +1,267 @@
+import os
+import json
+from datetime import datetime
+from threading import Lock
+
+class UploadTransfer:
+    def __init__(self, upload_id: str, staging_dir: str, meta: dict) -> None:
+        '''
+        State of a single staged upload. Chunks are written to "<upload id>.part" in the staging folder as they arrive, next to "<upload id>.json" holding the upload's description\n
+        The rest of the file can be split into stripes sent in parallel (each stripe in order, by its own request). Once closed, the part file's size is the committed offset, so an interrupted upload can continue from it (even after a server restart). While more than one stripe is sent the part file has gaps, so the description holds the committed offset from before the split until the upload is closed, a server that exits without closing the upload resumes it from there\n
+        Chunks are written on a thread other than the event loop's (see write_chunks), the part file is only used holding the upload's lock
+
+        Args:
+            upload_id [str]: Id of the upload
+            staging_dir [str]: Path to the staging folder
+            meta [dict]: Description of the upload, keys are: 'username', 'file-desc', 'staged-time'
+
+        Returns:
+            None
+        '''
+        self.upload_id = upload_id
+        self.meta = meta
+        self.username: str = meta['username']
+        self.file_desc: dict = meta['file-desc']
+
+        self.part_path = staging_dir + f'\\{upload_id}.part'
+        self.meta_path = staging_dir + f'\\{upload_id}.json'
+
+        #create the part file if needed, then open it for writing at any offset
+        open(self.part_path, 'ab').close()
+        self.lock = Lock()
+        self.file = open(self.part_path, 'r+b')
+        self.recorded_offset = self.load_committed_offset()
+        self.offset = self.file.seek(0, os.SEEK_END)
+        if (self.recorded_offset is not None) and (self.recorded_offset < self.offset):
+            #left by stripes of an upload that wasn't closed, past the recorded offset there may be gaps
+            self.offset = self.file.truncate(self.recorded_offset)
+        self.received = 0
+
+        #[start, next expected offset, end] of every stripe, and the stripe each request sends
+        self.stripes = [[self.offset, self.offset, self.file_desc['file-size-bytes']]]
+        self.stripe_owners: dict[object, int] = {}
+
+    @staticmethod
+    def stage(staging_dir: str, username: str, file_desc: dict) -> tuple[str, dict]:
+        '''
+        Creates a new staged upload in the staging folder
+
+        Args:
+            staging_dir [str]: Path to the staging folder
+            username [str]: Username of the uploader
+            file_desc [dict]: Description of the file being uploaded
+
+        Returns:
+            [tuple[str, dict]]: Tuple containing 2 elements, first is the new upload's id, second is its description
+        '''
+        upload_id = os.urandom(16).hex()
+        meta = {
+            'username': username,
+            'file-desc': file_desc,
+            'staged-time': round(datetime.now().timestamp())
+        }
+        with open(staging_dir + f'\\{upload_id}.json', 'w') as f:
+            json.dump(meta, f)
+
+        return (upload_id, meta)
+
+    @staticmethod
+    def load_staged(staging_dir: str) -> dict[str, dict]:
+        '''
+        Loads the descriptions of all uploads staged in the staging folder
+
+        Args:
+            staging_dir [str]: Path to the staging folder
+
+        Returns:
+            [dict[str, dict]]: Descriptions of the staged uploads, by upload id
+        '''
+        staged = {}
+        for file_name in os.listdir(staging_dir):
+            upload_id, extension = os.path.splitext(file_name)
+            if extension != '.json':
+                continue
+
+            try:
+                with open(staging_dir + f'\\{file_name}', 'r') as f:
+                    staged[upload_id] = json.load(f)
+            except (OSError, ValueError):
+                continue
+
+        return staged
+
+    @staticmethod
+    def discard(staging_dir: str, upload_id: str) -> None:
+        '''
+        Deletes a staged upload's files
+
+        Args:
+            staging_dir [str]: Path to the staging folder
+            upload_id [str]: Id of the upload
+
+        Returns:
+            None
+        '''
+        for extension in ('.part', '.json', '.json.tmp'):
+            try:
+                os.remove(staging_dir + f'\\{upload_id}{extension}')
+            except FileNotFoundError:
+                pass
+
+    def load_committed_offset(self) -> int | None:
+        '''
+        Get the committed offset recorded in the upload's description (see save_committed_offset)
+
+        Returns:
+            [int | None]: The recorded offset, None if the part file's size is the committed offset
+        '''
+        try:
+            with open(self.meta_path, 'r') as f:
+                return json.load(f).get('committed-offset')
+        except (OSError, ValueError):
+            return None
+
+    def save_committed_offset(self, offset: int | None) -> None:
+        '''
+        Records the committed offset in the upload's description, for a part file whose size isn't the committed offset (while it's written by several stripes). The description is replaced in one step, so an exit while it's written never loses it
+
+        Args:
+            offset [int | None]: Committed offset, None if the part file's size is the committed offset
+
+        Returns:
+            None
+        '''
+        if offset == self.recorded_offset:
+            return
+
+        meta = {key: value for key, value in self.meta.items() if key != 'committed-offset'}
+        if offset is not None:
+            meta['committed-offset'] = offset
+        with open(self.meta_path + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(self.meta_path + '.tmp', self.meta_path)
+        self.recorded_offset = offset
+
+    def split(self, count: int, min_stripe_size: int) -> list[tuple[int, int]]:
+        '''
+        Splits the rest of the file into stripes of (about) the same size, expected to be called before any stripe is claimed
+
+        Args:
+            count [int]: Amount of stripes wanted
+            min_stripe_size [int]: Smallest stripe size (in bytes), less stripes are made for small files
+
+        Returns:
+            [list[tuple[int, int]]]: [start, end) byte range of every stripe
+        '''
+        size = self.file_desc['file-size-bytes']
+        count = max(1, min(count, (size - self.offset) // min_stripe_size))
+        bounds = [self.offset + (size - self.offset) * i // count for i in range(count + 1)]
+        self.stripes = [[bounds[i], bounds[i], bounds[i + 1]] for i in range(count)]
+        self.save_committed_offset(self.offset if count > 1 else None)
+
+        return [(start, end) for start, _, end in self.stripes]
+
+    def claim_stripe(self, owner: object, index: int) -> bool:
+        '''
+        Assigns a stripe to the request that will send it
+
+        Args:
+            owner [object]: Key of the request (by socket and request id)
+            index [int]: Index of the stripe
+
+        Returns:
+            [bool]: Whether the stripe was claimed, False if it doesn't exist or was already claimed
+        '''
+        if (not 0 <= index < len(self.stripes)) or (index in self.stripe_owners.values()):
+            return False
+
+        self.stripe_owners[owner] = index
+        return True
+
+    def stripe_owner(self, index: int) -> object | None:
+        '''
+        Args:
+            index [int]: Index of a stripe
+
+        Returns:
+            [object | None]: Key of the request sending the stripe, None if it wasn't claimed
+        '''
+        return next((owner for owner, owner_index in self.stripe_owners.items() if owner_index == index), None)
+
+    def write_chunks(self, owner: object, chunks: list[tuple[int, bytes]]) -> bool:
+        '''
+        Writes received chunks of a stripe, safe to call from any thread. The stripe's next chunks are expected once this returns
+
+        Args:
+            owner [object]: Key of the request the chunks were sent by
+            chunks [list[tuple[int, bytes]]]: Offset in the file and decrypted data of every chunk, in the order they arrived
+
+        Returns:
+            [bool]: Whether all of the chunks were accepted, False if one isn't the next expected chunk of the request's stripe, goes beyond the stripe, or the upload was closed meanwhile (the chunks before it are kept)
+        '''
+        stripe = self.stripes[self.stripe_owners[owner]]
+        with self.lock:
+            for offset, chunk in chunks:
+                _, position, end = stripe
+                if (offset != position) or (offset + len(chunk) > end) or self.file.closed:
+                    return False
+
+                self.file.seek(offset)
+                self.file.write(chunk)
+                #counted once written, so closing never keeps a chunk that didn't make it to the file
+                stripe[1] += len(chunk)
+                self.received += len(chunk)
+        return True
+
+    def is_complete(self) -> bool:
+        '''
+        Returns:
+            [bool]: Whether all of the file's bytes were received
+        '''
+        return self.offset + self.received == self.file_desc['file-size-bytes']
+
+    def committed_offset(self) -> int:
+        '''
+        Get the amount of bytes received without gaps from the start of the file, an interrupted upload can continue from there
+
+        Returns:
+            [int]: Committed offset (in bytes)
+        '''
+        offset = self.offset
+        for start, position, end in self.stripes:
+            if start != offset:
+                break
+
+            offset = position
+            if position < end:
+                break
+
+        return offset
+
+    def close(self) -> None:
+        '''
+        Closes the part file, keeping everything received without gaps staged (stripes received past a gap are dropped), the part file's size is the committed offset again. Waits for a chunk being written to finish
+
+        Returns:
+            None
+        '''
+        with self.lock:
+            if not self.file.closed:
+                self.file.truncate(self.committed_offset())
+                self.file.close()
+                self.save_committed_offset(None)
+
+    def commit(self, file_path: str) -> None:
+        '''
+        Moves the complete file out of the staging folder
+
+        Args:
+            file_path [str]: Path to move the file to
+
+        Returns:
+            None
+        '''
+        with self.lock:
+            self.file.close()
+        os.replace(self.part_path, file_path)
+        os.remove(self.meta_path)
@@ -0,0 +1,33 @@
+from multiprocessing.connection import Connection as Pipe
+
+class WorkerState:
+    def __init__(self, index: int, workers: int, static_key: bytes, server_identity: bytes, ticket_key: bytes, session_owners: dict, revoked_tickets: dict, staged_uploads: dict, staged_upload_ids: dict, pipe: Pipe) -> None:
+        '''
+        Everything a worker process of a multi-process server gets from the main process. The main process accepts the connections and hands each one to a worker, along with the client hello it read\n
+        The maps are shared between all processes (manager proxies), so a user logged-in on one worker is known to every other worker
+
+        Args:
+            index [int]: Index of the worker
+            workers [int]: Amount of workers, limits of the whole server are split between them
+            static_key [bytes]: The server's static X25519 private key (raw), so every worker presents the same identity
+            server_identity [bytes]: The ready-to-send server_identity package
+            ticket_key [bytes]: Key session tickets are sealed with, so a ticket issued by one worker can be opened by any other
+            session_owners [dict[str, int]]: Index of the worker every logged-in user's session is on, by username
+            revoked_tickets [dict[str, int]]: Revoked ticket ids, mapped to when they can be forgotten
+            staged_uploads [dict[str, dict]]: Descriptions of the staged uploads, by upload id
+            staged_upload_ids [dict[tuple[str, str], str]]: Id of the staged upload of every file, by (username, file name)
+            pipe [Pipe]: Receiving end of the pipe the main process sends connections and commands through
+
+        Returns:
+            None
+        '''
+        self.index = index
+        self.workers = workers
+        self.static_key = static_key
+        self.server_identity = server_identity
+        self.ticket_key = ticket_key
+        self.session_owners = session_owners
+        self.revoked_tickets = revoked_tickets
+        self.staged_uploads = staged_uploads
+        self.staged_upload_ids = staged_upload_ids
+        self.pipe = pipe
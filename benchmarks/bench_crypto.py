@@ -0,0 +1,109 @@
+'''
+Crypto offload benchmark: several clients download large files at once while another client keeps sending small requests, once with downloads sealed on the crypto pool and once with them sealed on the event loop
+
+usage: python benchmarks/bench_crypto.py [clients] [file MB]  (4 and 32 by default)
+'''
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from harness import ROOT, free_port, quiet, remove_folder, running_server
+
+ROUNDS = 2 #downloads of its file by every client
+
+def connect(folder: str, port: int):
+    '''
+    Connects a client keeping its files in "folder" (every client logs in on its own)
+    '''
+    sys.path.insert(0, os.path.join(ROOT, 'Client'))
+    import client as client_module
+    client_module.PATH = folder
+    client_module.TICKET_PATH = os.path.join(folder, 'no-ticket.json')
+    client_module.Client.save_session_ticket = lambda self, username, ticket: None
+    os.makedirs(folder + '\\downloads', exist_ok=True)
+    with quiet():
+        return client_module.Client(('127.0.0.1', port))
+
+def downloader(folder: str, port: int, index: int, start, results) -> None:
+    client = connect(f'{folder}{index}', port)
+    with quiet():
+        client.send_signup_package(f'downloader{index}', 'password')
+        start.wait()
+        ok = True
+        for _ in range(ROUNDS):
+            client.send_download_request(f'file{index}.bin', 'uploader')
+            ok &= client.download_file(f'file{index}.bin', 'uploader')
+    results.put(ok)
+
+def run(folder: str, clients: int, size: int, offload: bool) -> str:
+    '''
+    Runs a server, uploads a file for every downloading client, then measures the downloads and the other client's latency
+
+    Returns:
+        [str]: The results
+    '''
+    port = free_port()
+    settings = {} if offload else {'crypto_offload_threshold': float('inf')} #every download sealed inline
+    with running_server(tempfile.mkdtemp(dir=folder), port, **settings):
+        uploader = connect(folder, port)
+        with quiet():
+            uploader.send_signup_package('uploader', 'password')
+            for index in range(clients):
+                uploader.send_upload_request(f'file{index}.bin', True)
+                uploader.upload_file(f'file{index}.bin')
+
+        def latency() -> float:
+            start = time.perf_counter()
+            uploader.send_user_files_request('uploader')
+            return time.perf_counter() - start
+
+        with quiet():
+            idle = [latency() for _ in range(50)]
+
+        start, results = multiprocessing.Barrier(clients + 1), multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=downloader, args=(folder, port, index, start, results)) for index in range(clients)]
+        for process in processes:
+            process.start()
+        start.wait()
+        started = time.perf_counter()
+        done = []
+        waiter = threading.Thread(target=lambda: done.extend(results.get() for _ in processes))
+        waiter.start()
+        under_load = []
+        with quiet():
+            while waiter.is_alive():
+                under_load.append(latency())
+                time.sleep(0.005)
+        elapsed = time.perf_counter() - started
+        for process in processes:
+            process.join()
+
+    under_load.sort()
+    return (f'{clients * ROUNDS * size / elapsed / 1e6:.0f} MB/s total (ok={all(done)}), '
+            f'control latency idle median {statistics.median(idle) * 1000:.2f} ms, under load median {statistics.median(under_load) * 1000:.2f} ms '
+            f'p99 {under_load[int(len(under_load) * 0.99)] * 1000:.2f} ms max {under_load[-1] * 1000:.1f} ms')
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    size = int(sys.argv[2]) * 1024 * 1024 if len(sys.argv) > 2 else 32 * 1024 * 1024
+
+    folder = tempfile.mkdtemp()
+    try:
+        os.chdir(folder) #the client names an upload by the path it's given
+        for index in range(clients):
+            with open(f'file{index}.bin', 'wb') as f:
+                f.write(os.urandom(size))
+
+        print(f'{clients} clients downloading {size // (1024 * 1024)} MB {ROUNDS} times each')
+        print(f'sealed inline: {run(folder, clients, size, False)}')
+        print(f'crypto pool:   {run(folder, clients, size, True)}')
+    finally:
+        os.chdir(ROOT)
+        remove_folder(folder)
+
+if __name__ == '__main__':
+    main()
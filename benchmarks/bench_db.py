@@ -0,0 +1,78 @@
+'''
+Times the uploader queries of DatabaseLink on a large database, before and after the "files-by-uploader" migration
+
+usage: python benchmarks/bench_db.py [rows]  (1,000,000 files by default, spread over 10,000 users)
+'''
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'Server'))
+
+import database_link
+from database_link import DatabaseLink
+
+USERS = 10_000
+
+def build(db_name: str, rows: int) -> None:
+    migrations = database_link.MIGRATIONS
+    database_link.MIGRATIONS = [] #the database as it was before the migrations
+    link = DatabaseLink(db_name)
+    database_link.MIGRATIONS = migrations
+
+    link.cursor.executemany('INSERT INTO users VALUES (?, ?)', ((f'user{user}', 'hash') for user in range(USERS)))
+    rnd = random.Random(1)
+    link.cursor.executemany('INSERT INTO files VALUES (?, ?, ?, ?, ?, ?)',
+                            ((f'file{i}.bin', f'user{rnd.randrange(USERS)}', 1000, 0, rnd.random() < 0.5, 0) for i in range(rows)))
+    link.commit()
+    link.close()
+
+def timeit(label: str, function, runs: int) -> None:
+    times = []
+    for i in range(runs):
+        start = time.perf_counter()
+        function(i)
+        times.append(time.perf_counter() - start)
+    print(f'  {label:45} median {statistics.median(times) * 1000:8.3f} ms (n={runs})')
+
+def run(link: DatabaseLink, first_user: int) -> None:
+    plan = link.cursor.execute('EXPLAIN QUERY PLAN SELECT * FROM files WHERE "uploader"=?', ('user1',)).fetchall()
+    print(f'  plan: {" | ".join(row[3] for row in plan)}')
+    timeit('get_all_user_files', lambda i: link.get_all_user_files(f'user{i}'), 20)
+    timeit('get_all_user_files (public only)', lambda i: link.get_all_user_files(f'user{i}', True), 20)
+    timeit('count_public_files', lambda i: link.count_public_files(f'user{i}'), 20)
+    timeit('count_public_files_by_users (20 users)', lambda i: link.count_public_files_by_users([f'user{i * 20 + j}' for j in range(20)]), 5)
+    timeit('remove_user', lambda i: link.remove_user(f'user{first_user + i}'), 5)
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    with tempfile.TemporaryDirectory() as folder:
+        os.mkdir(os.path.join(folder, 'data'))
+        database_link.PATH = folder
+        try:
+            print(f'Building {rows} files...')
+            build('bench.db', rows)
+
+            print('Before the migration:')
+            link = DatabaseLink('bench.db', False)
+            run(link, 9000)
+            link.close()
+
+            start = time.perf_counter()
+            link = DatabaseLink('bench.db')
+            print(f'Migration took {time.perf_counter() - start:.2f}s')
+            print('After the migration:')
+            run(link, 9100)
+            link.close()
+        finally:
+            #on platforms with "/" paths the database sits next to the folder (see DatabaseLink), not inside it
+            for suffix in ('', '-wal', '-shm'):
+                path = f'{folder}\\data\\bench.db{suffix}'
+                if os.path.exists(path):
+                    os.remove(path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+'''
+Handshake benchmark: measures the cost of the RSA handshake the server used to make on every connection (signing its key, decrypting the client's symmetric key, and the client's side of it) and runs full handshakes against a server, one after another and from concurrent clients
+
+usage: python benchmarks/bench_handshake.py [handshakes] [concurrent clients]  (300 and 8 by default)
+'''
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import rsa
+
+from harness import ROOT, free_port, quiet, remove_folder, running_server
+
+def rsa_handshake_time(count: int) -> float:
+    '''
+    Times the RSA operations of the old handshake with the repo's keys: the server signs its public key and decrypts the client's symmetric key, the client verifies the signature and encrypts the key
+
+    Returns:
+        [float]: Seconds per handshake
+    '''
+    with open(os.path.join(ROOT, 'privkey.pem'), 'rb') as f:
+        private_key = rsa.PrivateKey.load_pkcs1(f.read())
+    with open(os.path.join(ROOT, 'pubkey.pem'), 'rb') as f:
+        public_pem = f.read()
+    public_key = rsa.PublicKey.load_pkcs1(public_pem)
+
+    start = time.perf_counter()
+    for _ in range(count):
+        signature = rsa.sign(public_pem, private_key, 'SHA-1')
+        rsa.verify(public_pem, signature, public_key)
+        rsa.decrypt(rsa.encrypt(os.urandom(32), public_key), private_key)
+    return (time.perf_counter() - start) / count
+
+def handshakes(port: int, count: int) -> None:
+    from client import Client
+    for _ in range(count):
+        Client(('127.0.0.1', port)).client_socket.close()
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+
+    sys.path.insert(0, os.path.join(ROOT, 'Client'))
+    import client as client_module
+    folder = tempfile.mkdtemp()
+    client_module.PATH = folder
+    client_module.TICKET_PATH = os.path.join(folder, 'no-ticket.json') #every handshake is a full one
+
+    rsa_time = rsa_handshake_time(max(count // 10, 10))
+    print(f'old RSA handshake: {rsa_time * 1000:.2f} ms of RSA per handshake, at most {1 / rsa_time:.0f} handshakes/s on one core')
+
+    port = free_port()
+    try:
+        with running_server(folder, port):
+            with quiet():
+                handshakes(port, 10) #warm up
+                start = time.perf_counter()
+                handshakes(port, count)
+            elapsed = time.perf_counter() - start
+            print(f'X25519 handshake, one client: {count} in {elapsed:.2f}s, {count / elapsed:.0f} handshakes/s')
+
+            threads = [threading.Thread(target=handshakes, args=(port, count // concurrency)) for _ in range(concurrency)]
+            with quiet():
+                start = time.perf_counter()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            elapsed = time.perf_counter() - start
+            total = concurrency * (count // concurrency)
+            print(f'X25519 handshake, {concurrency} clients: {total} in {elapsed:.2f}s, {total / elapsed:.0f} handshakes/s')
+    finally:
+        remove_folder(folder)
+
+if __name__ == '__main__':
+    main()
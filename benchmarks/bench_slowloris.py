@@ -0,0 +1,148 @@
+'''
+Slow client (slowloris) harness: runs a server with short deadlines, attacks it with connections that stall at every stage, and checks that each one gets cut off while a healthy client keeps being served
+
+usage: python benchmarks/bench_slowloris.py [silent connections] [stalled records]  (200 and 20 by default)
+Exits with status 1 if an attack outlived its deadline
+'''
+import multiprocessing
+import os
+import signal
+import socket
+import statistics
+import sys
+import tempfile
+import time
+
+from harness import ROOT, free_port, quiet, remove_folder, running_server
+
+HANDSHAKE_TIMEOUT = 2 #seconds
+REQUEST_TIMEOUT = 2 #seconds
+TRANSFER_CHECK_WINDOW = 4 #seconds
+FILE_SIZE = 16 * 1024 * 1024 #16 MB, more than the socket buffers can absorb
+
+def connect(port: int):
+    from client import Client
+    with quiet():
+        return Client(('127.0.0.1', port))
+
+def signed_up(port: int, username: str):
+    client = connect(port)
+    with quiet():
+        client.send_signup_package(username, 'password')
+    return client
+
+def is_closed(soc: socket.socket) -> bool:
+    '''
+    Whether the server closed the connection (whatever it sent before is discarded)
+    '''
+    soc.setblocking(False)
+    try:
+        while True:
+            if not soc.recv(1 << 20):
+                return True
+    except BlockingIOError:
+        return False
+    except OSError:
+        return True
+
+def never_read(port: int, ready) -> None:
+    '''
+    A client that gets ready for a download and then stops reading (its process is stopped)
+    '''
+    client = signed_up(port, 'hog')
+    with quiet():
+        client.send_download_request('big.bin', 'healthy')
+        request_id = client.accepted_downloads[('big.bin', 'healthy')][0]
+        client.client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        client.send_package({'type': 'download_ready'}, request_id)
+    ready.send(client.client_socket.getsockname()[1])
+    os.kill(os.getpid(), signal.SIGSTOP)
+
+def main():
+    silent_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    stalled_count = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    sys.path.insert(0, os.path.join(ROOT, 'Client'))
+    import client as client_module
+    folder = tempfile.mkdtemp()
+    client_module.PATH = folder
+    client_module.TICKET_PATH = os.path.join(folder, 'no-ticket.json')
+    client_module.Client.save_session_ticket = lambda self, username, ticket: None #every client logs in on its own
+
+    port = free_port()
+    processes = []
+    try:
+        with running_server(folder, port, handshake_timeout=HANDSHAKE_TIMEOUT, request_timeout=REQUEST_TIMEOUT, transfer_check_window=TRANSFER_CHECK_WINDOW) as output:
+
+            healthy = signed_up(port, 'healthy')
+            os.chdir(folder) #the client names an upload by the path it's given
+            upload_path = 'big.bin'
+            with open(upload_path, 'wb') as f:
+                f.write(os.urandom(FILE_SIZE))
+            with quiet():
+                healthy.send_upload_request(upload_path, True)
+                healthy.upload_file(upload_path)
+
+            def latencies(count: int) -> list[float]:
+                times = []
+                with quiet():
+                    for _ in range(count):
+                        start = time.perf_counter()
+                        healthy.send_user_files_request('healthy')
+                        times.append(time.perf_counter() - start)
+                        time.sleep(0.01)
+                return times
+
+            idle = latencies(100)
+
+            #(attack, deadline in seconds, connections)
+            attacks: list[tuple[str, float, list[socket.socket]]] = []
+            attacks.append(('never sends the client hello', HANDSHAKE_TIMEOUT, [socket.create_connection(('127.0.0.1', port)) for _ in range(silent_count)]))
+
+            stalled = [signed_up(port, f'stalled{i}') for i in range(stalled_count)]
+            for client in stalled:
+                client.client_socket.send(b'\x00') #first byte of a record header, the rest never comes
+            attacks.append(('stops in the middle of a record', REQUEST_TIMEOUT, [client.client_socket for client in stalled]))
+
+            holder = signed_up(port, 'holder')
+            with quiet():
+                holder.send_download_request('big.bin', 'healthy')
+            attacks.append(('never gets ready for a download', TRANSFER_CHECK_WINDOW, [holder.client_socket]))
+
+            uploader = signed_up(port, 'uploader')
+            with quiet():
+                uploader.send_upload_request(upload_path, True)
+            attacks.append(('never sends an accepted upload', TRANSFER_CHECK_WINDOW, [uploader.client_socket]))
+
+            if hasattr(signal, 'SIGSTOP'):
+                ready, child_end = multiprocessing.Pipe()
+                hog = multiprocessing.get_context('fork').Process(target=never_read, args=(port, child_end))
+                hog.start()
+                processes.append(hog)
+                hog_port = ready.recv()
+
+            started = time.time()
+            under_attack = latencies(300)
+            #a transfer is measured over a whole window, checked every quarter of a window
+            while time.time() - started < 2 * TRANSFER_CHECK_WINDOW + 2:
+                time.sleep(0.5)
+
+            print(f'healthy client: idle median {statistics.median(idle) * 1000:.2f} ms, under attack median {statistics.median(under_attack) * 1000:.2f} ms p99 {sorted(under_attack)[296] * 1000:.2f} ms')
+            failed = False
+            for name, deadline, sockets in attacks:
+                closed = sum(is_closed(soc) for soc in sockets)
+                failed |= closed < len(sockets)
+                print(f'{name} (deadline {deadline}s): {closed}/{len(sockets)} cut off')
+    finally:
+        for process in processes:
+            process.kill()
+        remove_folder(folder)
+
+    if processes:
+        cut = any(f'{hog_port}) is slower than' in line for line in output)
+        failed |= not cut
+        print(f'stops reading a download: {int(cut)}/1 cut off')
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+'''
+Striped transfer benchmark: uploads and downloads a file over a link with emulated latency, through one connection and split into stripes over extra data connections
+
+The link is a local proxy that delays everything by half the round trip time each way and keeps at most a window of bytes in flight per direction, like a TCP stream whose window can't grow past it
+
+usage: python benchmarks/bench_stripes.py [rtt ms] [window KB] [file MB]  (40, 256 and 64 by default)
+'''
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from harness import ROOT, free_port, quiet, remove_folder, running_server
+
+STREAMS = (1, 4, 8)
+
+def proxy(port: int, target: int, rtt: float, window: int) -> None:
+    '''
+    Forwards connections on "port" to "target", delaying every read by half "rtt" (seconds) and keeping at most "window" bytes in flight per direction
+    '''
+    async def pipe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        loop = asyncio.get_running_loop()
+        room = asyncio.Condition()
+        in_flight = 0
+
+        async def release(size: int):
+            nonlocal in_flight
+            async with room:
+                in_flight -= size
+                room.notify_all()
+
+        def deliver(data: bytes):
+            if not writer.is_closing():
+                writer.write(data)
+            loop.call_later(rtt / 2, lambda: asyncio.ensure_future(release(len(data))))
+
+        while data := await reader.read(65536):
+            async with room:
+                await room.wait_for(lambda: in_flight + len(data) <= window)
+                in_flight += len(data)
+            loop.call_later(rtt / 2, deliver, data)
+
+        await asyncio.sleep(rtt)
+        writer.close()
+
+    async def forward(client_reader: asyncio.StreamReader, client_writer: asyncio.StreamWriter):
+        server_reader, server_writer = await asyncio.open_connection('127.0.0.1', target)
+        await asyncio.gather(pipe(client_reader, server_writer), pipe(server_reader, client_writer), return_exceptions=True)
+
+    async def run():
+        async with await asyncio.start_server(forward, '127.0.0.1', port) as server:
+            await server.serve_forever()
+
+    asyncio.run(run())
+
+def main():
+    rtt = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.04
+    window = int(sys.argv[2]) * 1024 if len(sys.argv) > 2 else 256 * 1024
+    size = int(sys.argv[3]) * 1024 * 1024 if len(sys.argv) > 3 else 64 * 1024 * 1024
+
+    sys.path.insert(0, os.path.join(ROOT, 'Client'))
+    import client as client_module
+    from client import Client
+    folder = tempfile.mkdtemp()
+    client_module.PATH = folder
+    client_module.TICKET_PATH = os.path.join(folder, 'session_ticket.json')
+    os.makedirs(folder + '\\downloads')
+
+    port, proxy_port = free_port(), free_port()
+    link = subprocess.Popen([sys.executable, os.path.realpath(__file__), 'proxy', str(proxy_port), str(port), str(rtt), str(window)])
+    try:
+        with running_server(folder, port):
+            os.chdir(folder) #the client names an upload by the path it's given
+            data = os.urandom(size)
+            print(f'{size // (1024 * 1024)} MB file, {rtt * 1000:g} ms round trip, {window // 1024} KB window per connection')
+
+            with quiet():
+                client = Client(('127.0.0.1', proxy_port))
+                client.send_signup_package('striper', 'password')
+            for streams in STREAMS:
+                file_name = f'file{streams}.bin'
+                with open(file_name, 'wb') as f:
+                    f.write(data)
+
+                with quiet():
+                    data_connections = client.open_data_connections(streams - 1)
+                    start = time.perf_counter()
+                    accepted, response = client.send_upload_request(file_name, True, streams)
+                    uploaded = accepted and client.upload_file(file_name, data_connections)[0]
+                    upload_time = time.perf_counter() - start
+
+                    start = time.perf_counter()
+                    client.send_download_request(file_name, 'striper')
+                    downloaded = client.download_file(file_name, 'striper', data_connections)
+                    download_time = time.perf_counter() - start
+                for connection in data_connections:
+                    connection.client_socket.close()
+
+                with open(os.path.join(folder + '\\downloads', file_name), 'rb') as f:
+                    matches = f.read() == data
+                stripes = len(response['stripes']) if accepted else 0
+                print(f'{streams} connections ({stripes} stripes): upload {size / upload_time / 1e6:.1f} MB/s (ok={uploaded}), download {size / download_time / 1e6:.1f} MB/s (ok={downloaded}, match={matches})')
+    finally:
+        link.kill()
+        remove_folder(folder)
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['proxy']:
+        proxy(int(sys.argv[2]), int(sys.argv[3]), float(sys.argv[4]), int(sys.argv[5]))
+    else:
+        main()
@@ -0,0 +1,88 @@
+'''
+Shared setup of the benchmarks that run a server: the server runs in its own process (this script), with its data in a temporary folder
+
+usage: python benchmarks/harness.py folder port [settings]  (run by running_server)
+'''
+import contextlib
+import glob
+import io
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+def serve(folder: str, port: int, settings: dict) -> None:
+    '''
+    Runs the server on "port", with its data in "folder" and the attributes in "settings" set on it (deadlines for example)
+    '''
+    sys.path.insert(0, os.path.join(ROOT, 'Server'))
+    import database_link
+    import main
+    database_link.PATH = main.PATH = folder
+    main.Server.admin_input = lambda self: None #stopped by the harness
+
+    server = main.Server(port, 'database.db')
+    for name, value in settings.items():
+        setattr(server, name, value)
+    server.handle_clients()
+
+def data_folder(folder: str) -> str:
+    '''
+    Prepares the server's data in "folder", paths are built with "\\" (see DatabaseLink), so elsewhere than on Windows they are file names next to "folder"
+
+    Returns:
+        [str]: The folder
+    '''
+    for sub in ('data', 'data\\encryption_keys', 'data\\files'):
+        os.makedirs(f'{folder}\\{sub}', exist_ok=True)
+    for source, target in (('privkey.pem', 'privatekey.pem'), ('pubkey.pem', 'publickey.pem')):
+        with open(os.path.join(ROOT, source), 'rb') as f, open(f'{folder}\\data\\encryption_keys\\{target}', 'wb') as out:
+            out.write(f.read())
+    return folder
+
+@contextlib.contextmanager
+def running_server(folder: str, port: int, **settings):
+    '''
+    Runs the server (see serve) with its data in "folder" until the block ends, the block starts once the server is listening
+
+    Returns:
+        [list[str]]: The server's output lines, filled as they come
+    '''
+    server = subprocess.Popen([sys.executable, os.path.realpath(__file__), data_folder(folder), str(port), json.dumps(settings)], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    output: list[str] = []
+    listening = threading.Event()
+    def read_output():
+        for line in server.stdout:
+            output.append(line)
+            if line.startswith('Server is listening'):
+                listening.set()
+    threading.Thread(target=read_output, daemon=True).start()
+    try:
+        listening.wait(30)
+        yield output
+    finally:
+        server.terminate()
+        server.wait()
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+def quiet():
+    return contextlib.redirect_stdout(io.StringIO())
+
+def remove_folder(folder: str) -> None:
+    '''
+    Removes "folder" along with the files named after it (see data_folder)
+    '''
+    for path in glob.glob(f'{folder}*'):
+        shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+
+if __name__ == '__main__':
+    serve(sys.argv[1], int(sys.argv[2]), json.loads(sys.argv[3]) if len(sys.argv) > 3 else {})